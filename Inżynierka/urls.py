@@ -4,6 +4,7 @@ from django.conf.urls import include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rental_service.models import *
 from rental_service.views import *
+from rental_service import async_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -11,10 +12,45 @@ urlpatterns = [
     path('dj-rest-auth/registration/', CustomRegisterView.as_view(), name='rest_register'),
     path('api/token', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh', TokenRefreshView.as_view(), name='token_refresh'),
-    path('api/user/<int:pk>/', UserViewSetDetail.as_view(), name='user_detail'),
+    path('api/user/<uuid:pk>/', UserViewSetDetail.as_view(), name='user_detail'),
     path('api/user/', UserViewSetList.as_view(), name='user_list'),
-    path('api/item/<int:pk>/', ItemViewSetDetail.as_view(), name='item_detail'),
+    path('api/item/<uuid:pk>/', ItemViewSetDetail.as_view(), name='item_detail'),
     path('api/item/', ItemViewSetList.as_view(), name='item_list'),
-    path('api/item/<int:pk>/rent/', ItemRentViewSetList.as_view(), name='rent_list'),
+    path('api/item/bulk', ItemBulkViewSet.as_view(), name='item_bulk'),
+    path('api/item/search', ItemSearchViewSetList.as_view(), name='item_search'),
+    path('api/item/available', ItemAvailableViewSetList.as_view(), name='item_available'),
+    path('api/item/<uuid:pk>/rent/', ItemRentViewSetList.as_view(), name='rent_list'),
+    path('api/category/', CategoryViewSetList.as_view(), name='category_list'),
+    path('api/category/tree', CategoryTreeViewSetList.as_view(), name='category_tree'),
+    path('api/category/<uuid:pk>/items/', CategoryItemsViewSetList.as_view(), name='category_items'),
+    path('api/image/<str:variant>/<path:name>', ImageVariantView.as_view(), name='image_variant'),
+    path('api/rental/', RentalViewSetList.as_view(), name='rental_list'),
+    path('api/rental/bulk', RentalBulkViewSet.as_view(), name='rental_bulk'),
+    path('api/rental/bulk/status', RentalTransitionBulkViewSet.as_view(), name='rental_transition_bulk'),
+    path('api/rental/<uuid:pk>/<str:action>', RentalTransitionViewSet.as_view(), name='rental_transition'),
+    path('api/safeconduct/', SafeConductViewSetList.as_view(), name='safeconduct_list'),
+    path('api/safeconduct/<uuid:pk>/document', SafeConductDocumentViewSet.as_view(), name='safeconduct_document'),
+    path('api/document-job/<uuid:pk>/', DocumentJobViewSetDetail.as_view(), name='document_job_detail'),
+    path('api/message/', MessageViewSetList.as_view(), name='message_list'),
+    path('api/conversation/', ConversationViewSetList.as_view(), name='conversation_list'),
+    path('api/conversation/messages/', ConversationMessagesViewSetList.as_view(), name='inbox_messages'),
+    path('api/conversation/<uuid:pk>/messages/', ConversationMessagesViewSetList.as_view(),
+         name='conversation_messages'),
+    path('api/async/item/', async_views.item_list, name='async_item_list'),
+    path('api/async/item/<uuid:pk>/', async_views.item_detail, name='async_item_detail'),
+    path('api/async/item/<uuid:pk>/rent/', async_views.item_rent_list, name='async_rent_list'),
+    path('api/async/category/', async_views.category_list, name='async_category_list'),
+    path('api/async/category/tree', async_views.category_tree_list, name='async_category_tree'),
+    path('api/async/category/<uuid:pk>/items/', async_views.category_items, name='async_category_items'),
+    path('api/async/rental/', async_views.rental_list, name='async_rental_list'),
+    path('api/async/rental/<uuid:pk>/', async_views.rental_detail, name='async_rental_detail'),
+    path('api/sync/', SyncView.as_view(), name='sync'),
+    path('api/export/<str:name>.<str:extension>', ExportView.as_view(), name='export'),
+    path('api/upload/', UploadViewSetList.as_view(), name='upload_list'),
+    path('api/upload/<uuid:pk>/', UploadViewSetDetail.as_view(), name='upload_detail'),
+    path('api/upload/<uuid:pk>/finalize', UploadFinalizeView.as_view(), name='upload_finalize'),
+    path('api/quote/', QuoteView.as_view(), name='quote'),
+    path('api/reports/utilisation/', UtilisationReportView.as_view(), name='utilisation_report'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 
 ]
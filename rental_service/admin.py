@@ -1,9 +1,24 @@
 from django.contrib import admin
 from rental_service.models import *
+
+
+class RentalAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'start_date', 'end_date')
+    list_select_related = ('user', 'item')
+    raw_id_fields = ('user', 'item')
+
+
+class SafeConductAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'created_at')
+    list_select_related = ('rental__user', 'rental__item')
+    raw_id_fields = ('rental',)
+
+
 # Register your models here.
 admin.site.register(User)
-admin.site.register(Rental)
+admin.site.register(Rental, RentalAdmin)
 admin.site.register(Item)
 admin.site.register(Category)
-admin.site.register(SafeConduct)
-
+admin.site.register(PricingRule)
+admin.site.register(SafeConduct, SafeConductAdmin)
+admin.site.register(DocumentJob)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class RentalServiceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rental_service'
+
+    def ready(self):
+        from rental_service import signals
+        from rental_service.metrics import instrument_serializers
+        instrument_serializers()
@@ -0,0 +1,193 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework import exceptions, status
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from rental_service.cache import cache_timeout, get_cache, if_none_match, response_etag
+from rental_service.categories import category_tree, in_subtree
+from rental_service.models import Category, Item, Rental
+from rental_service.pagination import KeysetPagination
+from rental_service.search import filter_items
+from rental_service.serializers import (CategorySerializer, CategoryValuesSerializer, ItemListQuerySerializer,
+                                        ItemRentSerializer, ItemSerializer, RentalSerializer, RentalValuesSerializer,
+                                        eager_load, requested_fields)
+
+# Async variants of the item, category and rental read endpoints, served under
+# /api/async/. Under ASGI a request holds no thread while it waits: it hops to
+# the database thread to authenticate, to check the response cache and for the
+# rows (with everything they prefetch), and is serialized and sent from the
+# event loop.
+#
+# Django 4.0 has no async ORM, so aget()/alist() fall back to sync_to_async,
+# which is what QuerySet.aget() does internally on 4.1+.
+
+
+async def aget(queryset, **kwargs):
+    try:
+        if hasattr(queryset, 'aget'):
+            return await queryset.aget(**kwargs)
+        return await sync_to_async(queryset.get)(**kwargs)
+    except (queryset.model.DoesNotExist, ValidationError):
+        raise NotFound
+
+
+async def alist(queryset):
+    return await sync_to_async(list)(queryset)
+
+
+def get_renderers():
+    # The project's renderers but the browsable API, which needs an APIView.
+    return [renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+            if not issubclass(renderer, BrowsableAPIRenderer)]
+
+
+def render(request, data, status_code=status.HTTP_200_OK, headers=None):
+    renderer = request.accepted_renderer
+    content_type = request.accepted_media_type
+    if renderer.charset:
+        content_type = '%s; charset=%s' % (content_type, renderer.charset)
+    body = renderer.render(data, request.accepted_media_type, {'request': request}) if data is not None else b''
+    response = HttpResponse(body, status=status_code, content_type=content_type, headers=headers)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def negotiate(request):
+    # As APIView.perform_content_negotiation: an unsatisfiable Accept header is
+    # answered with the first renderer.
+    renderers = get_renderers()
+    try:
+        request.accepted_renderer, request.accepted_media_type = \
+            DefaultContentNegotiation().select_renderer(request, renderers)
+    except (Http404, exceptions.NotAcceptable):
+        request.accepted_renderer, request.accepted_media_type = renderers[0], renderers[0].media_type
+        raise
+
+
+def authenticate(request):
+    # Runs the authentication classes, as APIView.initial does. The read
+    # endpoints need no permissions, but a bad token is still a 401.
+    request.user
+
+
+def error_response(request, exc):
+    # Same body as DRF's exception handler: validation errors as they are.
+    if isinstance(exc, Http404):
+        exc = NotFound()
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)) and request.authenticators:
+        headers['WWW-Authenticate'] = request.authenticators[0].authenticate_header(request)
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return render(request, data, exc.status_code, headers)
+
+
+def async_read_view(*tags, timeout=None):
+    """
+    Runs a coroutine returning response data as a GET endpoint: the request
+    goes through the project's authentication classes and renderers (JSON, or
+    MessagePack for Accept: application/msgpack or ?format=msgpack; no
+    browsable API), and with `tags` through the response cache and ETags of
+    cache_response.
+    """
+    def decorator(view):
+        # require_GET and DRF's APIView do not support coroutines on Django 4.0.
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            authenticators = [authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+            request = Request(request, authenticators=authenticators)
+            try:
+                negotiate(request)
+                if request.method not in ('GET', 'HEAD'):
+                    raise exceptions.MethodNotAllowed(request.method)
+                await sync_to_async(authenticate)(request)
+                if not tags:
+                    return render(request, await view(request, *args, **kwargs))
+                etag, key = await sync_to_async(response_etag)(
+                    view.__name__, request, [tag.format(**kwargs) for tag in tags])
+                if if_none_match(request, etag):
+                    return render(request, None, status.HTTP_304_NOT_MODIFIED, {'ETag': etag})
+                data = await sync_to_async(get_cache().get)(key)
+                if data is None:
+                    data = await view(request, *args, **kwargs)
+                    await sync_to_async(get_cache().set)(key, data, cache_timeout(timeout))
+                return render(request, data, headers={'ETag': etag})
+            except (APIException, Http404) as exc:
+                response = error_response(request, exc)
+                if isinstance(exc, exceptions.MethodNotAllowed):
+                    response['Allow'] = 'GET, HEAD'
+                return response
+        return wrapper
+    return decorator
+
+
+async def paginate(request, queryset, serializer_class, paginator=None):
+    paginator = paginator or KeysetPagination()
+    fields = requested_fields(request, serializer_class)
+    queryset = eager_load(queryset, serializer_class, fields, paginator.ordering)
+    serializer_kwargs = {'fields': fields} if fields is not None else {}
+    page = await sync_to_async(paginator.paginate_queryset)(queryset, request)
+    return {
+        'next': paginator.get_next_link(),
+        'results': serializer_class(page, many=True, **serializer_kwargs).data,
+    }
+
+
+async def paginate_items(request, items):
+    query = ItemListQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    paginator = KeysetPagination(ordering=query.validated_data['ordering'])
+    return await paginate(request, filter_items(items, **query.filters), query.serializer_class, paginator)
+
+
+@async_read_view()
+async def item_list(request):
+    return await paginate_items(request, Item.objects.all())
+
+
+@async_read_view('item:{pk}')
+async def item_detail(request, pk):
+    item = await aget(Item.objects.all(), pk=pk)
+    return ItemSerializer(item, fields=requested_fields(request, ItemSerializer)).data
+
+
+@async_read_view('item:{pk}', 'rentals:{pk}')
+async def item_rent_list(request, pk):
+    return ItemRentSerializer(await aget(eager_load(Item.objects.all(), ItemRentSerializer), pk=pk)).data
+
+
+@async_read_view('category')
+async def category_list(request):
+    categories = await alist(CategoryValuesSerializer.values(Category.objects.order_by('path')))
+    return CategoryValuesSerializer(categories, many=True).data
+
+
+@async_read_view('category')
+async def category_tree_list(request):
+    root = request.query_params.get('root')
+    if root is not None:
+        root = await aget(Category.objects.all(), pk=root)
+    return CategorySerializer(await sync_to_async(category_tree)(root=root), many=True).data
+
+
+@async_read_view()
+async def category_items(request, pk):
+    return await paginate_items(request, Item.objects.filter(in_subtree(pk)))
+
+
+@async_read_view()
+async def rental_list(request):
+    return await paginate(request, Rental.objects.all(), RentalValuesSerializer)
+
+
+@async_read_view()
+async def rental_detail(request, pk):
+    rental = await aget(Rental.objects.all(), pk=pk)
+    return RentalSerializer(rental, fields=requested_fields(request, RentalSerializer)).data
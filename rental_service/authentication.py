@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+def get_user_cache():
+    return caches[settings.JWT_USER_CACHE_ALIAS]
+
+
+def user_cache_key(user_id):
+    return 'jwt-user:%s' % user_id
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # The user behind a token is cached for JWT_USER_CACHE_TIMEOUT seconds, so
+    # authenticated requests do not pay a query just to build request.user.
+    # The entry is dropped whenever the user is saved or deleted.
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        cache = get_user_cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(key, user, settings.JWT_USER_CACHE_TIMEOUT)
+        elif not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
@@ -0,0 +1,51 @@
+from django.db.models import Exists, OuterRef
+
+from rental_service.categories import in_subtree
+from rental_service.models import Item, Rental
+
+
+def overlapping_rentals(item, start_date, end_date, exclude=None):
+    # Rental dates are inclusive, so two ranges overlap unless one ends
+    # before the other starts. Served by rental_item_dates_idx. Returned and
+    # cancelled rentals no longer hold their dates.
+    rentals = Rental.objects.filter(item=item, start_date__lte=end_date, end_date__gte=start_date,
+                                    status__in=Rental.ACTIVE)
+    if exclude is not None:
+        rentals = rentals.exclude(pk=exclude.pk)
+    return rentals
+
+
+def available_items(start_date, end_date, category=None):
+    busy = Rental.objects.filter(item=OuterRef('pk'), start_date__lte=end_date, end_date__gte=start_date,
+                                 status__in=Rental.ACTIVE)
+    items = Item.objects.filter(~Exists(busy))
+    if category is not None:
+        items = items.filter(in_subtree(category))
+    return items
+
+
+def find_conflicts(bookings):
+    # bookings: (item_id, start_date, end_date, rental_pk or None) tuples.
+    # Returns the indexes of bookings that overlap an existing rental or an
+    # earlier booking of the same batch, using one query for the whole batch.
+    if not bookings:
+        return set()
+    updated = [pk for _, _, _, pk in bookings if pk is not None]
+    existing = Rental.objects.filter(
+        item__in={item for item, _, _, _ in bookings},
+        start_date__lte=max(end for _, _, end, _ in bookings),
+        end_date__gte=min(start for _, start, _, _ in bookings),
+        status__in=Rental.ACTIVE,
+    ).exclude(pk__in=updated).values_list('item_id', 'start_date', 'end_date')
+    taken = {}
+    for item, start, end in existing:
+        taken.setdefault(item, []).append((start, end))
+
+    conflicts = set()
+    for index, (item, start, end, _) in enumerate(bookings):
+        periods = taken.setdefault(item, [])
+        if any(start <= other_end and end >= other_start for other_start, other_end in periods):
+            conflicts.add(index)
+        else:
+            periods.append((start, end))
+    return conflicts
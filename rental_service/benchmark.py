@@ -0,0 +1,374 @@
+import asyncio
+import contextlib
+import datetime
+import json
+import random
+import re
+import statistics
+import time
+import tracemalloc
+import uuid
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.core.asgi import get_asgi_application
+from django.conf import settings
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import get_resolver, reverse
+from django_seed import Seed
+
+from rental_service import rollups
+from rental_service.models import Category, Conversation, Item, Message, Participant, Rental, SafeConduct, User
+
+BATCH_SIZE = 1000
+PASSWORD = 'benchmark-password'
+
+# Cached responses would be measured as hits with no queries, so the benchmark
+# and explain_queries run with every cache disabled.
+NO_CACHE = {name: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'} for name in settings.CACHES}
+
+# Routes that always need a token: the staff reports and the inbox.
+TOKEN_REQUIRED = {'conversation_list', 'inbox_messages', 'conversation_messages', 'export', 'utilisation_report'}
+
+# Routes that are not benchmarked: they write, so repeated runs would not
+# measure the same data, or they need a file or job created first.
+WRITE_ROUTES = {
+    'rest_register', 'item_bulk', 'rental_bulk', 'rental_transition_bulk', 'rental_transition',
+    'safeconduct_document', 'document_job_detail', 'image_variant', 'upload_list', 'upload_detail',
+    'upload_finalize',
+}
+
+
+def seed(users, categories, depth, items, rentals, messages, seed_value=0):
+    # Values come from django_seed's Faker, rows go in with bulk_create.
+    # bulk_create skips Model.save(), so category paths are computed here.
+    faker = Seed.faker(locale='pl_PL')
+    faker.seed_instance(seed_value)
+    rng = random.Random(seed_value)
+
+    password = make_password(PASSWORD)
+    user_rows = [User(
+        username='%s%d' % (faker.user_name(), index), email=faker.email(), password=password,
+        phone_number=faker.phone_number()[:20], address=faker.street_address()[:100], city=faker.city()[:50],
+        state=faker.region()[:50], zip_code=faker.postcode()[:10], first_name=faker.first_name(),
+        last_name=faker.last_name(),
+    ) for index in range(users)]
+    # The first user is staff, for the export and report endpoints.
+    if user_rows:
+        user_rows[0].is_staff = user_rows[0].is_superuser = True
+    User.objects.bulk_create(user_rows, batch_size=BATCH_SIZE)
+
+    category_rows = []
+    for index in range(categories):
+        parents = [category for category in category_rows if category.depth < depth - 1]
+        parent = rng.choice(parents) if parents and rng.random() < 0.8 else None
+        category = Category(id=uuid.uuid4(), name=faker.word().capitalize(), parent=parent)
+        category.path = (parent.path if parent else '') + category.id.hex + '/'
+        category_rows.append(category)
+    Category.objects.bulk_create(category_rows, batch_size=BATCH_SIZE)
+
+    item_rows = [Item(
+        category=rng.choice(category_rows), name=' '.join(faker.words(3)).capitalize()[:100],
+        description=faker.text(max_nb_chars=500), price=Decimal(rng.randrange(100, 100000)) / 100,
+        image='images/benchmark.png',
+    ) for index in range(items)]
+    Item.objects.bulk_create(item_rows, batch_size=BATCH_SIZE)
+
+    # Back-to-back, non-overlapping rentals per item.
+    next_start = {}
+    rental_rows = []
+    for index in range(rentals):
+        item = rng.choice(item_rows)
+        start_date = next_start.get(item.pk, datetime.date(2022, 1, 1)) + datetime.timedelta(days=rng.randrange(3))
+        end_date = start_date + datetime.timedelta(days=rng.randrange(1, 14))
+        next_start[item.pk] = end_date + datetime.timedelta(days=1)
+        rental_rows.append(Rental(user=rng.choice(user_rows), item=item, start_date=start_date, end_date=end_date,
+                                  status=Rental.RETURNED))
+    Rental.objects.bulk_create(rental_rows, batch_size=BATCH_SIZE)
+    SafeConduct.objects.bulk_create([SafeConduct(rental=rental, document='documents/benchmark.pdf')
+                                     for rental in rental_rows[::10]], batch_size=BATCH_SIZE)
+
+    # Two-person conversations, every tenth one with the staff user, holding
+    # all of the messages.
+    conversation_rows = [Conversation() for index in range(messages // 20 if users > 1 else 0)]
+    Conversation.objects.bulk_create(conversation_rows, batch_size=BATCH_SIZE)
+    participants = {}
+    for index, conversation in enumerate(conversation_rows):
+        first = user_rows[0] if index % 10 == 0 else rng.choice(user_rows)
+        participants[conversation.pk] = [first, rng.choice([user for user in user_rows if user is not first])]
+    Participant.objects.bulk_create([Participant(conversation=conversation, user=user)
+                                     for conversation in conversation_rows for user in participants[conversation.pk]],
+                                    batch_size=BATCH_SIZE)
+
+    message_rows = []
+    for index in range(messages):
+        conversation = rng.choice(conversation_rows) if conversation_rows else None
+        user = rng.choice(participants[conversation.pk]) if conversation else rng.choice(user_rows)
+        message_rows.append(Message(user=user, conversation=conversation, message=faker.sentence()[:500]))
+    Message.objects.bulk_create(message_rows, batch_size=BATCH_SIZE)
+
+    # bulk_create skips the signals that keep the rollups up to date.
+    rollups.rebuild([item.pk for item in item_rows])
+
+
+@contextlib.contextmanager
+def seeded_database(seed_value=0, **volumes):
+    # A throwaway test database, with replicas mirroring it, holding the
+    # seeded dataset for the duration of the block.
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    for alias in settings.DATABASE_REPLICAS:
+        connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        seed(seed_value=seed_value, **volumes)
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def endpoints():
+    # (route name, method, path, body) for every route the benchmark drives,
+    # and a staff user's access token for --authenticated runs and the
+    # TOKEN_REQUIRED routes. WRITE_ROUTES are left out.
+    user = User.objects.filter(is_staff=True).order_by('pk').first()
+    item = Item.objects.order_by('pk').first()
+    category = Category.objects.filter(parent=None).order_by('pk').first()
+    rental = Rental.objects.order_by('pk').first()
+    conversation = Conversation.objects.filter(participant__user=user).order_by('pk').first()
+    if user is None or item is None or category is None or rental is None or conversation is None:
+        return None, []
+    token = Client().post(reverse('token_obtain_pair'), {'username': user.username, 'password': PASSWORD}).json()
+    words = item.name.split()[0]
+    return token['access'], [
+        ('token_obtain_pair', 'post', reverse('token_obtain_pair'), {'username': user.username, 'password': PASSWORD}),
+        ('token_refresh', 'post', reverse('token_refresh'), {'refresh': token['refresh']}),
+        ('user_list', 'get', reverse('user_list'), None),
+        ('user_detail', 'get', reverse('user_detail', args=[user.pk]), None),
+        ('item_list', 'get', reverse('item_list'), None),
+        ('item_list_stream', 'get', reverse('item_list') + '?stream=ndjson', None),
+        ('item_detail', 'get', reverse('item_detail', args=[item.pk]), None),
+        ('item_search', 'get', reverse('item_search') + '?q=%s' % words, None),
+        ('item_available', 'get', reverse('item_available') + '?from=2022-03-01&to=2022-03-07', None),
+        ('rent_list', 'get', reverse('rent_list', args=[item.pk]), None),
+        ('category_list', 'get', reverse('category_list'), None),
+        ('category_tree', 'get', reverse('category_tree'), None),
+        ('category_items', 'get', reverse('category_items', args=[category.pk]), None),
+        ('rental_list', 'get', reverse('rental_list'), None),
+        ('safeconduct_list', 'get', reverse('safeconduct_list'), None),
+        ('message_list', 'get', reverse('message_list'), None),
+        ('async_item_list', 'get', reverse('async_item_list'), None),
+        ('async_item_detail', 'get', reverse('async_item_detail', args=[item.pk]), None),
+        ('async_rent_list', 'get', reverse('async_rent_list', args=[item.pk]), None),
+        ('async_category_list', 'get', reverse('async_category_list'), None),
+        ('async_category_tree', 'get', reverse('async_category_tree'), None),
+        ('async_category_items', 'get', reverse('async_category_items', args=[category.pk]), None),
+        ('async_rental_list', 'get', reverse('async_rental_list'), None),
+        ('async_rental_detail', 'get', reverse('async_rental_detail', args=[rental.pk]), None),
+        ('conversation_list', 'get', reverse('conversation_list'), None),
+        ('inbox_messages', 'get', reverse('inbox_messages'), None),
+        ('conversation_messages', 'get', reverse('conversation_messages', args=[conversation.pk]), None),
+        ('sync', 'get', reverse('sync'), None),
+        ('export', 'get', reverse('export', args=['rentals', 'csv']), None),
+        ('quote', 'post', reverse('quote'),
+         [{'item': str(item.pk), 'start_date': '2022-03-01', 'end_date': '2022-03-14'}]),
+        ('utilisation_report', 'get', reverse('utilisation_report') + '?to=2022-12-31', None),
+        ('metrics', 'get', reverse('metrics'), None),
+    ]
+
+
+def uncovered_routes(covered):
+    names = set()
+    for pattern in get_resolver().url_patterns:
+        name = getattr(pattern, 'name', None)
+        if name:
+            names.add(name)
+    return sorted(names - covered)
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return {'p50': value, 'p95': value, 'p99': value}
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {'p50': cuts[49], 'p95': cuts[94], 'p99': cuts[98]}
+
+
+def call(client, method, path, body):
+    # List bodies (a quote's cart) are sent as JSON, dicts as form data.
+    if isinstance(body, list):
+        response = getattr(client, method)(path, body, content_type='application/json')
+    elif body is not None:
+        response = getattr(client, method)(path, body)
+    else:
+        response = getattr(client, method)(path)
+    if response.streaming:
+        for chunk in response.streaming_content:
+            pass
+    return response
+
+
+def measure_client(method, path, body, iterations, authorization=None):
+    client = Client(**({'HTTP_AUTHORIZATION': authorization} if authorization else {}))
+    call(client, method, path, body)
+
+    with CaptureQueriesContext(connection) as context:
+        response = call(client, method, path, body)
+    queries = len(context.captured_queries)
+
+    tracemalloc.start()
+    call(client, method, path, body)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call(client, method, path, body)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return dict(percentiles(latencies), status=response.status_code, queries=queries,
+                peak_memory_kb=peak_memory // 1024)
+
+
+async def asgi_request(application, method, path, body, authorization=None):
+    path, _, query_string = path.partition('?')
+    payload = b''
+    headers = [(b'host', b'testserver')]
+    if authorization:
+        headers.append((b'authorization', authorization.encode('latin-1')))
+    if isinstance(body, list):
+        payload = json.dumps(body).encode('utf-8')
+        headers.append((b'content-type', b'application/json'))
+        headers.append((b'content-length', str(len(payload)).encode('ascii')))
+    elif body is not None:
+        payload = urlencode(body).encode('ascii')
+        headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+        headers.append((b'content-length', str(len(payload)).encode('ascii')))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method.upper(),
+        'scheme': 'http', 'path': path, 'raw_path': path.encode('utf-8'), 'root_path': '',
+        'query_string': query_string.encode('latin-1'), 'headers': headers,
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': payload, 'more_body': False}]
+    done = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.body' and not message.get('more_body'):
+            done.set()
+
+    await application(scope, receive, send)
+
+
+async def load(application, method, path, body, requests, concurrency, authorization=None):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            await asgi_request(application, method, path, body, authorization)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return dict(percentiles(latencies), rps=requests / elapsed if elapsed else 0.0, concurrency=concurrency)
+
+
+def measure_password_hasher(iterations=5):
+    # The token endpoint's cost is dominated by verifying the password hash.
+    hasher = get_hasher()
+    encoded = make_password(PASSWORD)
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        hasher.verify(PASSWORD, encoded)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return dict(percentiles(latencies), algorithm=hasher.algorithm, iterations=getattr(hasher, 'iterations', None))
+
+
+@override_settings(CACHES=NO_CACHE)
+def run(iterations, asgi_requests, concurrency, authenticated=False, log=lambda line: None):
+    application = get_asgi_application()
+    token, selected = endpoints()
+    hasher = measure_password_hasher()
+    log('%s (%s iterations): verify p50 %.2f ms' % (hasher['algorithm'], hasher['iterations'], hasher['p50']))
+    results = {}
+    for name, method, path, body in selected:
+        authorization = 'Bearer %s' % token if authenticated or name in TOKEN_REQUIRED else None
+        result = measure_client(method, path, body, iterations, authorization)
+        if asgi_requests:
+            result['asgi'] = asyncio.run(load(application, method, path, body, asgi_requests, concurrency,
+                                              authorization))
+        results[name] = result
+        log('%-20s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %3d queries  %6d KiB' % (
+            name, result['p50'], result['p95'], result['p99'], result['queries'], result['peak_memory_kb']))
+    return {
+        'endpoints': results,
+        'password_hasher': hasher,
+        # Routes that are neither benchmarked nor in WRITE_ROUTES.
+        'skipped_routes': uncovered_routes({name for name, _, _, _ in selected} | WRITE_ROUTES),
+    }
+
+
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?!.*\b(?:USING|VIRTUAL TABLE)\b)')
+POSTGRESQL_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql)
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    pattern = POSTGRESQL_FULL_SCAN if connection.vendor == 'postgresql' else SQLITE_FULL_SCAN
+    return [match.group(1) for match in (pattern.search(line.strip()) for line in plan) if match]
+
+
+def explain_endpoints():
+    # Yields (route name, sql, plan, fully scanned tables) for every SELECT the
+    # benchmarked endpoints run.
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    token, selected = endpoints()
+    for name, method, path, body in selected:
+        with override_settings(CACHES=NO_CACHE), CaptureQueriesContext(connection) as context:
+            call(Client(HTTP_AUTHORIZATION='Bearer %s' % token), method, path, body)
+        for query in context.captured_queries:
+            if not query['sql'].lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            plan = explain(query['sql'])
+            yield name, query['sql'], plan, full_scans(plan)
+
+
+def compare(baseline, current, threshold, min_delta_ms=1.0):
+    # Regressions beyond `threshold` (a fraction) in p95 latency or peak memory,
+    # and any increase in the number of queries.
+    regressions = []
+    for name, before in baseline['endpoints'].items():
+        after = current['endpoints'].get(name)
+        if after is None:
+            continue
+        if after['p95'] > before['p95'] * (1 + threshold) and after['p95'] - before['p95'] > min_delta_ms:
+            regressions.append('%s: p95 %.2f ms -> %.2f ms' % (name, before['p95'], after['p95']))
+        if after['queries'] > before['queries']:
+            regressions.append('%s: %d -> %d queries' % (name, before['queries'], after['queries']))
+        if after['peak_memory_kb'] > max(before['peak_memory_kb'] * (1 + threshold), before['peak_memory_kb'] + 64):
+            regressions.append('%s: peak memory %d KiB -> %d KiB'
+                               % (name, before['peak_memory_kb'], after['peak_memory_kb']))
+    return regressions
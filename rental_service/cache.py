@@ -0,0 +1,94 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def version_key(tag):
+    return 'response-version:' + tag
+
+
+def get_versions(tags):
+    # Versions are opaque tokens rather than counters, so a version key that was
+    # evicted can never come back with a value an old cached response used.
+    cache = get_cache()
+    keys = [version_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*tags):
+    get_cache().set_many({version_key(tag): uuid.uuid4().hex for tag in tags}, None)
+
+
+def invalidate(*tags):
+    bump(*tags)
+    if connection.in_atomic_block:
+        # A reader may cache the pre-commit rows under the new version in the
+        # meantime, so bump again once the write is visible.
+        transaction.on_commit(lambda: bump(*tags))
+
+
+def if_none_match(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    return '*' in candidates or etag in candidates or 'W/' + etag in candidates
+
+
+def response_etag(name, request, tags):
+    # The ETag and cache key of a response of `name` to `request`, under the
+    # current versions of `tags`. JSON and msgpack bodies of the same data must
+    # not share an ETag.
+    parts = [name, request.path, sorted(request.query_params.lists()), request.accepted_media_type,
+             get_versions(tags)]
+    digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return '"%s"' % digest, 'response:' + digest
+
+
+def cache_timeout(timeout=None):
+    return timeout if timeout is not None else getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def cache_response(*tags, timeout=None):
+    """
+    Cache the data of a successful GET handler under the endpoint, its query
+    parameters, the negotiated media type and the current versions of `tags`.
+    Tags are formatted with the URL kwargs, e.g. 'item:{pk}', and are bumped by
+    the model signals.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            etag, key = response_etag(type(view).__name__, request, [tag.format(**kwargs) for tag in tags])
+            if if_none_match(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            else:
+                cache = get_cache()
+                data = cache.get(key)
+                if data is not None:
+                    response = Response(data, headers={'ETag': etag})
+                else:
+                    response = method(view, request, *args, **kwargs)
+                    if response.status_code == status.HTTP_200_OK and isinstance(response, Response):
+                        cache.set(key, response.data, cache_timeout(timeout))
+                        response['ETag'] = etag
+            patch_vary_headers(response, ['Accept'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,39 @@
+from django.db.models import Q, Subquery
+
+from rental_service.models import Category
+
+
+def link_subtrees(categories, root=None):
+    # Categories must come in `path` order so every parent precedes its children.
+    # Each node gets a `children` list; the top-level nodes are returned.
+    nodes = {}
+    top = []
+    if root is not None:
+        root.children = []
+        nodes[root.id] = root
+    for category in categories:
+        category.children = []
+        nodes[category.id] = category
+        parent = nodes.get(category.parent_id)
+        if parent is None:
+            top.append(category)
+        else:
+            parent.children.append(category)
+    return top
+
+
+def category_tree(root=None):
+    if root is None:
+        return link_subtrees(Category.objects.order_by('path'))
+    link_subtrees(root.descendants(include_self=False).order_by('path'), root=root)
+    return [root]
+
+
+def in_subtree(category, prefix='category__'):
+    # Filter for rows whose category is `category` or any of its descendants,
+    # resolved inside the query itself when only the category id is known.
+    if isinstance(category, Category):
+        path = category.path
+    else:
+        path = Subquery(Category.objects.filter(pk=category).values('path')[:1])
+    return Q(**{prefix + 'path__startswith': path})
@@ -0,0 +1,55 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from rental_service.authentication import CachedJWTAuthentication
+from rental_service.messaging import user_group
+
+
+@database_sync_to_async
+def get_user(raw_token):
+    if not raw_token:
+        return AnonymousUser()
+    authentication = CachedJWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    # Browsers cannot set headers on the WebSocket handshake, so the access
+    # token comes in the query string: /ws/inbox/?token=<access token>.
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        scope = dict(scope, user=await get_user(query.get('token', [None])[0]))
+        return await super().__call__(scope, receive, send)
+
+
+class InboxConsumer(AsyncJsonWebsocketConsumer):
+    # Pushes every new message in the user's conversations. After a reconnect
+    # the client fetches what it missed from /api/conversation/messages/ with
+    # the cursor of the last message it received.
+    group = None
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.group = user_group(user.pk)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.group is not None:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def message_created(self, event):
+        await self.send_json(event['message'])
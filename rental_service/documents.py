@@ -0,0 +1,110 @@
+import datetime
+import hashlib
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import get_template
+from django.utils import timezone
+from wkhtmltopdf.utils import convert_to_pdf
+
+from rental_service.models import DocumentJob, SafeConduct
+
+SAFE_CONDUCT_TEMPLATE = 'rental_service/safe_conduct.html'
+
+
+def document_name(content_hash):
+    # Content-addressed: identical documents share one stored file.
+    return 'documents/sha256/%s/%s.pdf' % (content_hash[:2], content_hash)
+
+
+def enqueue(safe_conduct, template=SAFE_CONDUCT_TEMPLATE):
+    job = safe_conduct.document_jobs.filter(
+        template=template, status__in=[DocumentJob.QUEUED, DocumentJob.RUNNING],
+    ).first()
+    if job is None:
+        job = DocumentJob.objects.create(safe_conduct=safe_conduct, template=template)
+    return job
+
+
+def claimable(now):
+    # Queued jobs, and running ones whose worker has not finished them within
+    # DOCUMENT_JOB_CLAIM_SECONDS and is presumed dead.
+    stale = now - datetime.timedelta(seconds=settings.DOCUMENT_JOB_CLAIM_SECONDS)
+    return Q(status=DocumentJob.QUEUED) | Q(status=DocumentJob.RUNNING, updated_at__lt=stale)
+
+
+def claim_batch(batch_size):
+    # Claims up to batch_size claimable jobs sharing the template of the
+    # oldest one. The conditional UPDATE is the lock, so several workers can
+    # poll the same table without a broker.
+    now = timezone.now()
+    oldest = DocumentJob.objects.filter(claimable(now)).order_by('created_at').first()
+    if oldest is None:
+        return []
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        pks = list(DocumentJob.objects.filter(claimable(now), template=oldest.template)
+                   .order_by('created_at').values_list('pk', flat=True)[:batch_size])
+        DocumentJob.objects.filter(claimable(now), pk__in=pks).update(
+            status=DocumentJob.RUNNING, claimed_by=token, updated_at=now,
+        )
+    return list(DocumentJob.objects.filter(claimed_by=token, status=DocumentJob.RUNNING)
+                .select_related('safe_conduct__rental__user', 'safe_conduct__rental__item'))
+
+
+def html_to_pdf(html):
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.html', encoding='utf-8') as page:
+        page.write(html)
+        page.flush()
+        return convert_to_pdf(page.name)
+
+
+def process_batch(jobs, executor):
+    template = get_template(jobs[0].template)
+    pages = {}
+    for job in jobs:
+        rental = job.safe_conduct.rental
+        html = template.render({'safe_conduct': job.safe_conduct, 'rental': rental,
+                                'user': rental.user, 'item': rental.item})
+        job.content_hash = hashlib.sha256(html.encode('utf-8')).hexdigest()
+        pages[job.content_hash] = html
+
+    missing = [content_hash for content_hash in pages if not default_storage.exists(document_name(content_hash))]
+    failures = {}
+    futures = {content_hash: executor.submit(html_to_pdf, pages[content_hash]) for content_hash in missing}
+    for content_hash, future in futures.items():
+        try:
+            pdf = future.result()
+        except Exception as exc:
+            failures[content_hash] = str(exc) or exc.__class__.__name__
+            continue
+        if not default_storage.exists(document_name(content_hash)):
+            default_storage.save(document_name(content_hash), ContentFile(pdf))
+
+    now = timezone.now()
+    for job in jobs:
+        job.updated_at = now
+        if job.content_hash in failures:
+            job.status = DocumentJob.FAILED
+            job.error = failures[job.content_hash]
+            continue
+        job.status = DocumentJob.DONE
+        job.safe_conduct.document.name = document_name(job.content_hash)
+        job.safe_conduct.updated_at = now
+    with transaction.atomic():
+        # Jobs taken over by another worker after this one was presumed dead
+        # are left to that worker.
+        claimed = set(DocumentJob.objects.select_for_update().filter(
+            pk__in=[job.pk for job in jobs], claimed_by=jobs[0].claimed_by, status=DocumentJob.RUNNING,
+        ).values_list('pk', flat=True))
+        jobs = [job for job in jobs if job.pk in claimed]
+        SafeConduct.objects.bulk_update([job.safe_conduct for job in jobs if job.status == DocumentJob.DONE],
+                                        ['document', 'updated_at'])
+        DocumentJob.objects.bulk_update(jobs, ['status', 'content_hash', 'error', 'updated_at'])
+    return jobs
+
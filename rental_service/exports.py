@@ -0,0 +1,187 @@
+import csv
+import datetime
+import io
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from rental_service.models import Item, Rental, User
+
+# Flat exports of rentals, items and users for reporting. Rows are read from a
+# server-side cursor (queryset.iterator) in EXPORT_CHUNK_SIZE batches with the
+# related item, category and user columns joined in the same SELECT, and each
+# batch is encoded and handed on before the next one is read, so memory does
+# not grow with the table.
+#
+# Parquet and Arrow need pyarrow, which is optional.
+
+EXPORTS = {
+    'rentals': (Rental, (
+        'id', 'status', 'start_date', 'end_date', 'user', 'user__username', 'user__email', 'item', 'item__name',
+        'item__price', 'item__category', 'item__category__name', 'created_at', 'updated_at',
+    )),
+    'items': (Item, (
+        'id', 'name', 'description', 'price', 'status', 'image', 'category', 'category__name', 'created_at',
+        'updated_at',
+    )),
+    'users': (User, (
+        'id', 'username', 'email', 'first_name', 'last_name', 'phone_number', 'address', 'city', 'state',
+        'zip_code', 'is_active', 'created_at', 'updated_at',
+    )),
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+def horizon():
+    # Incremental exports stop short of the newest rows, like /api/sync/, so a
+    # row stamped before a slow transaction commits is not skipped by the next
+    # export that starts from this point.
+    return timezone.now() - datetime.timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+
+
+def export_rows(name, since=None, until=None):
+    model, columns = EXPORTS[name]
+    rows = model.objects.order_by()
+    if since is not None:
+        rows = rows.filter(updated_at__gt=since)
+    if until is not None:
+        rows = rows.filter(updated_at__lte=until)
+    return rows.values_list(*columns).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == settings.EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def column_field(model, lookup):
+    for part in lookup.split('__'):
+        field = model._meta.get_field(part)
+        if field.is_relation:
+            model = field.related_model
+            field = model._meta.pk
+    return field
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(name, rows):
+    _, columns = EXPORTS[name]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in chunks(rows):
+        writer.writerows([csv_value(value) for value in row] for row in chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def arrow_schema(pa, name):
+    model, columns = EXPORTS[name]
+    fields = []
+    for column in columns:
+        field = column_field(model, column)
+        if isinstance(field, models.DecimalField):
+            arrow_type = pa.decimal128(field.max_digits, field.decimal_places)
+        elif isinstance(field, models.DateTimeField):
+            arrow_type = pa.timestamp('us', tz='UTC')
+        elif isinstance(field, models.DateField):
+            arrow_type = pa.date32()
+        elif isinstance(field, models.BooleanField):
+            arrow_type = pa.bool_()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+
+def arrow_batch(pa, schema, chunk):
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in chunk]
+        if pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ChunkSink(io.RawIOBase):
+    # Collects what pyarrow writes so that it can be sent on after every batch.
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def encode_arrow(name, rows, file_format):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportUnavailable('%s exports need pyarrow' % file_format.capitalize())
+    return encode_columnar(pa, pq, name, rows, file_format)
+
+
+def encode_columnar(pa, pq, name, rows, file_format):
+    schema = arrow_schema(pa, name)
+    sink = ChunkSink()
+    if file_format == 'parquet':
+        # One row group per chunk; the footer comes last.
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema)
+    for chunk in chunks(rows):
+        writer.write_batch(arrow_batch(pa, schema, chunk))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def encode(name, file_format, since=None, until=None):
+    # Returns an iterator of bytes. Missing pyarrow is reported before any row
+    # is read.
+    rows = export_rows(name, since, until)
+    if file_format == 'csv':
+        return encode_csv(name, rows)
+    return encode_arrow(name, rows, file_format)
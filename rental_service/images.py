@@ -0,0 +1,67 @@
+import hashlib
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+VARIANT_DIR = 'images/variants/'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_name(source_name, variant):
+    # Keyed by the source file name, so a replaced image gets new variant paths
+    # and the old ones can be cached forever by clients.
+    digest = hashlib.sha1(source_name.encode('utf-8')).hexdigest()[:16]
+    stem = posixpath.splitext(posixpath.basename(source_name))[0]
+    return '%s%s-%s/%s.webp' % (VARIANT_DIR, stem, digest, variant)
+
+
+def render_variant(source_name, variant):
+    width = settings.IMAGE_VARIANTS[variant]
+    with default_storage.open(source_name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.thumbnail((width, width), Image.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        output = BytesIO()
+        image.save(output, 'WEBP', quality=settings.IMAGE_VARIANT_QUALITY, method=4)
+    return output.getvalue()
+
+
+def ensure_variant(source_name, variant):
+    # Variants are only made of originals; a variant of a variant would let
+    # every level of nesting add files.
+    if source_name.startswith(VARIANT_DIR):
+        raise SuspiciousFileOperation('Variants are not made of variants: %s' % source_name)
+    name = variant_name(source_name, variant)
+    if not default_storage.exists(name):
+        content = render_variant(source_name, variant)
+        # Another worker may have written it while this one was rendering.
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(content))
+    return name
+
+
+def generate_variants(source_name):
+    for variant in settings.IMAGE_VARIANTS:
+        ensure_variant(source_name, variant)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image-variants')
+    return _executor
+
+
+def schedule_variants(source_name):
+    return get_executor().submit(generate_variants, source_name)
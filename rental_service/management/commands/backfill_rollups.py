@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from rental_service.models import Item
+from rental_service.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the daily utilisation and revenue rollups from all rentals, in batches of '
+            'ROLLUP_BATCH_SIZE items. Run once after deploying them, or to repair them.')
+
+    def handle(self, *args, **options):
+        item_ids = Item.objects.order_by('pk').values_list('pk', flat=True)
+        rebuild(item_ids, log=self.stdout.write)
+        self.stdout.write('Rollups rebuilt')
@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from rental_service.benchmark import compare, run, seeded_database
+
+VOLUMES = ('users', 'categories', 'depth', 'items', 'rentals', 'messages')
+
+
+def add_volume_arguments(parser, users=1000, categories=200, depth=4, items=20000, rentals=100000, messages=20000):
+    parser.add_argument('--users', type=int, default=users)
+    parser.add_argument('--categories', type=int, default=categories)
+    parser.add_argument('--depth', type=int, default=depth, help='Maximum depth of the category tree.')
+    parser.add_argument('--items', type=int, default=items)
+    parser.add_argument('--rentals', type=int, default=rentals)
+    parser.add_argument('--messages', type=int, default=messages)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database with a large dataset, benchmark the read endpoints '
+            'and write or compare a JSON baseline.')
+
+    def add_arguments(self, parser):
+        add_volume_arguments(parser)
+        parser.add_argument('--iterations', type=int, default=50, help='Test-client requests per endpoint.')
+        parser.add_argument('--asgi-requests', type=int, default=200,
+                            help='Requests per endpoint sent through the ASGI application; 0 to skip.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--authenticated', action='store_true',
+                            help='Send a JWT access token with every request.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='Baseline JSON file; fail on regressions against it.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative growth of p95 latency and peak memory.')
+
+    def handle(self, *args, **options):
+        volumes = {name: options[name] for name in VOLUMES}
+        self.stdout.write('Seeding %s' % ', '.join('%s=%d' % item for item in volumes.items()))
+        with seeded_database(options['seed'], **volumes):
+            results = run(options['iterations'], options['asgi_requests'], options['concurrency'],
+                          authenticated=options['authenticated'], log=self.stdout.write)
+        results['volumes'] = volumes
+        results['authenticated'] = options['authenticated']
+        results['vendor'] = connection.vendor
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline.get('volumes') != volumes:
+                self.stderr.write('Baseline was recorded with %s' % baseline.get('volumes'))
+            regressions = compare(baseline, results, options['threshold'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write('No regressions against %s' % options['compare'])
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rental_service.benchmark import explain_endpoints, seeded_database
+from rental_service.management.commands.benchmark import VOLUMES, add_volume_arguments
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN on every query issued by the API read endpoints against a seeded throwaway '
+            'database and report full table scans.')
+
+    def add_arguments(self, parser):
+        add_volume_arguments(parser, users=500, categories=100, items=5000, rentals=20000, messages=5000)
+        parser.add_argument('--allow-scan', action='append', default=[], metavar='TABLE',
+                            help='Table that may be scanned in full, e.g. a small lookup table.')
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error if any other table is scanned in full.')
+
+    def handle(self, *args, **options):
+        volumes = {name: options[name] for name in VOLUMES}
+        offenders = []
+        with seeded_database(options['seed'], **volumes):
+            for name, sql, plan, scans in explain_endpoints():
+                scans = [table for table in scans if table not in options['allow_scan']]
+                if scans:
+                    offenders.append('%s: %s' % (name, ', '.join(scans)))
+                if scans or options['verbosity'] > 1:
+                    self.stdout.write('%s%s\n  %s\n  %s\n' % (
+                        name, ' (full scan of %s)' % ', '.join(scans) if scans else '', sql, '\n  '.join(plan)))
+        if not offenders:
+            self.stdout.write('No full table scans.')
+        elif options['fail_on_scan']:
+            raise CommandError('Full table scans:\n' + '\n'.join(offenders))
@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from rental_service.exports import EXPORTS, FORMATS, ExportUnavailable, encode, horizon
+
+
+def aware_datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+class Command(BaseCommand):
+    help = ('Stream rentals, items or users as CSV, Parquet or Arrow in constant memory. '
+            'With --since only rows changed after it are exported.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(FORMATS), default='csv', dest='file_format')
+        parser.add_argument('--since', type=aware_datetime,
+                            help='Export rows updated after this ISO timestamp, e.g. the previous --until.')
+        parser.add_argument('--output', '-o', help='File to write; standard output by default.')
+
+    def handle(self, *args, **options):
+        until = horizon()
+        try:
+            content = encode(options['name'], options['file_format'], options['since'], until)
+        except ExportUnavailable as exc:
+            raise CommandError(exc)
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for part in content:
+                output.write(part)
+        finally:
+            if options['output']:
+                output.close()
+        self.stderr.write('Exported rows updated up to %s; continue with --since %s' % (until.isoformat(),
+                                                                                         until.isoformat()))
@@ -0,0 +1,31 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rental_service.documents import claim_batch, process_batch
+
+
+class Command(BaseCommand):
+    help = 'Render queued safe-conduct documents, batching jobs that share a template.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.DOCUMENT_JOB_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=settings.DOCUMENT_WORKERS,
+                            help='Number of wkhtmltopdf processes run in parallel.')
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty.')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='wkhtmltopdf') as executor:
+            while True:
+                jobs = claim_batch(options['batch_size'])
+                if not jobs:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+                process_batch(jobs, executor)
+                failed = sum(job.status == job.FAILED for job in jobs)
+                self.stdout.write('Processed %d %s jobs, %d failed' % (len(jobs), jobs[0].template, failed))
@@ -0,0 +1,17 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rental_service.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = ('Delete tombstones older than SYNC_TOMBSTONE_DAYS. Clients with an older sync cursor '
+            'get 410 Gone and sync from scratch.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=settings.SYNC_TOMBSTONE_DAYS)
+        deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write('Deleted %d tombstones' % deleted)
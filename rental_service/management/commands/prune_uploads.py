@@ -0,0 +1,16 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rental_service.uploads import prune
+
+
+class Command(BaseCommand):
+    help = ('Delete chunked uploads untouched for UPLOAD_EXPIRE_HOURS, with the partial files of the '
+            'unfinished ones.')
+
+    def handle(self, *args, **options):
+        deleted = prune(timezone.now() - datetime.timedelta(hours=settings.UPLOAD_EXPIRE_HOURS))
+        self.stdout.write('Deleted %d uploads' % deleted)
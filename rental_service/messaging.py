@@ -0,0 +1,42 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+
+from rental_service.models import Conversation, Message, Participant
+from rental_service.serializers import ConversationMessageSerializer
+
+
+def user_group(user_id):
+    return 'user.%s' % user_id.hex
+
+
+def publish(user_ids, data):
+    # Fan-out on write: one event per recipient group, so every open socket of
+    # a user gets the message without any client polling.
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    group_send = async_to_sync(layer.group_send)
+    for user_id in user_ids:
+        group_send(user_group(user_id), {'type': 'message.created', 'message': data})
+
+
+@transaction.atomic
+def start_conversation(users):
+    conversation = Conversation.objects.create()
+    now = timezone.now()
+    Participant.objects.bulk_create([Participant(conversation=conversation, user=user, last_message_at=now)
+                                     for user in users])
+    return conversation
+
+
+@transaction.atomic
+def send_message(conversation, user, text):
+    message = Message.objects.create(conversation=conversation, user=user, message=text)
+    participants = Participant.objects.filter(conversation=conversation)
+    participants.update(last_message_at=message.created_at, updated_at=message.created_at)
+    recipients = list(participants.values_list('user_id', flat=True))
+    data = ConversationMessageSerializer(message).data
+    transaction.on_commit(lambda: publish(recipients, data))
+    return message
@@ -0,0 +1,140 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from rest_framework import renderers, serializers
+
+# Histograms are kept per process; with several workers each one exposes its
+# own /metrics and Prometheus adds them up.
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Wall time of the request.', (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)),
+    'http_request_db_duration_seconds': (
+        'Time spent executing SQL.', (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)),
+    'http_request_db_queries': (
+        'Number of SQL queries.', (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)),
+    'http_request_serializer_duration_seconds': (
+        'Time spent in serializer to_representation, including queries it triggers.',
+        (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)),
+    'http_response_size_bytes': (
+        'Size of non-streaming response bodies.', (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+}
+
+lock = threading.Lock()
+histograms = {}
+requests_total = {}
+
+current_request = ContextVar('current_request', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = []
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializing = False
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed once on every connection. Connections are per thread, so the
+    # request is found through the context variable, which also follows async
+    # views into the threads their queries run in.
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.db_time += duration
+        stats.queries.append((duration, sql))
+
+
+def observe(labels, values, status_code):
+    with lock:
+        for name, value in values.items():
+            key = (name, labels)
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+        key = labels + (('status', str(status_code)),)
+        requests_total[key] = requests_total.get(key, 0) + 1
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+def render():
+    with lock:
+        snapshot = [(key, list(histogram.counts), histogram.sum) for key, histogram in histograms.items()]
+        totals = list(requests_total.items())
+    lines = ['# HELP http_requests_total Requests by view, method and status.',
+             '# TYPE http_requests_total counter']
+    lines += ['http_requests_total%s %d' % (format_labels(labels), count) for labels, count in sorted(totals)]
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name]
+        for (metric, labels), counts, total in sorted(snapshot, key=lambda sample: sample[0]):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels, le=bound), cumulative))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels), repr(float(total))))
+            lines.append('%s_count%s %d' % (name, format_labels(labels), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data.encode(self.charset)
+
+
+def timed_representation(to_representation):
+    # Only the outermost serializer is timed; nested and per-row calls run
+    # inside it.
+    def wrapper(self, *args):
+        stats = current_request.get()
+        if stats is None or stats.serializing:
+            return to_representation(self, *args)
+        stats.serializing = True
+        started = time.perf_counter()
+        try:
+            return to_representation(self, *args)
+        finally:
+            stats.serializer_time += time.perf_counter() - started
+            stats.serializing = False
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_serializers():
+    from rental_service.serializers import ValuesSerializer
+
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(serializer_class.to_representation, 'timed', False):
+            serializer_class.to_representation = timed_representation(serializer_class.to_representation)
+    # ValuesSerializer renders a whole page in its data property.
+    if not getattr(ValuesSerializer.data.fget, 'timed', False):
+        ValuesSerializer.data = property(timed_representation(ValuesSerializer.data.fget))
@@ -0,0 +1,111 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from rental_service import metrics
+from rental_service.routers import use_replica
+
+logger = logging.getLogger('rental_service.performance')
+
+
+class PerformanceMiddleware:
+    # Records wall time, SQL count and time, serializer time and response size
+    # per URL name into the histograms served at /metrics, and logs slow
+    # requests together with their slowest queries. Async-capable, so it does
+    # not push async views back onto a thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = metrics.RequestStats()
+        token = metrics.current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = metrics.RequestStats()
+        token = metrics.current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, duration):
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        values = {
+            'http_request_duration_seconds': duration,
+            'http_request_db_duration_seconds': stats.db_time,
+            'http_request_db_queries': len(stats.queries),
+            'http_request_serializer_duration_seconds': stats.serializer_time,
+        }
+        if not response.streaming:
+            values['http_response_size_bytes'] = len(response.content)
+        metrics.observe((('view', view), ('method', request.method)), values, response.status_code)
+
+        if duration * 1000 >= settings.SLOW_REQUEST_MS:
+            slowest = sorted(stats.queries, key=lambda query: query[0], reverse=True)[:settings.SLOW_REQUEST_QUERIES]
+            logger.warning(
+                'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, serializer %.0f ms\n%s',
+                request.method, request.get_full_path(), view, duration * 1000, len(stats.queries),
+                stats.db_time * 1000, stats.serializer_time * 1000,
+                '\n'.join('%8.1f ms  %s' % (query_time * 1000, sql) for query_time, sql in slowest),
+            )
+
+
+class ReplicaMiddleware:
+    # Lets ReplicaRouter send the queries of GET and HEAD requests to a read
+    # replica. Any other request pins its client to the primary for
+    # DATABASE_STICKY_SECONDS through a cookie, so it reads its own writes.
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'db_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def reads_from_replica(self, request):
+        return request.method in ('GET', 'HEAD') and self.cookie_name not in request.COOKIES
+
+    def pin(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(self.cookie_name, '1', max_age=settings.DATABASE_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = use_replica.set(self.reads_from_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = use_replica.set(self.reads_from_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self.pin(request, response)
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['item', 'start_date', 'end_date'], name='rental_item_dates_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0.3 on 2026-10-18 17:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model('rental_service', 'Category')
+    paths = {}
+    level = list(Category.objects.filter(parent__isnull=True))
+    while level:
+        for category in level:
+            category.path = paths.get(category.parent_id, '') + category.id.hex + '/'
+            paths[category.id] = category.path
+        Category.objects.bulk_update(level, ['path'])
+        level = list(Category.objects.filter(parent__in=[category.id for category in level]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0002_rental_item_dates_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1024),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='subcategories', to='rental_service.category'),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.3 on 2026-10-18 17:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0003_category_path'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='safeconduct',
+            name='document',
+            field=models.FileField(blank=True, upload_to='documents/'),
+        ),
+        migrations.CreateModel(
+            name='DocumentJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('template', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[['Queued', 'Queued'], ['Running', 'Running'], ['Done', 'Done'], ['Failed', 'Failed']], default='Queued', max_length=10)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=32)),
+                ('content_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('safe_conduct', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_jobs', to='rental_service.safeconduct')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='documentjob',
+            index=models.Index(fields=['status', 'template', 'created_at'], name='documentjob_queue_idx'),
+        ),
+    ]
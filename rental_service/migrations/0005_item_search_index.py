@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_index(apps, schema_editor):
+    from rental_service.search import install_index
+    install_index(schema_editor.connection)
+
+
+def uninstall_index(apps, schema_editor):
+    from rental_service.search import uninstall_index
+    uninstall_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0004_document_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_index, uninstall_index),
+    ]
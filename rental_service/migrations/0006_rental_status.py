@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0005_item_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rental',
+            name='status',
+            field=models.CharField(choices=[['Reserved', 'Reserved'], ['Rented', 'Rented'], ['Returned', 'Returned'], ['Cancelled', 'Cancelled']], default='Reserved', max_length=10),
+        ),
+    ]
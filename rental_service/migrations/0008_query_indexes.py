@@ -0,0 +1,114 @@
+# Generated by Django 4.0.3 on 2026-10-18 17:42
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+def repair_rows(apps, schema_editor):
+    # Rows that would fail the check constraints added below. They could only
+    # come from bulk writes or the admin before this migration; fix them so
+    # that adding the constraints does not fail on a live database.
+    Category = apps.get_model('rental_service', 'Category')
+    Item = apps.get_model('rental_service', 'Item')
+    Rental = apps.get_model('rental_service', 'Rental')
+
+    # A category that is its own parent becomes a root; its subtree never got
+    # a path (see 0003), so paths are rebuilt below it.
+    level = list(Category.objects.filter(parent=models.F('id')))
+    for category in level:
+        category.parent_id = None
+    Category.objects.bulk_update(level, ['parent'])
+    paths = {}
+    while level:
+        for category in level:
+            category.path = paths.get(category.parent_id, '') + category.id.hex + '/'
+            paths[category.id] = category.path
+        Category.objects.bulk_update(level, ['path'])
+        level = list(Category.objects.filter(parent__in=[category.id for category in level]))
+
+    Item.objects.filter(price__lt=0).update(price=0)
+    Item.objects.exclude(status__in=['Available', 'Rented', 'Reserved']).update(status='Available')
+    # Swapped dates: UPDATE reads the old values on both sides.
+    Rental.objects.filter(end_date__lt=models.F('start_date')).update(
+        start_date=models.F('end_date'), end_date=models.F('start_date'),
+    )
+    Rental.objects.exclude(status__in=['Reserved', 'Rented', 'Returned', 'Cancelled']).update(status='Cancelled')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0007_conversations'),
+    ]
+
+    operations = [
+        migrations.RunPython(repair_rows, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='rental',
+            name='rental_item_dates_idx',
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['created_at', 'id'], name='item_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='item_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['price', 'id'], name='item_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('status', 'Available')), fields=['category', 'price'], name='item_available_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user', 'created_at'], name='message_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['created_at', 'id'], name='message_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('status__in', ['Reserved', 'Rented'])), fields=['item', 'start_date', 'end_date'], name='rental_active_item_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['user', 'start_date', 'end_date'], name='rental_user_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['created_at', 'id'], name='rental_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='safeconduct',
+            index=models.Index(fields=['created_at', 'id'], name='safeconduct_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['created_at', 'id'], name='user_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.CheckConstraint(check=models.Q(('parent', django.db.models.expressions.F('id')), _negated=True), name='category_not_own_parent'),
+        ),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.CheckConstraint(check=models.Q(('price__gte', 0)), name='item_price_non_negative'),
+        ),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.CheckConstraint(check=models.Q(('status__in', ['Available', 'Rented', 'Reserved'])), name='item_status_valid'),
+        ),
+        migrations.AddConstraint(
+            model_name='rental',
+            constraint=models.CheckConstraint(check=models.Q(('end_date__gte', django.db.models.expressions.F('start_date'))), name='rental_dates_ordered'),
+        ),
+        migrations.AddConstraint(
+            model_name='rental',
+            constraint=models.CheckConstraint(check=models.Q(('status__in', ['Reserved', 'Rented', 'Returned', 'Cancelled'])), name='rental_status_valid'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.0.3 on 2026-10-18 17:51
+
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0008_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.UUIDField()),
+                ('owner', models.UUIDField(blank=True, null=True)),
+                ('conversation', models.UUIDField(blank=True, null=True)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['updated_at', 'id'], name='category_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['updated_at', 'id'], name='item_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='message_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'updated_at', 'id'], name='message_conv_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='rental_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'),
+        ),
+    ]
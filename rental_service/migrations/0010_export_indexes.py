@@ -0,0 +1,21 @@
+# Generated by Django 4.0.3 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0009_sync_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['updated_at'], name='rental_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['updated_at'], name='user_updated_idx'),
+        ),
+    ]
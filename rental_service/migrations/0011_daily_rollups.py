@@ -0,0 +1,48 @@
+# Generated by Django 4.0.3 on 2026-10-18 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0010_export_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemDailyStats',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('rentals', models.PositiveIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='item_daily_stats', to='rental_service.category')),
+                ('item', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='daily_stats', to='rental_service.item')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CategoryDailyStats',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('rented_items', models.PositiveIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='rental_service.category')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='itemdailystats',
+            index=models.Index(fields=['category', 'date'], name='itemdailystats_category_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='itemdailystats',
+            constraint=models.UniqueConstraint(fields=('item', 'date'), name='itemdailystats_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorydailystats',
+            constraint=models.UniqueConstraint(fields=('category', 'date'), name='categorydailystats_unique'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.3 on 2026-10-18 18:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0011_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricingRule',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('min_days', models.PositiveIntegerField(default=1)),
+                ('discount', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pricing_rules', to='rental_service.category')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pricingrule',
+            constraint=models.UniqueConstraint(fields=('category', 'min_days'), name='pricingrule_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='pricingrule',
+            constraint=models.CheckConstraint(check=models.Q(('discount__gte', 0), ('discount__lte', 100)), name='pricingrule_discount_percent'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.3 on 2026-10-18 18:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_service', '0012_pricing_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(max_length=30)),
+                ('object_id', models.UUIDField()),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('crc32', models.BigIntegerField(default=0)),
+                ('expected_crc32', models.BigIntegerField(blank=True, null=True)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=32)),
+                ('status', models.CharField(choices=[['Uploading', 'Uploading'], ['Done', 'Done']], default='Uploading', max_length=10)),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['updated_at'], name='upload_updated_idx'),
+        ),
+    ]
@@ -1,5 +1,8 @@
 import uuid as uuid
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 
@@ -18,17 +21,65 @@ class User(AbstractUser):
 
     REQUIRED_FIELDS = ['phone_number', 'address', 'city', 'state', 'zip_code', 'first_name', 'last_name', 'email', 'password']
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='user_created_idx'),
+            models.Index(fields=['updated_at'], name='user_updated_idx'),
+        ]
+
 
 class Category(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     name = models.CharField(max_length=50)
-    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='subcategories')
+    # Materialized path: hex ids of all ancestors and self, each followed by '/'.
+    path = models.CharField(max_length=1024, db_index=True, editable=False, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='category_updated_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=~models.Q(parent=models.F('id')), name='category_not_own_parent'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @property
+    def depth(self):
+        return self.path.count('/') - 1
+
+    def build_path(self):
+        if self.parent_id is None:
+            return self.id.hex + '/'
+        parent_path = self.parent.path
+        if parent_path.startswith(self.path or self.id.hex + '/'):
+            raise ValueError('A category cannot be moved below its own descendant')
+        return parent_path + self.id.hex + '/'
+
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        self.path = self.build_path()
+        super().save(*args, **kwargs)
+        if old_path and old_path != self.path:
+            self.descendants(include_self=False, path=old_path).update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+            )
+
+    def delete(self, *args, **kwargs):
+        if not self.path:
+            return super().delete(*args, **kwargs)
+        return self.descendants().delete()
+
+    def descendants(self, include_self=True, path=None):
+        categories = Category.objects.filter(path__startswith=path or self.path)
+        if not include_self:
+            categories = categories.exclude(pk=self.pk)
+        return categories
+
 
 class Item(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
@@ -37,24 +88,92 @@ class Item(models.Model):
     description = models.CharField(max_length=500)
     price = models.DecimalField(max_digits=6, decimal_places=2)
     image = models.ImageField(upload_to='images/')
-    status = [['Available', 'Available'], ['Rented', 'Rented'], ['Reserved', 'Reserved']]
-    status = models.CharField(max_length=10, choices=status, default='Available')
+    AVAILABLE = 'Available'
+    RENTED = 'Rented'
+    RESERVED = 'Reserved'
+    status = [[AVAILABLE, AVAILABLE], [RENTED, RENTED], [RESERVED, RESERVED]]
+    status = models.CharField(max_length=10, choices=status, default=AVAILABLE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='item_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='item_status_created_idx'),
+            models.Index(fields=['price', 'id'], name='item_price_idx'),
+            models.Index(fields=['updated_at', 'id'], name='item_updated_idx'),
+            # Available items of a category, cheapest first.
+            models.Index(fields=['category', 'price'], condition=models.Q(status='Available'),
+                         name='item_available_price_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(price__gte=0), name='item_price_non_negative'),
+            models.CheckConstraint(check=models.Q(status__in=['Available', 'Rented', 'Reserved']),
+                                   name='item_status_valid'),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class PricingRule(models.Model):
+    # Percentage off rentals of at least min_days days of the items in the
+    # category and its subcategories. The rules of the nearest category that
+    # has any replace those of its ancestors and PRICING_DURATION_DISCOUNTS.
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='pricing_rules')
+    min_days = models.PositiveIntegerField(default=1)
+    discount = models.DecimalField(max_digits=5, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'min_days'], name='pricingrule_unique'),
+            models.CheckConstraint(check=models.Q(discount__gte=0, discount__lte=100),
+                                   name='pricingrule_discount_percent'),
+        ]
+
+    def __str__(self):
+        return '%s: %s%% from %d days' % (self.category, self.discount, self.min_days)
+
+
 class Rental(models.Model):
+    # Reserved -> Rented -> Returned, or Reserved -> Cancelled.
+    RESERVED = 'Reserved'
+    RENTED = 'Rented'
+    RETURNED = 'Returned'
+    CANCELLED = 'Cancelled'
+    ACTIVE = [RESERVED, RENTED]
+    # Rentals that count towards utilisation and revenue.
+    COUNTED = [RESERVED, RENTED, RETURNED]
+    status = [[RESERVED, RESERVED], [RENTED, RENTED], [RETURNED, RETURNED], [CANCELLED, CANCELLED]]
+
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     start_date = models.DateField()
     end_date = models.DateField()
+    status = models.CharField(max_length=10, choices=status, default=RESERVED)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Overlap checks only look at rentals that still hold the item.
+            models.Index(fields=['item', 'start_date', 'end_date'],
+                         condition=models.Q(status__in=['Reserved', 'Rented']), name='rental_active_item_dates_idx'),
+            models.Index(fields=['user', 'start_date', 'end_date'], name='rental_user_dates_idx'),
+            models.Index(fields=['created_at', 'id'], name='rental_created_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='rental_user_updated_idx'),
+            models.Index(fields=['updated_at'], name='rental_updated_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(end_date__gte=models.F('start_date')), name='rental_dates_ordered'),
+            models.CheckConstraint(check=models.Q(status__in=['Reserved', 'Rented', 'Returned', 'Cancelled']),
+                                   name='rental_status_valid'),
+        ]
+
     def __str__(self):
         return self.user.username + ' ' + self.item.name
 
@@ -64,23 +183,193 @@ class SafeConduct(models.Model):
     rental = models.ForeignKey(Rental, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    document = models.FileField(upload_to='documents/')
+    document = models.FileField(upload_to='documents/', blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='safeconduct_created_idx'),
+        ]
 
     def __str__(self):
         return self.rental.user.username + ' ' + self.rental.item.name
 
 
+class DocumentJob(models.Model):
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    DONE = 'Done'
+    FAILED = 'Failed'
+    status = [[QUEUED, QUEUED], [RUNNING, RUNNING], [DONE, DONE], [FAILED, FAILED]]
+
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    safe_conduct = models.ForeignKey(SafeConduct, on_delete=models.CASCADE, related_name='document_jobs')
+    template = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=status, default=QUEUED)
+    claimed_by = models.CharField(max_length=32, blank=True, default='')
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'template', 'created_at'], name='documentjob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.template, self.status)
+
+
+class Upload(models.Model):
+    # A chunked upload of Item.image or SafeConduct.document, see
+    # rental_service.uploads. `offset` bytes have been received so far and
+    # `crc32` is their running checksum.
+    UPLOADING = 'Uploading'
+    DONE = 'Done'
+    status = [[UPLOADING, UPLOADING], [DONE, DONE]]
+
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    target = models.CharField(max_length=30)
+    object_id = models.UUIDField()
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    crc32 = models.BigIntegerField(default=0)
+    expected_crc32 = models.BigIntegerField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=32, blank=True, default='')
+    status = models.CharField(max_length=10, choices=status, default=UPLOADING)
+    # Storage name of the finished file.
+    name = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='upload_updated_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.filename, self.status)
+
+
+class Conversation(models.Model):
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    participants = models.ManyToManyField(User, through='Participant', related_name='conversations')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class Participant(models.Model):
+    # One row per user and conversation. last_message_at is copied from the
+    # conversation on every message, so a user's inbox is one index range scan.
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    last_message_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='participant_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at'], name='participant_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return self.user.username + ' ' + str(self.conversation_id)
+
+
 class Message(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, null=True, blank=True,
+                                     related_name='messages')
     message = models.CharField(max_length=500)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_conversation_idx'),
+            models.Index(fields=['user', 'created_at'], name='message_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='message_created_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='message_user_updated_idx'),
+            models.Index(fields=['conversation', 'updated_at', 'id'], name='message_conv_updated_idx'),
+        ]
+
     def __str__(self):
         return self.user.username + ' ' + self.message
 
 
+class ItemDailyStats(models.Model):
+    # Per item and day: how many counted rentals (any status but Cancelled)
+    # cover the day and the revenue they bring, Item.price per rental day.
+    # Maintained by rental_service.rollups. The item is not a database-level
+    # foreign key, so the rows of a deleted item survive until the rollup
+    # refresh has used them to correct the category totals.
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    item = models.ForeignKey(Item, on_delete=models.DO_NOTHING, db_constraint=False, related_name='daily_stats')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='item_daily_stats')
+    date = models.DateField()
+    rentals = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'date'], name='itemdailystats_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'date'], name='itemdailystats_category_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.item_id, self.date)
+
+
+class CategoryDailyStats(models.Model):
+    # Per category (its own items, not the subtree) and day: items rented and
+    # their revenue, summed from ItemDailyStats.
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    rented_items = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'date'], name='categorydailystats_unique'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.category_id, self.date)
+
+
+class Tombstone(models.Model):
+    # Left behind by every deleted row of a synced model, so /api/sync/ can tell
+    # offline clients what to drop. owner and conversation hold plain ids: they
+    # decide who sees the tombstone and are often deleted in the same cascade.
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    model = models.CharField(max_length=20)
+    object_id = models.UUIDField()
+    owner = models.UUIDField(null=True, blank=True)
+    conversation = models.UUIDField(null=True, blank=True)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.model, self.object_id)
+
+
 class DeliveryMethod(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     name = models.CharField(max_length=50)
@@ -0,0 +1,186 @@
+import base64
+import json
+import tempfile
+from functools import partial
+from itertools import islice
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q, prefetch_related_objects
+from django.http import FileResponse, StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+from rental_service.serializers import eager_load, requested_fields
+
+
+def encode_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+class KeysetPagination:
+    """
+    Keyset (cursor) pagination over a unique, stable ordering.
+
+    The cursor holds the ordering values of the last row of a page, so the
+    next page is a plain indexed range scan instead of an OFFSET.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('created_at', 'id')
+    page_size = 50
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, page_size=None, max_page_size=None, ordering=None):
+        if page_size is not None:
+            self.page_size = page_size
+        if max_page_size is not None:
+            self.max_page_size = max_page_size
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, obj):
+        # Rows are model instances, or dicts for the ValuesSerializer lists.
+        get = obj.__getitem__ if isinstance(obj, dict) else partial(getattr, obj)
+        values = [encode_value(get(field.lstrip('-'))) for field in self.ordering]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def filter_queryset(self, queryset, request):
+        queryset = queryset.order_by(*self.ordering)
+        values = self.decode_cursor(request)
+        if values is None:
+            return queryset
+        return self.after(queryset, values)
+
+    def after(self, queryset, values):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y), with < for the
+        # fields ordered descending ('-price').
+        fields = [field.lstrip('-') for field in self.ordering]
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            equal = {name: value for name, value in zip(fields[:position], values)}
+            lookup = fields[position] + ('__lt' if field.startswith('-') else '__gt')
+            condition |= Q(**equal, **{lookup: values[position]})
+        try:
+            return queryset.filter(condition)
+        except (DjangoValidationError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        rows = list(self.filter_queryset(queryset, request)[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+def streaming_response(request, content, content_type):
+    """
+    Send an iterator of bytes as the response body. Django 4.0's ASGI handler
+    iterates streaming bodies on the event loop, where the queries behind them
+    are not allowed, so under ASGI the body is first written to a temporary
+    file from the view's thread and sent from there. Memory use stays flat
+    either way, but only under WSGI does the first byte go out before the
+    last row is read; under ASGI the time to first byte grows with the body.
+    """
+    if not isinstance(getattr(request, '_request', request), ASGIRequest):
+        return StreamingHttpResponse(content, content_type=content_type)
+    body = tempfile.TemporaryFile()
+    for chunk in content:
+        body.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    body.seek(0)
+    return FileResponse(body, content_type=content_type)
+
+
+def stream_ndjson(request, queryset, serializer_class, chunk_size=500, **serializer_kwargs):
+    """
+    Stream a queryset as newline-delimited JSON, reading rows in chunks from a
+    server-side iterator so memory use does not grow with the table.
+    """
+    def lines():
+        rows = queryset.iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            # iterator() skips prefetch_related, so apply it per chunk.
+            prefetch_related_objects(chunk, *queryset._prefetch_related_lookups)
+            data = serializer_class(chunk, many=True, **serializer_kwargs).data
+            yield ''.join(json.dumps(row, cls=JSONEncoder) + '\n' for row in data)
+
+    return streaming_response(request, lines(), 'application/x-ndjson')
+
+
+class KeysetListMixin:
+    """
+    List endpoints paginated by `pagination_class`, tunable per view through
+    `page_size`, `max_page_size` and `ordering`. `?stream=ndjson` streams the
+    whole (optionally cursor-offset) result set instead of a single page, and
+    `?fields=` selects the fields of serializers that support it.
+    """
+    pagination_class = KeysetPagination
+    page_size = None
+    max_page_size = None
+    ordering = None
+    stream_query_param = 'stream'
+    stream_chunk_size = 500
+
+    def get_paginator(self):
+        return self.pagination_class(
+            page_size=self.page_size,
+            max_page_size=self.max_page_size,
+            ordering=self.ordering,
+        )
+
+    def list_response(self, request, queryset, serializer_class, ordering=None):
+        paginator = self.get_paginator()
+        if ordering is not None:
+            paginator.ordering = tuple(ordering)
+        fields = requested_fields(request, serializer_class)
+        queryset = eager_load(queryset, serializer_class, fields, paginator.ordering)
+        serializer_kwargs = {'fields': fields} if fields is not None else {}
+        if request.query_params.get(self.stream_query_param) == 'ndjson':
+            return stream_ndjson(request, paginator.filter_queryset(queryset, request), serializer_class,
+                                 self.stream_chunk_size, **serializer_kwargs)
+        page = paginator.paginate_queryset(queryset, request)
+        serializer = serializer_class(page, many=True, **serializer_kwargs)
+        return paginator.get_paginated_response(serializer.data)
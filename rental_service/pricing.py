@@ -0,0 +1,67 @@
+import uuid
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from rental_service.models import Item, PricingRule
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal(100)
+
+
+def ancestors(path):
+    # Category ids from the materialized path, nearest (the category itself) first.
+    return [uuid.UUID(segment) for segment in reversed(path.split('/')) if segment]
+
+
+def default_tiers():
+    return sorted((min_days, Decimal(discount)) for min_days, discount in settings.PRICING_DURATION_DISCOUNTS)
+
+
+def load(item_ids):
+    # Two queries for any number of items: the items with their category
+    # paths, then the rules of every category on those paths.
+    items = Item.objects.select_related('category').only('price', 'category__path').in_bulk(item_ids)
+    category_ids = {category_id for item in items.values() for category_id in ancestors(item.category.path)}
+    rules = {}
+    for category_id, min_days, discount in (PricingRule.objects.filter(category__in=category_ids)
+                                            .order_by('min_days').values_list('category', 'min_days', 'discount')):
+        rules.setdefault(category_id, []).append((min_days, discount))
+    return items, rules
+
+
+def tiers_for(item, rules, defaults):
+    for category_id in ancestors(item.category.path):
+        if category_id in rules:
+            return rules[category_id]
+    return defaults
+
+
+def discount_for(tiers, days):
+    discount = Decimal(0)
+    for min_days, tier_discount in tiers:
+        if days >= min_days:
+            discount = tier_discount
+    return discount
+
+
+def quote(lines):
+    # Prices (item, start_date, end_date) lines, both dates included, at the
+    # item's daily price less the duration discount of its category. Unknown
+    # items are reported per line, like a bulk write.
+    items, rules = load({line['item'] for line in lines})
+    errors = [{} if line['item'] in items else {'item': ['Item does not exist.']} for line in lines]
+    if any(errors):
+        raise ValidationError(errors)
+    defaults = default_tiers()
+    quotes = []
+    for line in lines:
+        item = items[line['item']]
+        days = (line['end_date'] - line['start_date']).days + 1
+        subtotal = item.price * days
+        discount = discount_for(tiers_for(item, rules, defaults), days)
+        discount_amount = (subtotal * discount / HUNDRED).quantize(CENT, rounding=ROUND_HALF_UP)
+        quotes.append(dict(line, days=days, price=item.price, subtotal=subtotal, discount=discount,
+                           discount_amount=discount_amount, total=subtotal - discount_amount))
+    return quotes, sum((line['total'] for line in quotes), Decimal('0.00'))
@@ -0,0 +1,30 @@
+import msgpack
+import orjson
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    # Same JSON as DRF's renderer, encoded by orjson. Indented output (the
+    # browsable API, `Accept: application/json; indent=2`) still goes through
+    # the standard renderer.
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    # `Accept: application/msgpack` or ?format=msgpack.
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
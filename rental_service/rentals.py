@@ -0,0 +1,170 @@
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from rental_service.availability import find_conflicts
+from rental_service.cache import invalidate
+from rental_service.models import Item, Rental
+from rental_service.rollups import schedule as schedule_rollups
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The resource was changed by a concurrent request.'
+    default_code = 'conflict'
+
+
+def lock_items(item_ids):
+    # Row locks on the items serialize bookings per item only; requests for
+    # other items proceed in parallel. Locked in pk order to avoid deadlocks.
+    return list(Item.objects.select_for_update().filter(pk__in=item_ids).order_by('pk'))
+
+
+def invalidate_items(item_ids):
+    # For rental writes that send no signals (QuerySet.update() and delete()):
+    # the cached rental lists and details of these items.
+    tags = ['rentals:%s' % item_id for item_id in item_ids] + ['item:%s' % item_id for item_id in item_ids]
+    if tags:
+        invalidate(*tags)
+
+
+def rental_spans(rentals):
+    return [(rental.item_id, rental.start_date, rental.end_date) for rental in rentals]
+
+
+def refresh_item_statuses(item_ids):
+    # Called after every change to the rentals of these items. Writes that
+    # send no signals also schedule the daily rollups of the rentals' days.
+    active = {}
+    for item_id, rental_status in (Rental.objects.filter(item__in=item_ids, status__in=Rental.ACTIVE)
+                                   .values_list('item_id', 'status').distinct()):
+        active.setdefault(item_id, set()).add(rental_status)
+    now = timezone.now()
+    for item in Item.objects.filter(pk__in=item_ids).only('pk', 'status'):
+        statuses = active.get(item.pk, set())
+        if Rental.RENTED in statuses:
+            item_status = Item.RENTED
+        elif Rental.RESERVED in statuses:
+            item_status = Item.RESERVED
+        else:
+            item_status = Item.AVAILABLE
+        if item.status != item_status:
+            item.status = item_status
+            item.updated_at = now
+            item.save(update_fields=['status', 'updated_at'])
+
+
+ACTIONS = {
+    'rent': (Rental.RESERVED, Rental.RENTED),
+    'return': (Rental.RENTED, Rental.RETURNED),
+    'cancel': (Rental.RESERVED, Rental.CANCELLED),
+}
+
+
+def check_bookings(bookings, message="Item is already rented in this period"):
+    if find_conflicts(bookings):
+        raise Conflict(message)
+
+
+@transaction.atomic
+def book(serializer):
+    # Creates or reschedules a rental from a validated RentalSerializer. The
+    # serializer's overlap check ran without locks; it is repeated here while
+    # holding the item row, and a lost race is reported as 409.
+    instance = serializer.instance
+    data = serializer.validated_data
+    item_id = data['item'].pk if 'item' in data else instance.item_id
+    item_ids = {item_id, getattr(instance, 'item_id', item_id)}
+    lock_items(item_ids)
+    check_bookings([(
+        item_id,
+        data.get('start_date', getattr(instance, 'start_date', None)),
+        data.get('end_date', getattr(instance, 'end_date', None)),
+        getattr(instance, 'pk', None),
+    )])
+    rental = serializer.save()
+    refresh_item_statuses(item_ids)
+    return rental
+
+
+def transition(rental, source, target, check=None):
+    with transaction.atomic():
+        lock_items([rental.item_id])
+        if check is not None:
+            check(rental)
+        # Compare-and-set: only one of several concurrent requests can move
+        # the rental out of `source`.
+        updated = Rental.objects.filter(pk=rental.pk, status=source).update(status=target, updated_at=timezone.now())
+        if not updated:
+            raise Conflict('Rental is not %s' % source.lower())
+        invalidate_items([rental.item_id])
+        refresh_item_statuses([rental.item_id])
+        schedule_rollups(spans=rental_spans([rental]))
+    rental.refresh_from_db()
+    return rental
+
+
+def check_not_rented_out(rental):
+    if Rental.objects.filter(item=rental.item_id, status=Rental.RENTED).exclude(pk=rental.pk).exists():
+        raise Conflict('Item is already rented out')
+
+
+def rent(rental):
+    return transition(rental, *ACTIONS['rent'], check=check_not_rented_out)
+
+
+def return_rental(rental):
+    return transition(rental, *ACTIONS['return'])
+
+
+def cancel(rental):
+    return transition(rental, *ACTIONS['cancel'])
+
+
+TRANSITIONS = {
+    'rent': rent,
+    'return': return_rental,
+    'cancel': cancel,
+}
+
+@transaction.atomic
+def bulk_transition(actions):
+    # actions: (rental pk, action name) pairs. Either every transition applies
+    # or none does, with the reasons reported per row.
+    rentals = Rental.objects.in_bulk([pk for pk, _ in actions])
+    item_ids = {rental.item_id for rental in rentals.values()}
+    lock_items(item_ids)
+    current = dict(Rental.objects.filter(pk__in=rentals).values_list('pk', 'status'))
+    rented_out = set(Rental.objects.filter(item__in=item_ids, status=Rental.RENTED).values_list('item_id', flat=True))
+    errors = []
+    groups = {}
+    seen = set()
+    for pk, action in actions:
+        source, target = ACTIONS[action]
+        if pk not in current or pk in seen:
+            errors.append({'id': ['Not found or listed twice.']})
+            continue
+        seen.add(pk)
+        item_id = rentals[pk].item_id
+        if current[pk] != source:
+            errors.append({'non_field_errors': ['Rental is not %s' % source.lower()]})
+            continue
+        if action == 'rent' and item_id in rented_out:
+            errors.append({'non_field_errors': ['Item is already rented out']})
+            continue
+        if action == 'rent':
+            rented_out.add(item_id)
+        elif action == 'return':
+            rented_out.discard(item_id)
+        groups.setdefault((source, target), []).append(pk)
+        errors.append({})
+    if any(errors):
+        raise Conflict(errors)
+    now = timezone.now()
+    for (source, target), pks in groups.items():
+        Rental.objects.filter(pk__in=pks, status=source).update(status=target, updated_at=now)
+    invalidate_items({rentals[pk].item_id for pk in seen})
+    refresh_item_statuses(item_ids)
+    schedule_rollups(spans=rental_spans(rentals[pk] for pk in seen))
+    return len(seen)
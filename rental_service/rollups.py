@@ -0,0 +1,199 @@
+import datetime
+import itertools
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, FilteredRelation, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from rental_service.categories import in_subtree
+from rental_service.models import Category, CategoryDailyStats, Item, ItemDailyStats, Rental
+
+# Daily utilisation and revenue rollups per item (ItemDailyStats) and per
+# category (CategoryDailyStats), so that reports over months of rentals read a
+# few rows per category and day instead of expanding every rental.
+#
+# Every write to a rental schedules the days it was counted on before and
+# after the write; a change to an item's price or category schedules its
+# whole history. Everything scheduled in a transaction is brought up to date
+# once it commits: the item's daily rows of those days are recomputed from
+# the rentals overlapping them and only the rows that differ are replaced,
+# then the category rows of exactly the days that changed are summed again
+# from the item rows. Full recomputes are left to rebuild().
+
+_pending = threading.local()
+
+
+def schedule(item_ids=(), spans=()):
+    # item_ids: items refreshed over their whole history. spans: (item, start,
+    # end) of rentals, refreshed on the days the rental is counted on.
+    if getattr(_pending, 'items', None) is None:
+        _pending.items, _pending.spans = set(), {}
+    _pending.items.update(item_ids)
+    for item_id, start, end in spans:
+        _pending.spans.setdefault(item_id, set()).add(counted_days(start, end))
+    # Runs right away outside of a transaction. Inside one, every call
+    # registers the flush, so that items scheduled after a rolled back
+    # savepoint are not lost; the later flushes find nothing left to do.
+    transaction.on_commit(flush)
+
+
+def flush():
+    item_ids = getattr(_pending, 'items', None)
+    if item_ids or getattr(_pending, 'spans', None):
+        spans = _pending.spans
+        _pending.items, _pending.spans = set(), {}
+        refresh(item_ids, {item_id: days for item_id, days in spans.items() if item_id not in item_ids})
+
+
+def counted_days(start, end):
+    # Rentals are counted for at most RENTAL_MAX_DAYS days, including any
+    # saved before that limit was validated.
+    return start, min(end, start + datetime.timedelta(days=settings.RENTAL_MAX_DAYS - 1))
+
+
+def expand(rentals):
+    # (item, category, price, start, end) rows -> {(item, date): [category, rentals, revenue]}
+    stats = {}
+    for item_id, category_id, price, start, end in rentals:
+        start, end = counted_days(start, end)
+        day = start
+        while day <= end:
+            row = stats.get((item_id, day))
+            if row is None:
+                stats[(item_id, day)] = [category_id, 1, price]
+            else:
+                row[1] += 1
+                row[2] += price
+            day += datetime.timedelta(days=1)
+    return stats
+
+
+def counted_rentals(item_ids):
+    return (Rental.objects.filter(item__in=item_ids, status__in=Rental.COUNTED).order_by()
+            .values_list('item', 'item__category', 'item__price', 'start_date', 'end_date'))
+
+
+def item_rows(stats):
+    for (item_id, date), (category_id, rentals, revenue) in stats.items():
+        yield ItemDailyStats(item_id=item_id, date=date, category_id=category_id, rentals=rentals, revenue=revenue)
+
+
+def insert(model, rows):
+    # bulk_create turns its argument into a list; feed it one batch at a time.
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, settings.ROLLUP_BATCH_SIZE))
+        if not batch:
+            return
+        model.objects.bulk_create(batch)
+
+
+def refresh(item_ids, windows=None):
+    # The whole history of item_ids, then the days of windows, {item: {(start, end)}}.
+    item_ids = sorted(item_ids)
+    for start in range(0, len(item_ids), settings.ROLLUP_BATCH_SIZE):
+        with transaction.atomic():
+            refresh_items(item_ids[start:start + settings.ROLLUP_BATCH_SIZE])
+    windowed = sorted(windows or {})
+    for start in range(0, len(windowed), settings.ROLLUP_BATCH_SIZE):
+        batch = windowed[start:start + settings.ROLLUP_BATCH_SIZE]
+        with transaction.atomic():
+            refresh_items(batch, {item_id: windows[item_id] for item_id in batch})
+
+
+def in_windows(windows, item_id, date):
+    return any(start <= date <= end for start, end in windows[item_id])
+
+
+def refresh_items(item_ids, windows=None):
+    # Same lock order as bookings (see rentals.lock_items).
+    list(Item.objects.select_for_update().filter(pk__in=item_ids).order_by('pk').values_list('pk'))
+    rows = ItemDailyStats.objects.filter(item__in=item_ids)
+    rentals = counted_rentals(item_ids)
+    if windows is not None:
+        # One date range covering every window of the batch; rows and rentals
+        # are read from it, and days outside the windows dropped here.
+        low = min(start for days in windows.values() for start, _ in days)
+        high = max(end for days in windows.values() for _, end in days)
+        rows = rows.filter(date__range=(low, high))
+        rentals = rentals.filter(start_date__range=(low - datetime.timedelta(days=settings.RENTAL_MAX_DAYS - 1), high),
+                                 end_date__gte=low)
+    current = {(row.item_id, row.date): row for row in rows}
+    stats = expand(rentals)
+    if windows is not None:
+        current = {key: row for key, row in current.items() if in_windows(windows, *key)}
+        stats = {key: value for key, value in stats.items() if in_windows(windows, *key)}
+    stale = set()
+    days = {}
+    for key, row in current.items():
+        if stats.get(key) != [row.category_id, row.rentals, row.revenue]:
+            stale.add(row.pk)
+            days.setdefault(row.category_id, set()).add(row.date)
+    fresh = {}
+    for key, value in stats.items():
+        row = current.get(key)
+        if row is None or row.pk in stale:
+            fresh[key] = value
+            days.setdefault(value[0], set()).add(key[1])
+    ItemDailyStats.objects.filter(pk__in=stale).delete()
+    insert(ItemDailyStats, item_rows(fresh))
+    refresh_categories(days)
+
+
+def refresh_categories(days):
+    # {category: dates} -> the category rows of those dates, summed again.
+    # Category rows are locked, in pk order after the items, so refreshes of
+    # different items of one category do not insert the same day twice.
+    list(Category.objects.select_for_update().filter(pk__in=days).order_by('pk').values_list('pk'))
+    for category_id, dates in days.items():
+        dates = sorted(dates)
+        for start in range(0, len(dates), settings.ROLLUP_BATCH_SIZE):
+            batch = dates[start:start + settings.ROLLUP_BATCH_SIZE]
+            CategoryDailyStats.objects.filter(category=category_id, date__in=batch).delete()
+            rows = category_rows(ItemDailyStats.objects.filter(category=category_id, date__in=batch))
+            insert(CategoryDailyStats, rows)
+
+
+def category_rows(item_stats):
+    rows = (item_stats.order_by().values_list('category', 'date')
+            .annotate(rented_items=Count('pk'), revenue=Sum('revenue')))
+    for category_id, date, rented_items, revenue in rows.iterator(chunk_size=settings.ROLLUP_BATCH_SIZE):
+        yield CategoryDailyStats(category_id=category_id, date=date, rented_items=rented_items, revenue=revenue)
+
+
+def rebuild(item_ids, log=None):
+    # Recomputes everything from scratch: item rows in batches of
+    # ROLLUP_BATCH_SIZE items, each expanded from one query over its rentals,
+    # then the category rows from one GROUP BY over the item rows.
+    with transaction.atomic():
+        ItemDailyStats.objects.all().delete()
+        CategoryDailyStats.objects.all().delete()
+        item_ids = list(item_ids)
+        for start in range(0, len(item_ids), settings.ROLLUP_BATCH_SIZE):
+            batch = item_ids[start:start + settings.ROLLUP_BATCH_SIZE]
+            insert(ItemDailyStats, item_rows(expand(counted_rentals(batch))))
+            if log is not None:
+                log('%d/%d items' % (start + len(batch), len(item_ids)))
+        insert(CategoryDailyStats, category_rows(ItemDailyStats.objects.all()))
+
+
+def utilisation(start, end, category=None):
+    # Every category (or every category of a subtree) with its item count and
+    # the rented item-days and revenue between start and end, inclusive, in
+    # one query: the category rows of the period are joined on the
+    # (category, date) index and summed per category.
+    items = (Item.objects.filter(category=OuterRef('pk')).order_by().values('category')
+             .annotate(count=Count('pk')).values('count'))
+    categories = Category.objects.order_by('path')
+    if category is not None:
+        categories = categories.filter(in_subtree(category, prefix=''))
+    return (categories
+            .annotate(period=FilteredRelation('daily_stats', condition=Q(daily_stats__date__range=(start, end))))
+            .values('id', 'name', 'path')
+            .annotate(items=Coalesce(Subquery(items), 0),
+                      rented_item_days=Coalesce(Sum('period__rented_items'), 0),
+                      revenue=Coalesce(Sum('period__revenue'), Decimal(0),
+                                       output_field=DecimalField(max_digits=14, decimal_places=2))))
@@ -0,0 +1,39 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+# Set by ReplicaMiddleware for the duration of a read-only request. Outside of
+# such requests (writes, management commands, signal handlers) every query
+# goes to the primary.
+use_replica = ContextVar('use_replica', default=False)
+
+
+def database_key(alias):
+    settings_dict = connections[alias].settings_dict
+    return settings_dict['NAME'], settings_dict['HOST'], settings_dict['PORT']
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not use_replica.get() or not settings.DATABASE_REPLICAS:
+            return 'default'
+        alias = random.choice(settings.DATABASE_REPLICAS)
+        # A replica alias that points at the primary's own database, as a TEST
+        # MIRROR does under the test runner, is read through the primary's
+        # connection so that rows of an open transaction stay visible.
+        if database_key(alias) == database_key('default'):
+            return 'default'
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas are copies of the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
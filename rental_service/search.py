@@ -0,0 +1,157 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, CharField, Count, Value, When
+
+from rental_service.categories import in_subtree
+from rental_service.models import Category, Item
+
+# Polish letters are folded to ASCII on both the indexed text and the query,
+# so 'lodz' finds 'Łódź'. SQLite's unicode61 tokenizer already strips every
+# diacritic except the stroke of 'ł', so only that one is replaced there.
+POLISH_FOLD = str.maketrans('ąćęłńóśźżĄĆĘŁŃÓŚŹŻ', 'acelnoszzACELNOSZZ')
+SQLITE_DOCUMENT = "replace(replace({0}.name || ' ' || {0}.description, 'ł', 'l'), 'Ł', 'L')"
+POSTGRESQL_DOCUMENT = "translate(lower(name || ' ' || description), 'ąćęłńóśźż', 'acelnoszz')"
+
+SQLITE_TRIGGERS = {
+    'rental_service_item_fts_insert': (
+        "CREATE TRIGGER rental_service_item_fts_insert AFTER INSERT ON rental_service_item BEGIN "
+        "INSERT INTO rental_service_item_fts (rowid, document) VALUES (new.rowid, %s); END"
+        % SQLITE_DOCUMENT.format('new')
+    ),
+    'rental_service_item_fts_delete': (
+        "CREATE TRIGGER rental_service_item_fts_delete AFTER DELETE ON rental_service_item BEGIN "
+        "INSERT INTO rental_service_item_fts (rental_service_item_fts, rowid, document) "
+        "VALUES ('delete', old.rowid, %s); END" % SQLITE_DOCUMENT.format('old')
+    ),
+    'rental_service_item_fts_update': (
+        "CREATE TRIGGER rental_service_item_fts_update AFTER UPDATE OF name, description ON rental_service_item "
+        "BEGIN INSERT INTO rental_service_item_fts (rental_service_item_fts, rowid, document) "
+        "VALUES ('delete', old.rowid, %s); "
+        "INSERT INTO rental_service_item_fts (rowid, document) VALUES (new.rowid, %s); END"
+        % (SQLITE_DOCUMENT.format('old'), SQLITE_DOCUMENT.format('new'))
+    ),
+}
+
+
+def install_index(using):
+    with using.cursor() as cursor:
+        if using.vendor == 'sqlite':
+            # Contentless FTS5 table keyed by the item rowid, kept in sync by triggers.
+            cursor.execute("DROP TABLE IF EXISTS rental_service_item_fts")
+            cursor.execute("CREATE VIRTUAL TABLE rental_service_item_fts USING fts5("
+                           "document, content='', tokenize='unicode61 remove_diacritics 2')")
+            cursor.execute("INSERT INTO rental_service_item_fts (rowid, document) SELECT rowid, %s "
+                           "FROM rental_service_item" % SQLITE_DOCUMENT.format('rental_service_item'))
+            for name, statement in SQLITE_TRIGGERS.items():
+                cursor.execute("DROP TRIGGER IF EXISTS %s" % name)
+                cursor.execute(statement)
+        elif using.vendor == 'postgresql':
+            cursor.execute("ALTER TABLE rental_service_item ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                           "GENERATED ALWAYS AS (to_tsvector('simple', %s)) STORED" % POSTGRESQL_DOCUMENT)
+            cursor.execute("CREATE INDEX IF NOT EXISTS rental_service_item_search_idx "
+                           "ON rental_service_item USING gin (search_vector)")
+
+
+def uninstall_index(using):
+    with using.cursor() as cursor:
+        if using.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute("DROP TRIGGER IF EXISTS %s" % name)
+            cursor.execute("DROP TABLE IF EXISTS rental_service_item_fts")
+        elif using.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS rental_service_item_search_idx")
+            cursor.execute("ALTER TABLE rental_service_item DROP COLUMN IF EXISTS search_vector")
+
+
+def ensure_index(using):
+    # SQLite migrations that rebuild rental_service_item drop its triggers and
+    # renumber its rowids, so the index is rebuilt whenever a trigger is gone.
+    if using.vendor != 'sqlite':
+        return
+    with using.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'rental_service_item'")
+        triggers = {row[0] for row in cursor.fetchall()}
+    if not set(SQLITE_TRIGGERS) <= triggers:
+        install_index(using)
+
+
+def tokenize(query):
+    return re.findall(r'\w+', query.translate(POLISH_FOLD).lower())
+
+
+def match(queryset, query):
+    # Every term must match, as a prefix, which stands in for Polish inflection
+    # ('rower' finds 'rowery', 'rowerem').
+    terms = tokenize(query)
+    if not terms:
+        return queryset.none()
+    if connection.vendor == 'postgresql':
+        tsquery = ' & '.join('%s:*' % term for term in terms)
+        return queryset.extra(
+            select={'search_rank': "ts_rank(rental_service_item.search_vector, to_tsquery('simple', %s))"},
+            select_params=[tsquery],
+            where=["rental_service_item.search_vector @@ to_tsquery('simple', %s)"],
+            params=[tsquery],
+            order_by=['-search_rank'],
+        )
+    fts_query = ' '.join('"%s"*' % term for term in terms)
+    return queryset.extra(
+        select={'search_rank': 'rental_service_item_fts.rank'},
+        tables=['rental_service_item_fts'],
+        where=['rental_service_item_fts.rowid = rental_service_item.rowid',
+               'rental_service_item_fts MATCH %s'],
+        params=[fts_query],
+        order_by=['search_rank'],
+    )
+
+
+def price_bucket():
+    bounds = settings.SEARCH_PRICE_BUCKETS
+    whens = [When(price__lt=upper, then=Value('%s-%s' % (lower, upper))) for lower, upper in zip(bounds, bounds[1:])]
+    return Case(*whens, default=Value('%s+' % bounds[-1]), output_field=CharField())
+
+
+def category_facets(queryset, category=None):
+    # Counts per child of `category` (or per root), each including its whole
+    # subtree, rolled up from one GROUP BY over the matching items.
+    depth = category.depth + 1 if category is not None else 0
+    counts = {}
+    rows = queryset.order_by().values_list('category__path').annotate(count=Count('pk'))
+    for path, count in rows:
+        segments = path.split('/')
+        if len(segments) > depth + 1:
+            counts[segments[depth]] = counts.get(segments[depth], 0) + count
+    names = dict(Category.objects.filter(id__in=counts).values_list('id', 'name'))
+    return [{'id': pk, 'name': name, 'count': counts[pk.hex]} for pk, name in names.items()]
+
+
+def facets(queryset, category=None):
+    queryset = queryset.order_by()
+    return {
+        'category': category_facets(queryset, category),
+        'status': dict(queryset.values_list('status').annotate(count=Count('pk'))),
+        'price': dict(queryset.annotate(bucket=price_bucket()).values_list('bucket').annotate(count=Count('pk'))),
+    }
+
+
+def filter_items(items, category=None, status=None, price_min=None, price_max=None, created_after=None,
+                 created_before=None):
+    if category is not None:
+        items = items.filter(in_subtree(category))
+    if status:
+        items = items.filter(status=status)
+    if price_min is not None:
+        items = items.filter(price__gte=price_min)
+    if price_max is not None:
+        items = items.filter(price__lte=price_max)
+    if created_after is not None:
+        items = items.filter(created_at__gte=created_after)
+    if created_before is not None:
+        items = items.filter(created_at__lt=created_before)
+    return items
+
+
+def search_items(query, **filters):
+    return filter_items(match(Item.objects.all(), query), **filters)
@@ -1,9 +1,92 @@
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.urls import reverse
+from django.utils.http import RFC3986_SUBDELIMS
+from django.utils import timezone
 from dj_rest_auth.registration.serializers import RegisterSerializer
 from rest_framework import serializers
-from rest_framework_recursive.fields import RecursiveField
 
 from rental_service.models import *
-import re
+from rental_service.availability import find_conflicts, overlapping_rentals
+from rental_service.categories import category_tree
+from rental_service.rentals import ACTIONS, check_bookings, lock_items, refresh_item_statuses, rental_spans
+from rental_service.rollups import schedule as schedule_rollups
+from rental_service.uploads import TARGETS
+
+
+def eager_load(queryset, serializer_class, fields=None, ordering=()):
+    # Serializers that follow relations declare their loading plan as
+    # Meta.select_related / Meta.prefetch_related, so that rendering a list
+    # costs a constant number of queries whatever its length. Meta.only limits
+    # the columns read to the ones the serializer (and the paginator) use; a
+    # sparse fieldset narrows them further.
+    if issubclass(serializer_class, ValuesSerializer):
+        return serializer_class.values(queryset, fields, ordering)
+    meta = getattr(serializer_class, 'Meta', None)
+    select_related = getattr(meta, 'select_related', ())
+    prefetch_related = getattr(meta, 'prefetch_related', ())
+    only = getattr(meta, 'only', ())
+    if fields is not None:
+        only = sparse_columns(serializer_class, fields)
+    if only:
+        ordering = [field.lstrip('-') for field in ordering]
+        queryset = queryset.only(*only, *ordering, *{name.split('__')[0] for name in select_related})
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+def requested_fields(request, serializer_class):
+    # ?fields=id,name,price for serializers that support sparse fieldsets.
+    value = request.query_params.get('fields')
+    if not value or not issubclass(serializer_class, (SparseFieldsetMixin, ValuesSerializer)):
+        return None
+    fields = [name for name in value.split(',') if name]
+    check_fields(fields, serializer_class().fields)
+    return fields
+
+
+def check_fields(fields, declared):
+    unknown = set(fields) - set(declared)
+    if unknown:
+        raise serializers.ValidationError({'fields': ['Unknown fields: %s' % ', '.join(sorted(unknown))]})
+
+
+def sparse_columns(serializer_class, fields, declared=None):
+    # Model columns behind the serialized `fields`. Method fields name theirs
+    # in Meta.field_sources.
+    meta = serializer_class.Meta
+    if declared is None:
+        declared = serializer_class().fields
+    field_sources = getattr(meta, 'field_sources', {})
+    columns = {meta.model._meta.pk.name}
+    for name in fields:
+        for source in field_sources.get(name, (declared[name].source.split('.')[0],)):
+            try:
+                field = meta.model._meta.get_field(source)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete and not field.many_to_many:
+                columns.add(source)
+    return tuple(columns)
+
+
+class SparseFieldsetMixin:
+    # Serializes only the fields passed as `fields`, e.g. from ?fields=.
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            return
+        check_fields(fields, self.fields)
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+
 
 class CustomRegisterSerializer(RegisterSerializer):
     phone_number = serializers.CharField(required=True, write_only=True, max_length=10)
@@ -73,30 +156,391 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class CategorySerializer(serializers.ModelSerializer):
-    parentCategory = serializers.PrimaryKeyRelatedField(read_only=True)
-    subcategories = serializers.ListSerializer(child=RecursiveField())
+    parentCategory = serializers.PrimaryKeyRelatedField(source='parent', read_only=True)
+    parent = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), required=False, allow_null=True,
+                                                write_only=True)
+    subcategories = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
-        fields = ('parentCategory', 'id', 'name', 'subcategories')
+        fields = ('parentCategory', 'parent', 'id', 'name', 'subcategories')
+
+    def get_subcategories(self, obj):
+        if not hasattr(obj, 'children'):
+            category_tree(root=obj)
+        return CategorySerializer(obj.children, many=True, context=self.context).data
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    # Inside a BulkListSerializer the related rows of the whole batch are
+    # loaded up front, so each row is a dict lookup instead of a query.
 
+    def to_internal_value(self, data):
+        preloaded = getattr(self.root, 'preloaded', {}).get(self.field_name)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        try:
+            return preloaded[self.get_queryset().model._meta.pk.to_python(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    batch_size = 1000
+
+    def to_internal_value(self, data):
+        self.preload(data)
+        value = super().to_internal_value(data)
+        self.validate_batch(value)
+        return value
+
+    def preload(self, data):
+        self.preloaded = {}
+        if not isinstance(data, list):
+            return
+        for name, field in self.child.fields.items():
+            if field.read_only or not isinstance(field, PreloadedPrimaryKeyRelatedField):
+                continue
+            pk_field = field.get_queryset().model._meta.pk
+            pks = set()
+            for row in data:
+                try:
+                    pks.add(pk_field.to_python(row[name]))
+                except (KeyError, TypeError, ValueError, DjangoValidationError):
+                    pass
+            self.preloaded[name] = field.get_queryset().in_bulk(pks)
+
+    def validate_batch(self, rows):
+        pass
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        instances = [model(**attrs) for attrs in validated_data]
+        return model.objects.bulk_create(instances, batch_size=self.batch_size)
+
+    def update(self, instances, validated_data):
+        # bulk_update skips auto_now, so updated_at is set here.
+        now = timezone.now()
+        fields = {'updated_at'}
+        for instance, attrs in zip(instances, validated_data):
+            for attr, value in attrs.items():
+                setattr(instance, attr, value)
+            instance.updated_at = now
+            fields.update(attrs)
+        self.child.Meta.model.objects.bulk_update(instances, fields, batch_size=self.batch_size)
+        return instances
+
+
+class ItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+    image_variants = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
-class ItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = Item
-        fields = ('id', 'name', 'description', 'price', 'image', 'category')
-
+        fields = ('id', 'name', 'description', 'price', 'image', 'image_variants', 'image_srcset', 'category',
+                  'status')
+        field_sources = {'image_variants': ('image',), 'image_srcset': ('image',)}
+        # Changed only by the rental workflow in rental_service.rentals.
+        read_only_fields = ('status',)
+        list_serializer_class = BulkListSerializer
+
+    def variant_url(self, obj, variant):
+        url = reverse('image_variant', args=[variant, obj.image.name])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_image_variants(self, obj):
+        if not obj.image:
+            return {}
+        return {variant: self.variant_url(obj, variant) for variant in settings.IMAGE_VARIANTS}
+
+    def get_image_srcset(self, obj):
+        if not obj.image:
+            return ''
+        return ', '.join('%s %dw' % (self.variant_url(obj, variant), width)
+                         for variant, width in settings.IMAGE_VARIANTS.items())
+
+
+class ItemGridSerializer(ItemSerializer):
+    # Item cards of the grid views: everything but the description.
+
+    class Meta(ItemSerializer.Meta):
+        fields = ('id', 'name', 'price', 'image', 'image_variants', 'image_srcset', 'category', 'status')
+        only = ('id', 'name', 'price', 'image', 'category', 'status', 'created_at')
+
+
+class ItemBulkSerializer(ItemSerializer):
+    # Batch imports refer to images already in storage by name.
+    image = serializers.CharField(max_length=100, required=False)
+
+
+def date_range_error(start_date, end_date):
+    # Rentals are limited to RENTAL_MAX_DAYS, both dates included; the daily
+    # rollups hold a row per rented day.
+    if start_date > end_date:
+        return "End date must not be before start date"
+    if (end_date - start_date).days >= settings.RENTAL_MAX_DAYS:
+        return "Rentals may last at most %d days" % settings.RENTAL_MAX_DAYS
+    return None
+
+
+class RentalListSerializer(BulkListSerializer):
+
+    def validate_batch(self, rows):
+        instances = self.instance or [None] * len(rows)
+        bookings = []
+        errors = [{} for _ in rows]
+        for index, (instance, row) in enumerate(zip(instances, rows)):
+            item = row['item'].pk if 'item' in row else instance.item_id
+            start_date = row.get('start_date', getattr(instance, 'start_date', None))
+            end_date = row.get('end_date', getattr(instance, 'end_date', None))
+            error = date_range_error(start_date, end_date)
+            if error:
+                errors[index] = {'non_field_errors': [error]}
+            bookings.append((item, start_date, end_date, getattr(instance, 'pk', None)))
+        for index in find_conflicts(bookings):
+            errors[index] = errors[index] or {'non_field_errors': ["Item is already rented in this period"]}
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        self.bookings = bookings
+
+    def lock_items(self):
+        # Same check as above, repeated while holding the item rows.
+        item_ids = {item for item, _, _, _ in self.bookings}
+        item_ids.update(instance.item_id for instance in self.instance or [])
+        lock_items(item_ids)
+        check_bookings(self.bookings)
+        return item_ids
+
+    # bulk_create and bulk_update send no signals; the rollups of the rentals'
+    # days, before and after the write, are scheduled here.
+
+    def create(self, validated_data):
+        item_ids = self.lock_items()
+        rentals = super().create(validated_data)
+        refresh_item_statuses(item_ids)
+        schedule_rollups(spans=rental_spans(rentals))
+        return rentals
+
+    def update(self, instances, validated_data):
+        item_ids = self.lock_items()
+        spans = rental_spans(instances)
+        rentals = super().update(instances, validated_data)
+        refresh_item_statuses(item_ids)
+        schedule_rollups(spans=spans + rental_spans(rentals))
+        return rentals
+
+
+class RentalSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
 
-class RentalSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rental
         fields = ('id', 'user', 'item', 'start_date', 'end_date', 'status')
+        read_only_fields = ('status',)
+        list_serializer_class = RentalListSerializer
+
+    def validate(self, data):
+        if isinstance(self.parent, serializers.ListSerializer):
+            # Checked for the whole batch by RentalListSerializer.
+            return data
+        item = data.get('item', getattr(self.instance, 'item', None))
+        start_date = data.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = data.get('end_date', getattr(self.instance, 'end_date', None))
+        error = date_range_error(start_date, end_date)
+        if error:
+            raise serializers.ValidationError(error)
+        if overlapping_rentals(item, start_date, end_date, exclude=self.instance).exists():
+            raise serializers.ValidationError("Item is already rented in this period")
+        return data
+
+
+class RentalTransitionSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    action = serializers.ChoiceField(choices=list(ACTIONS))
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+
+
+class QuoteLineSerializer(serializers.Serializer):
+    # The item is a plain UUID so that a cart is validated without a query
+    # per line; pricing.quote loads all items at once.
+    item = serializers.UUIDField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    days = serializers.IntegerField(read_only=True)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, read_only=True)
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    discount = serializers.DecimalField(max_digits=5, decimal_places=2, read_only=True)
+    discount_amount = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    def validate(self, data):
+        error = date_range_error(data['start_date'], data['end_date'])
+        if error:
+            raise serializers.ValidationError(error)
+        return data
+
+
+class CRC32Field(serializers.CharField):
+    # CRC-32 as 8 hex digits, as zlib.crc32 and `crc32` compute it.
+    default_error_messages = {'invalid': 'Expected 8 hexadecimal digits.'}
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if not re.fullmatch(r'[0-9a-fA-F]{8}', value):
+            self.fail('invalid')
+        return int(value, 16)
+
+    def to_representation(self, value):
+        return '%08x' % value
+
+
+class UploadStartSerializer(serializers.Serializer):
+    target = serializers.ChoiceField(choices=list(TARGETS))
+    object_id = serializers.UUIDField()
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1, max_value=settings.UPLOAD_MAX_SIZE)
+    # Of the whole file; it can also be given when finalizing.
+    crc32 = CRC32Field(required=False)
+
+
+class UploadFinalizeSerializer(serializers.Serializer):
+    crc32 = CRC32Field(required=False)
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    # `offset` is where a resumed upload continues; `crc32` covers the bytes
+    # received so far.
+    crc32 = CRC32Field(read_only=True)
+
+    class Meta:
+        model = Upload
+        fields = ('id', 'target', 'object_id', 'filename', 'size', 'offset', 'crc32', 'status', 'name')
+        read_only_fields = fields
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    category = serializers.UUIDField(required=False)
+    status = serializers.ChoiceField(choices=Item._meta.get_field('status').choices, required=False)
+    price_min = serializers.DecimalField(max_digits=6, decimal_places=2, required=False)
+    price_max = serializers.DecimalField(max_digits=6, decimal_places=2, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.SEARCH_MAX_RESULTS, default=20)
+    offset = serializers.IntegerField(min_value=0, default=0)
+
+    def validate_category(self, value):
+        try:
+            return Category.objects.get(pk=value)
+        except Category.DoesNotExist:
+            raise serializers.ValidationError("Category does not exist")
+
+
+class ItemListQuerySerializer(serializers.Serializer):
+    # Filters and orderings of the item lists; every ordering is backed by an
+    # index ending in id, so keyset pagination stays a range scan.
+    ORDERINGS = {
+        'created_at': ('created_at', 'id'),
+        '-created_at': ('-created_at', '-id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
+    category = serializers.UUIDField(required=False)
+    status = serializers.ChoiceField(choices=Item._meta.get_field('status').choices, required=False)
+    price_min = serializers.DecimalField(max_digits=6, decimal_places=2, required=False)
+    price_max = serializers.DecimalField(max_digits=6, decimal_places=2, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    ordering = serializers.ChoiceField(choices=list(ORDERINGS), default='created_at')
+    view = serializers.ChoiceField(choices=['full', 'grid'], default='full')
+
+    def validate_ordering(self, value):
+        return self.ORDERINGS[value]
+
+    def validate(self, data):
+        if 'price_min' in data and 'price_max' in data and data['price_min'] > data['price_max']:
+            raise serializers.ValidationError("'price_max' must not be below 'price_min'")
+        return data
+
+    @property
+    def serializer_class(self):
+        return ItemGridValuesSerializer if self.validated_data['view'] == 'grid' else ItemValuesSerializer
+
+    @property
+    def filters(self):
+        return {name: value for name, value in self.validated_data.items() if name not in ('ordering', 'view')}
+
+
+class SyncQuerySerializer(serializers.Serializer):
+    since = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.SYNC_MAX_PAGE_SIZE, required=False)
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False)
+
+
+class UtilisationQuerySerializer(serializers.Serializer):
+    # The period ends today unless `to` is given.
+    days = serializers.IntegerField(min_value=1, max_value=settings.REPORT_MAX_DAYS, default=90)
+    to = serializers.DateField(required=False)
+    category = serializers.UUIDField(required=False)
+
+
+class UtilisationSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    name = serializers.CharField()
+    path = serializers.CharField()
+    items = serializers.IntegerField()
+    rented_item_days = serializers.IntegerField()
+    utilisation = serializers.SerializerMethodField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+    def get_utilisation(self, row):
+        # Share of the category's item-days in the period that were rented.
+        if not row['items']:
+            return 0.0
+        return round(row['rented_item_days'] / (row['items'] * self.context['days']), 4)
+
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    to = serializers.DateField()
+    category = serializers.UUIDField(required=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fields['from'] = serializers.DateField()
+        return fields
+
+    def validate(self, data):
+        if data['from'] > data['to']:
+            raise serializers.ValidationError("'to' must not be before 'from'")
+        return data
 
 
 class SafeConductSerializer(serializers.ModelSerializer):
+    user = serializers.PrimaryKeyRelatedField(source='rental.user', read_only=True)
+    item = serializers.PrimaryKeyRelatedField(source='rental.item', read_only=True)
+
     class Meta:
         model = SafeConduct
-        fields = ('id', 'user','item', 'document')
+        fields = ('id', 'rental', 'user', 'item', 'document')
+        select_related = ('rental',)
+
+
+class DocumentJobSerializer(serializers.ModelSerializer):
+    document = serializers.FileField(source='safe_conduct.document', read_only=True)
+
+    class Meta:
+        model = DocumentJob
+        fields = ('id', 'safe_conduct', 'template', 'status', 'content_hash', 'error', 'document')
+        read_only_fields = fields
+        select_related = ('safe_conduct',)
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -105,26 +549,218 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ('id', 'user', 'message')
 
 
-class UserMessagesSerializer(serializers.ModelSerializer):
-    message = MessageSerializer(many=True)
+class ConversationMessageSerializer(serializers.ModelSerializer):
+    # UUIDs are rendered as strings so the data can go through a channel layer
+    # as is. `cursor` resumes the message stream after this message.
+    user = serializers.PrimaryKeyRelatedField(read_only=True, pk_field=serializers.UUIDField())
+    conversation = serializers.PrimaryKeyRelatedField(read_only=True, pk_field=serializers.UUIDField())
+    cursor = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ('id', 'user', 'message')
+        fields = ('id', 'conversation', 'user', 'message', 'created_at', 'cursor')
+        read_only_fields = ('id', 'created_at')
+
+    def get_cursor(self, obj):
+        from rental_service.pagination import KeysetPagination
+        return KeysetPagination().encode_cursor(obj)
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    participants = serializers.PrimaryKeyRelatedField(many=True, queryset=User.objects.all())
+
+    class Meta:
+        model = Conversation
+        fields = ('id', 'participants', 'created_at')
+        read_only_fields = ('id', 'created_at')
+        prefetch_related = ('participants',)
+
+
+class InboxSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(source='conversation_id', read_only=True)
+    participants = serializers.PrimaryKeyRelatedField(source='conversation.participants', many=True, read_only=True)
+
+    class Meta:
+        model = Participant
+        fields = ('id', 'participants', 'last_message_at')
+        select_related = ('conversation',)
+        prefetch_related = ('conversation__participants',)
+
+
+class UserMessagesSerializer(serializers.ModelSerializer):
+    message = MessageSerializer(source='message_set', many=True, read_only=True)
+
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'message')
+        prefetch_related = ('message_set',)
 
 
 class CategoryItemsSerializer(serializers.ModelSerializer):
-    items = ItemSerializer(many=True)
+    items = ItemSerializer(source='item_set', many=True, read_only=True)
 
     class Meta:
         model = Category
-        fields = ('id', 'name', 'category', 'items')
+        fields = ('id', 'name', 'parent', 'items')
+        prefetch_related = ('item_set',)
 
 
 class ItemRentSerializer(serializers.ModelSerializer):
-    rental = RentalSerializer(many=True)
+    rental = RentalSerializer(source='rental_set', many=True, read_only=True)
 
     class Meta:
         model = Item
         fields = ('id', 'name', 'rental')
-
+        prefetch_related = ('rental_set',)
+
+
+class ValuesSerializer:
+    """
+    Read-only twin of `serializer_class` for list endpoints. It renders rows of
+    queryset.values() straight into dicts with the same field names and
+    formats, skipping model instances and the per-field serializer machinery.
+    Method fields are implemented here as get_<name>(row).
+    """
+    serializer_class = None
+
+    def __init__(self, instance=None, many=False, context=None, fields=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+        self.fields = self.serializer_fields()
+        if fields is not None:
+            check_fields(fields, self.fields)
+            self.fields = {name: field for name, field in self.fields.items() if name in fields}
+
+    @classmethod
+    def serializer_fields(cls):
+        # Built once per class. Only the context-free to_representation of
+        # these fields is used; files and method fields are rendered here.
+        if '_serializer_fields' not in cls.__dict__:
+            cls._serializer_fields = {name: field for name, field in cls.serializer_class().fields.items()
+                                      if not field.write_only}
+        return cls._serializer_fields
+
+    @classmethod
+    def values(cls, queryset, fields=None, ordering=()):
+        declared = cls.serializer_fields()
+        columns = sparse_columns(cls.serializer_class, fields if fields is not None else declared, declared)
+        ordering = [field.lstrip('-') for field in ordering]
+        return queryset.values(*columns, *[field for field in ordering if field not in columns])
+
+    def file_url(self, field):
+        storage = self.serializer_class.Meta.model._meta.get_field(field.source).storage
+        request = self.context.get('request')
+
+        def url(name):
+            if not name:
+                return None
+            return request.build_absolute_uri(storage.url(name)) if request is not None else storage.url(name)
+        return url
+
+    def get_formatters(self):
+        # (name, column, format): format gets the column value, or the whole row
+        # when column is None.
+        formatters = []
+        for name, field in self.fields.items():
+            if isinstance(field, serializers.SerializerMethodField):
+                formatters.append((name, None, getattr(self, 'get_' + name)))
+            elif isinstance(field, serializers.RelatedField):
+                pk_field = getattr(field, 'pk_field', None)
+                formatters.append((name, field.source, pk_field.to_representation if pk_field else lambda pk: pk))
+            elif isinstance(field, serializers.FileField):
+                formatters.append((name, field.source, self.file_url(field)))
+            else:
+                formatters.append((name, field.source, field.to_representation))
+        return formatters
+
+    def to_representation(self, row, formatters):
+        data = {}
+        for name, column, format in formatters:
+            if column is None:
+                data[name] = format(row)
+            else:
+                value = row[column]
+                data[name] = None if value is None else format(value)
+        return data
+
+    @property
+    def data(self):
+        formatters = self.get_formatters()
+        if self.many:
+            return [self.to_representation(row, formatters) for row in self.instance]
+        return self.to_representation(self.instance, formatters)
+
+
+class UserValuesSerializer(ValuesSerializer):
+    serializer_class = UserSerializer
+
+
+class RentalValuesSerializer(ValuesSerializer):
+    serializer_class = RentalSerializer
+
+
+class ItemValuesSerializer(ValuesSerializer):
+    serializer_class = ItemSerializer
+    placeholder = 'image-name'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # reverse() per row and variant is the slowest part of ItemSerializer;
+        # the URL differs only in the (quoted) image name.
+        request = self.context.get('request')
+        self.variant_urls = {}
+        for variant in settings.IMAGE_VARIANTS:
+            url = reverse('image_variant', args=[variant, self.placeholder])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            self.variant_urls[variant] = url.split(self.placeholder)
+
+    def variant_url(self, name, variant):
+        prefix, suffix = self.variant_urls[variant]
+        return prefix + quote(name, safe=RFC3986_SUBDELIMS + '/~:@') + suffix
+
+    def get_image_variants(self, row):
+        if not row['image']:
+            return {}
+        return {variant: self.variant_url(row['image'], variant) for variant in settings.IMAGE_VARIANTS}
+
+    def get_image_srcset(self, row):
+        if not row['image']:
+            return ''
+        return ', '.join('%s %dw' % (self.variant_url(row['image'], variant), width)
+                         for variant, width in settings.IMAGE_VARIANTS.items())
+
+
+class MessageValuesSerializer(ValuesSerializer):
+    serializer_class = ConversationMessageSerializer
+
+    def get_cursor(self, row):
+        from rental_service.pagination import KeysetPagination
+        return KeysetPagination().encode_cursor(row)
+
+
+class ItemGridValuesSerializer(ItemValuesSerializer):
+    serializer_class = ItemGridSerializer
+
+
+class CategoryValuesSerializer(ValuesSerializer):
+    # Rows must come in `path` order, like link_subtrees() expects; every
+    # category carries its whole subtree, as CategorySerializer renders it.
+    serializer_class = CategorySerializer
+
+    def get_subcategories(self, row):
+        return []
+
+    @property
+    def data(self):
+        if 'subcategories' not in self.fields:
+            return super().data
+        formatters = self.get_formatters()
+        nodes = {}
+        for row in self.instance:
+            node = nodes[row['id']] = self.to_representation(row, formatters)
+            parent = nodes.get(row['parent'])
+            if parent is not None:
+                parent['subcategories'].append(node)
+        return list(nodes.values())
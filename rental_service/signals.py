@@ -0,0 +1,120 @@
+import django
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from rental_service.authentication import get_user_cache, user_cache_key
+from rental_service.cache import invalidate
+from rental_service.images import schedule_variants
+from rental_service.metrics import record_query
+from rental_service.models import Category, Item, Message, Rental, User
+from rental_service.rollups import schedule as schedule_rollups
+from rental_service.search import ensure_index
+from rental_service.sync import tombstone_for
+
+
+def cache_tags(instance):
+    if isinstance(instance, Item):
+        return ['item:%s' % instance.pk]
+    if isinstance(instance, Category):
+        return ['category']
+    if isinstance(instance, Rental):
+        return ['rentals:%s' % instance.item_id]
+    return []
+
+
+def invalidate_instances(instances):
+    # For bulk writes, which do not send post_save.
+    tags = set()
+    for instance in instances:
+        tags.update(cache_tags(instance))
+    if tags:
+        invalidate(*tags)
+
+
+@receiver([post_save, post_delete], sender=Item)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Rental)
+def invalidate_cached_responses(sender, instance, **kwargs):
+    invalidate(*cache_tags(instance))
+
+
+def schedule_item_rollups(items):
+    # For bulk item updates, which may change prices or categories.
+    schedule_rollups([item.pk for item in items])
+
+
+@receiver(pre_save, sender=Rental)
+def remember_rental_span(sender, instance, **kwargs):
+    # The days the rental was counted on before this save, whose rollups
+    # change along with the new ones.
+    instance._saved_span = None
+    if not instance._state.adding:
+        instance._saved_span = (Rental.objects.filter(pk=instance.pk)
+                                .values_list('item_id', 'start_date', 'end_date').first())
+
+
+@receiver([post_save, post_delete], sender=Rental)
+def schedule_rental_rollups(sender, instance, **kwargs):
+    spans = [(instance.item_id, instance.start_date, instance.end_date)]
+    if getattr(instance, '_saved_span', None):
+        spans.append(instance._saved_span)
+    schedule_rollups(spans=spans)
+
+
+@receiver(post_save, sender=Item)
+def schedule_price_rollups(sender, instance, created=False, update_fields=None, **kwargs):
+    # Revenue is counted at the item's price, per day in its category.
+    if not created and (update_fields is None or {'price', 'category'} & set(update_fields)):
+        schedule_rollups([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Rental)
+@receiver(post_delete, sender=Message)
+def record_tombstone(sender, instance, **kwargs):
+    tombstone_for(instance).save()
+
+
+@receiver([post_save, post_delete], sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    key = user_cache_key(instance.pk)
+    get_user_cache().delete(key)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: get_user_cache().delete(key))
+
+
+@receiver(post_save, sender=Item)
+def render_image_variants(sender, instance, update_fields=None, **kwargs):
+    if not instance.image or (update_fields is not None and 'image' not in update_fields):
+        return
+    name = instance.image.name
+    transaction.on_commit(lambda: schedule_variants(name))
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using, **kwargs):
+    if sender.name == 'rental_service':
+        ensure_index(connections[using])
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    # CONN_HEALTH_CHECKS is only honoured by Django itself from 4.1 on. Until
+    # then, persistent connections that died while idle are dropped here so
+    # the request reconnects instead of failing on its first query.
+    if django.VERSION >= (4, 1):
+        return
+    for connection in connections.all():
+        if (connection.connection is not None and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not connection.is_usable()):
+            connection.close()
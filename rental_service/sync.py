@@ -0,0 +1,142 @@
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from rental_service.models import Category, Item, Message, Participant, Rental, Tombstone
+from rental_service.pagination import KeysetPagination, encode_value
+from rental_service.serializers import (CategoryValuesSerializer, ItemValuesSerializer, MessageValuesSerializer,
+                                        RentalValuesSerializer)
+
+# Change feed for offline clients: every row of the synced collections that
+# was created or changed after the cursor, plus the ids of deleted rows. Each
+# collection is read in (updated_at, id) order, and the cursor holds the last
+# position reached in every one of them and in the tombstones.
+#
+# Rows and tombstones younger than SYNC_SETTLE_SECONDS are left for the next
+# call: updated_at is stamped before the transaction commits, so a younger row
+# may still become visible behind a position already handed out.
+
+DELETED = 'deleted'
+CHANGES = KeysetPagination(ordering=('updated_at', 'id'))
+DELETIONS = KeysetPagination(ordering=('deleted_at', 'id'))
+# Sorts after every real id, so (horizon, LAST_ID) skips all earlier tombstones.
+LAST_ID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+MESSAGE_FIELDS = ['id', 'conversation', 'user', 'message', 'created_at']
+CATEGORY_FIELDS = ['parentCategory', 'id', 'name']
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'The cursor is older than the kept deletions; sync again without since.'
+    default_code = 'cursor_expired'
+
+
+def own_conversations(user):
+    return Participant.objects.filter(user=user).values('conversation')
+
+
+def collections(user):
+    # name: (model, queryset, values serializer, fields)
+    synced = {
+        'items': (Item, Item.objects.all(), ItemValuesSerializer, None),
+        'categories': (Category, Category.objects.all(), CategoryValuesSerializer, CATEGORY_FIELDS),
+    }
+    if user.is_authenticated:
+        messages = Message.objects.filter(Q(user=user) | Q(conversation__in=own_conversations(user)))
+        synced['rentals'] = (Rental, Rental.objects.filter(user=user), RentalValuesSerializer, None)
+        synced['messages'] = (Message, messages, MessageValuesSerializer, MESSAGE_FIELDS)
+    return synced
+
+
+def visible_tombstones(user):
+    condition = Q(model__in=['item', 'category'])
+    if user.is_authenticated:
+        condition |= Q(model='rental', owner=user.pk)
+        condition |= Q(model='message') & (Q(owner=user.pk) | Q(conversation__in=own_conversations(user)))
+    return Tombstone.objects.filter(condition)
+
+
+def encode_cursor(positions):
+    return base64.urlsafe_b64encode(json.dumps(positions).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(encoded):
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise NotFound(CHANGES.invalid_cursor_message)
+    if not isinstance(positions, dict) or not all(
+            isinstance(value, list) and len(value) == 2 for value in positions.values()):
+        raise NotFound(CHANGES.invalid_cursor_message)
+    return positions
+
+
+def position(row, *fields):
+    return [encode_value(row[field]) for field in fields]
+
+
+def changes(user, since=None, limit=None):
+    positions = decode_cursor(since) if since else {}
+    limit = limit or settings.SYNC_PAGE_SIZE
+    horizon = timezone.now() - datetime.timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    data = {}
+    more = False
+    synced = collections(user)
+    for name, (model, queryset, serializer_class, fields) in synced.items():
+        rows = serializer_class.values(queryset.filter(updated_at__lte=horizon), fields, CHANGES.ordering)
+        rows = rows.order_by(*CHANGES.ordering)
+        if name in positions:
+            rows = CHANGES.after(rows, positions[name])
+        rows = list(rows[:limit + 1])
+        more = more or len(rows) > limit
+        rows = rows[:limit]
+        if rows:
+            positions[name] = position(rows[-1], 'updated_at', 'id')
+        data[name] = serializer_class(rows, many=True, fields=fields).data
+
+    # A first sync starts the deletions at the horizon: the client has none of
+    # the rows deleted before it.
+    deleted_after = positions.get(DELETED) or [encode_value(horizon), LAST_ID]
+    try:
+        oldest = parse_datetime(deleted_after[0])
+    except (TypeError, ValueError):
+        oldest = None
+    if oldest is None or timezone.is_naive(oldest):
+        raise NotFound(CHANGES.invalid_cursor_message)
+    if oldest < timezone.now() - datetime.timedelta(days=settings.SYNC_TOMBSTONE_DAYS):
+        raise CursorExpired()
+    tombstones = DELETIONS.after(visible_tombstones(user).filter(deleted_at__lte=horizon), deleted_after)
+    tombstones = list(tombstones.order_by(*DELETIONS.ordering)
+                      .values('model', 'object_id', 'deleted_at', 'id')[:limit + 1])
+    if len(tombstones) > limit:
+        more = True
+        tombstones = tombstones[:limit]
+        positions[DELETED] = position(tombstones[-1], 'deleted_at', 'id')
+    else:
+        # All tombstones up to the horizon are read; moving the position there
+        # keeps the cursor of a client that syncs regularly from expiring.
+        positions[DELETED] = [encode_value(horizon), LAST_ID]
+    names = {model._meta.model_name: name for name, (model, _, _, _) in synced.items()}
+    data[DELETED] = {name: [] for name in synced}
+    for tombstone in tombstones:
+        data[DELETED][names[tombstone['model']]].append(tombstone['object_id'])
+
+    data['cursor'] = encode_cursor(positions)
+    data['more'] = more
+    return data
+
+
+def tombstone_for(instance):
+    owner = conversation = None
+    if isinstance(instance, (Rental, Message)):
+        owner = instance.user_id
+    if isinstance(instance, Message):
+        conversation = instance.conversation_id
+    return Tombstone(model=instance._meta.model_name, object_id=instance.pk, owner=owner, conversation=conversation)
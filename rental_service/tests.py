@@ -1,3 +1,1369 @@
-from django.test import TestCase
+import base64
+import contextlib
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import uuid
+import zlib
+from concurrent.futures import Future
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from Inżynierka.asgi import application
+from rental_service import benchmark, documents, metrics, rollups
+from rental_service.categories import in_subtree, link_subtrees
+from rental_service.images import VARIANT_DIR, ensure_variant
+from rental_service.models import *
+from rental_service.rentals import refresh_item_statuses
+from rental_service.routers import ReplicaRouter, use_replica
+from rental_service.serializers import *
+from rental_service.views import RentalViewSetDetail
+
+
+def create_user(username, **extra):
+    return User.objects.create_user(
+        username=username, password=username, email='%s@example.com' % username, phone_number='1',
+        address='a', city='c', state='s', zip_code='00-000', first_name='a', last_name='b', **extra,
+    )
+
+
+class QueryBudgetMixin:
+    """
+    Asserts that an endpoint runs a fixed number of queries, and that the
+    number does not change when more rows are added.
+    """
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return len(context.captured_queries)
+
+    def assertQueryBudget(self, url, budget, grow):
+        before = self.count_queries(url)
+        grow()
+        after = self.count_queries(url)
+        self.assertEqual(before, after, '%s query count grows with rows' % url)
+        self.assertLessEqual(after, budget, '%s exceeds its query budget' % url)
+
+
+class EndpointQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', password='admin', email='admin@example.com', phone_number='1',
+            address='a', city='c', state='s', zip_code='00-000', first_name='a', last_name='b',
+        )
+        self.root = Category.objects.create(name='root')
+        self.item = self.add_rows(self.root)
+
+    def add_rows(self, parent, count=3):
+        category = Category.objects.create(name='category', parent=parent)
+        for index in range(count):
+            item = Item.objects.create(category=category, name='item', description='d', price=10,
+                                       image='images/item.png')
+            rental = Rental.objects.create(user=self.admin, item=item, start_date=datetime.date(2022, 1, 1),
+                                           end_date=datetime.date(2022, 1, 2))
+            SafeConduct.objects.create(rental=rental, document='documents/doc.pdf')
+            Message.objects.create(user=self.admin, message='message')
+        return item
+
+    def grow(self):
+        self.add_rows(self.root.subcategories.first())
+        Rental.objects.create(user=self.admin, item=self.item, start_date=datetime.date(2022, 2, 1),
+                              end_date=datetime.date(2022, 2, 2))
+
+    def test_api_query_budgets(self):
+        budgets = [
+            (reverse('user_list'), 1),
+            (reverse('item_list'), 1),
+            (reverse('item_list') + '?stream=ndjson', 1),
+            (reverse('item_list') + '?view=grid&ordering=-price&status=Available&price_min=1', 1),
+            (reverse('item_available') + '?from=2022-01-01&to=2022-01-05&category=%s' % self.root.pk, 1),
+            (reverse('rent_list', args=[self.item.pk]), 2),
+            (reverse('category_list'), 1),
+            (reverse('category_tree'), 1),
+            (reverse('category_items', args=[self.root.pk]), 1),
+            (reverse('rental_list'), 1),
+            (reverse('rental_list') + '?fields=id,item,start_date&format=msgpack', 1),
+            (reverse('safeconduct_list'), 1),
+            (reverse('message_list'), 1),
+            (reverse('async_item_list'), 1),
+            (reverse('async_rent_list', args=[self.item.pk]), 2),
+            (reverse('async_category_list'), 1),
+            (reverse('async_category_tree'), 1),
+            (reverse('async_category_items', args=[self.root.pk]), 1),
+            (reverse('async_rental_list'), 1),
+        ]
+        for url, budget in budgets:
+            with self.subTest(url=url):
+                self.assertQueryBudget(url, budget, self.grow)
+
+    def test_nested_serializer_plans(self):
+        # Serializers with nested lists and no endpoint of their own.
+        plans = [(User.objects.all(), UserMessagesSerializer), (Category.objects.all(), CategoryItemsSerializer)]
+        for queryset, serializer_class in plans:
+            with self.subTest(serializer=serializer_class.__name__):
+                def render():
+                    with CaptureQueriesContext(connection) as context:
+                        serializer_class(eager_load(queryset, serializer_class), many=True).data
+                    return len(context.captured_queries)
+
+                before = render()
+                self.grow()
+                self.assertEqual(render(), before)
+                self.assertEqual(before, 2)
+
+    def test_authenticated_reads_use_cached_user(self):
+        url = reverse('item_list')
+        anonymous = self.count_queries(url)
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer %s' % AccessToken.for_user(self.admin)
+        self.assertEqual(self.count_queries(url), anonymous + 1)
+        self.assertEqual(self.count_queries(url), anonymous)
+        self.admin.save()
+        self.assertEqual(self.count_queries(url), anonymous + 1)
+
+    def test_item_list_filters_and_ordering(self):
+        for price in (5, 30, 20):
+            Item.objects.create(category=self.item.category, name='priced', description='d', price=price,
+                                image='images/item.png')
+        url = reverse('category_items', args=[self.root.pk]) + '?ordering=-price&price_min=1&page_size=2&view=grid'
+        prices = []
+        while url:
+            page = self.client.get(url).json()
+            prices += [row['price'] for row in page['results']]
+            self.assertNotIn('description', page['results'][0])
+            url = page['next']
+        self.assertEqual(prices, ['30.00', '20.00', '10.00', '10.00', '10.00', '5.00'])
+        self.assertEqual(self.client.get(reverse('item_list') + '?ordering=description').status_code, 400)
+
+    def test_admin_changelist_query_budgets(self):
+        self.client.force_login(self.admin)
+        for model in ('rental', 'safeconduct'):
+            with self.subTest(model=model):
+                self.assertQueryBudget(reverse('admin:rental_service_%s_changelist' % model), 10, self.grow)
+
+
+class PaginationTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='category')
+        self.items = [Item.objects.create(category=category, name='item %d' % index, description='d', price=10,
+                                          image='images/item.png') for index in range(5)]
+        # Ties on created_at are broken by id.
+        Item.objects.update(created_at=datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc))
+
+    def test_invalid_cursor(self):
+        wrong_length = base64.urlsafe_b64encode(json.dumps(['2026-01-01']).encode()).decode()
+        for cursor in ['not a cursor', wrong_length]:
+            response = self.client.get(reverse('item_list'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_pages_are_stable_over_ties(self):
+        ids, url = [], reverse('item_list') + '?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            ids.extend(row['id'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(ids, sorted(str(item.pk) for item in self.items))
+
+    def test_ndjson_stream(self):
+        response = self.client.get(reverse('item_list'), {'stream': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines],
+                         ['item %d' % index for index in sorted(range(5), key=lambda index: self.items[index].pk)])
+
+
+class AsyncParityTest(TestCase):
+    def setUp(self):
+        self.user = create_user('user')
+        self.root = Category.objects.create(name='root')
+        child = Category.objects.create(name='child', parent=self.root)
+        self.items = [Item.objects.create(category=category, name='item %d' % index, description='d', price=index,
+                                          image='images/item.png')
+                      for index, category in enumerate((self.root, child, child))]
+        self.rental = Rental.objects.create(user=self.user, item=self.items[0], start_date=datetime.date(2026, 1, 1),
+                                            end_date=datetime.date(2026, 1, 2))
+
+    def assertParity(self, sync_url, async_url, **headers):
+        expected, actual = self.client.get(sync_url, **headers), self.client.get(async_url, **headers)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual['Content-Type'], expected['Content-Type'])
+        if expected['Content-Type'] == 'application/msgpack':
+            self.assertEqual(msgpack.unpackb(actual.content), msgpack.unpackb(expected.content))
+        else:
+            self.assertEqual(actual.json(), expected.json())
+        return actual
+
+    def test_bodies_match_the_sync_endpoints(self):
+        item, missing = self.items[1].pk, uuid.uuid4()
+        for name, args, query in (
+            ('item_list', [], ''), ('item_list', [], '?fields=id,name&ordering=-price'),
+            ('item_list', [], '?ordering=name'), ('item_list', [], '?fields=secret'),
+            ('item_detail', [item], ''), ('item_detail', [item], '?fields=name,price'),
+            ('item_detail', [missing], ''), ('item_detail', [item], '?fields=secret'),
+            ('rent_list', [self.items[0].pk], ''), ('rent_list', [missing], ''),
+            ('category_list', [], ''), ('category_tree', [], ''), ('category_tree', [], '?root=%s' % self.root.pk),
+            ('category_tree', [], '?root=%s' % missing), ('category_items', [self.root.pk], '?ordering=price'),
+            ('rental_list', [], ''), ('rental_list', [], '?fields=item,end_date'), ('rental_list', [], '?cursor=x'),
+        ):
+            for headers in ({}, {'HTTP_ACCEPT': 'application/msgpack'}):
+                with self.subTest(name=name, args=args, query=query, **headers):
+                    self.assertParity(reverse(name, args=args) + query, reverse('async_' + name, args=args) + query,
+                                      **headers)
+
+    def test_rental_detail(self):
+        # RentalViewSetDetail has no route of its own.
+        for pk, fields in ((self.rental.pk, None), (self.rental.pk, 'status'), (uuid.uuid4(), None)):
+            query = {'fields': fields} if fields else {}
+            expected = RentalViewSetDetail.as_view()(APIRequestFactory().get('/', query), pk=pk)
+            expected.render()
+            actual = self.client.get(reverse('async_rental_detail', args=[pk]), query)
+            self.assertEqual((actual.status_code, actual.json()), (expected.status_code, json.loads(expected.content)))
+
+    def test_negotiation_authentication_and_etags(self):
+        url = reverse('async_item_detail', args=[self.items[0].pk])
+        response = self.client.get(url, {'format': 'msgpack'})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 404)
+        response = self.client.get(url)
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                         HTTP_ACCEPT='application/msgpack').status_code, 200)
+        self.items[0].name = 'renamed'
+        self.items[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, response.json()['name']), (200, 'renamed'))
+
+        sync_url = reverse('item_detail', args=[self.items[0].pk])
+        for sync_url, async_url in ((reverse('item_list'), reverse('async_item_list')), (sync_url, url)):
+            self.assertParity(sync_url, async_url, HTTP_AUTHORIZATION='Bearer invalid')
+            self.assertEqual(self.client.get(async_url, HTTP_AUTHORIZATION='Bearer invalid').status_code, 401)
+        response = self.client.post(url)
+        self.assertEqual((response.status_code, response['Allow']), (405, 'GET, HEAD'))
+
+
+class ASGITest(TransactionTestCase):
+    # Requests through the project's ASGI application, whose views run on
+    # another thread (and database connection) than the test.
+
+    @async_to_sync
+    async def get(self, path, headers=()):
+        # channels' HttpCommunicator expects a body in every message, which
+        # Django's closing message leaves out.
+        path, _, query = path.partition('?')
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'http_version': '1.1', 'method': 'GET', 'path': path,
+            'query_string': query.encode('ascii'), 'headers': [(b'host', b'testserver'), *headers],
+        })
+        await communicator.send_input({'type': 'http.request'})
+        response = await communicator.receive_output(timeout=5)
+        response['body'] = b''
+        while True:
+            message = await communicator.receive_output(timeout=5)
+            response['body'] += message.get('body', b'')
+            if not message.get('more_body'):
+                return response
+
+    def test_ndjson_stream(self):
+        category = Category.objects.create(name='category')
+        for index in range(3):
+            Item.objects.create(category=category, name='item %d' % index, description='d', price=10,
+                                image='images/item.png')
+        response = self.get(reverse('item_list') + '?stream=ndjson')
+        self.assertEqual(response['status'], 200)
+        lines = response['body'].decode('utf-8').splitlines()
+        self.assertEqual(sorted(json.loads(line)['name'] for line in lines), ['item 0', 'item 1', 'item 2'])
+
+    @override_settings(SYNC_SETTLE_SECONDS=0, EXPORT_CHUNK_SIZE=2)
+    def test_csv_export(self):
+        admin = User.objects.create_superuser(
+            username='admin', password='admin', email='admin@example.com', phone_number='1',
+            address='a', city='c', state='s', zip_code='00-000', first_name='a', last_name='b',
+        )
+        token = 'Bearer %s' % AccessToken.for_user(admin)
+        response = self.get(reverse('export', args=['users', 'csv']), [(b'authorization', token.encode('ascii'))])
+        self.assertEqual(response['status'], 200)
+        rows = list(csv.DictReader(io.StringIO(response['body'].decode('utf-8'))))
+        self.assertEqual([row['username'] for row in rows], ['admin'])
+
+
+class InboxTest(TransactionTestCase):
+    # Sockets of /ws/inbox/ through the project's ASGI application; the HTTP
+    # requests run in the test's thread, in the same event loop.
+
+    def connect(self, user=None):
+        path = '/ws/inbox/' + ('?token=%s' % AccessToken.for_user(user) if user is not None else '')
+        return WebsocketCommunicator(application, path, headers=[(b'origin', b'http://testserver')])
+
+    @sync_to_async
+    def get(self, user, path):
+        return self.client.get(path, HTTP_AUTHORIZATION='Bearer %s' % AccessToken.for_user(user))
+
+    @sync_to_async
+    def post(self, user, path, data):
+        return self.client.post(path, data, content_type='application/json',
+                                HTTP_AUTHORIZATION='Bearer %s' % AccessToken.for_user(user))
+
+    @async_to_sync
+    async def test_messages_are_pushed_to_participants(self):
+        alice, bob, carol = [await sync_to_async(create_user)(name) for name in ('alice', 'bob', 'carol')]
+        anonymous = self.connect()
+        connected, code = await anonymous.connect()
+        self.assertEqual((connected, code), (False, 4401))
+
+        sockets = {}
+        for user in (alice, bob, carol):
+            sockets[user.username] = self.connect(user)
+            connected, _ = await sockets[user.username].connect()
+            self.assertTrue(connected)
+        response = await self.post(alice, reverse('conversation_list'), {'participants': [str(bob.pk)]})
+        self.assertEqual(response.status_code, 201)
+        conversation = response.json()['id']
+        response = await self.post(bob, reverse('conversation_messages', args=[conversation]), {'message': 'Cześć'})
+        self.assertEqual(response.status_code, 201)
+        for name in ('alice', 'bob'):
+            self.assertEqual(await sockets[name].receive_json_from(timeout=5), response.json())
+        self.assertTrue(await sockets['carol'].receive_nothing())
+        response = await self.post(carol, reverse('conversation_messages', args=[conversation]), {'message': 'Hej'})
+        self.assertEqual(response.status_code, 404)
+        for socket in sockets.values():
+            await socket.disconnect()
+
+        # After a reconnect the inbox and the catch-up fetch have the message.
+        response = await self.get(alice, reverse('conversation_list'))
+        self.assertEqual([row['id'] for row in response.json()], [conversation])
+        response = await self.get(alice, reverse('inbox_messages'))
+        self.assertEqual([row['message'] for row in response.json()['results']], ['Cześć'])
+
+
+class ReplicaTest(TestCase):
+    def setUp(self):
+        self.reads = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            self.reads.append(use_replica.get())
+            return db_for_read(router, model, **hints)
+        patcher = mock.patch.object(ReplicaRouter, 'db_for_read', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, method, *args, **kwargs):
+        self.reads = []
+        response = getattr(self.client, method)(*args, **kwargs)
+        self.assertTrue(self.reads)
+        return response, set(self.reads)
+
+    @override_settings(DATABASE_STICKY_SECONDS=30)
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        category = Category.objects.create(name='category')
+        response, reads = self.request('get', reverse('item_list'))
+        self.assertEqual((response.status_code, reads), (200, {True}))
+        self.assertNotIn('db_primary', response.cookies)
+        response, reads = self.request('post', reverse('item_bulk'), [{
+            'category': str(category.pk), 'name': 'item', 'description': 'd', 'price': 10, 'image': 'images/item.png',
+        }], content_type='application/json')
+        self.assertEqual((response.status_code, reads), (201, {False}))
+        self.assertEqual(response.cookies['db_primary']['max-age'], 30)
+        # The test client sends the cookie back.
+        response, reads = self.request('get', reverse('item_list'), {'category': category.pk})
+        self.assertEqual((response.status_code, reads), (200, {False}))
+        self.client.cookies.clear()
+        self.assertEqual(self.request('get', reverse('item_list'))[1], {True})
+
+    def test_router(self):
+        router = ReplicaRouter()
+        token = use_replica.set(True)
+        try:
+            # Under the test runner replicas mirror the primary.
+            with override_settings(DATABASE_REPLICAS=['default']):
+                self.assertEqual(router.db_for_read(Item), 'default')
+            with override_settings(DATABASE_REPLICAS=['replica_0']), \
+                    mock.patch('rental_service.routers.database_key', lambda alias: alias):
+                self.assertEqual(router.db_for_read(Item), 'replica_0')
+                self.assertEqual(router.db_for_write(Item), 'default')
+                self.assertFalse(router.allow_migrate('replica_0', 'rental_service'))
+                use_replica.set(False)
+                self.assertEqual(router.db_for_read(Item), 'default')
+        finally:
+            use_replica.reset(token)
+
+
+class ValuesSerializerParityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='user', password='user', email='user@example.com', phone_number='1', address='a',
+            city='Łódź', state='s', zip_code='00-000', first_name='Zażółć', last_name='b',
+        )
+        root = Category.objects.create(name='root')
+        child = Category.objects.create(name='child', parent=root)
+        Category.objects.create(name='grandchild', parent=child)
+        Category.objects.create(name='other')
+        images = ['images/item.png', 'images/zdjęcie nr 1 (kopia).png', '']
+        for index, price in enumerate((Decimal('0'), Decimal('12.5'), Decimal('9999.99'))):
+            item = Item.objects.create(category=child, name='item %d' % index, description='d', price=price,
+                                       image=images[index], status=Item.RENTED if index else Item.AVAILABLE)
+            Rental.objects.create(user=self.user, item=item, start_date=datetime.date(2022, 1, index + 1),
+                                  end_date=datetime.date(2022, 2, 1))
+
+    def render(self, data):
+        return json.loads(JSONRenderer().render(data))
+
+    def assertParity(self, values_class, queryset, context=None, fields=None):
+        context = context or {}
+        kwargs = {'fields': fields} if fields is not None else {}
+        expected = values_class.serializer_class(queryset, many=True, context=context, **kwargs).data
+        rows = values_class.values(queryset, fields)
+        actual = values_class(rows, many=True, context=context, **kwargs).data
+        self.assertEqual(self.render(actual), self.render(expected))
+
+    def test_list_parity(self):
+        request = Request(APIRequestFactory().get('/api/item/'))
+        for values_class, queryset in [
+            (UserValuesSerializer, User.objects.all()),
+            (RentalValuesSerializer, Rental.objects.order_by('start_date')),
+            (ItemValuesSerializer, Item.objects.order_by('price')),
+            (ItemGridValuesSerializer, Item.objects.order_by('price')),
+        ]:
+            for context in (None, {'request': request}):
+                with self.subTest(serializer=values_class.__name__, context=context):
+                    self.assertParity(values_class, queryset, context)
+        self.assertParity(ItemValuesSerializer, Item.objects.order_by('price'), fields=['price', 'image_srcset'])
+        self.assertParity(RentalValuesSerializer, Rental.objects.order_by('start_date'), fields=['item', 'end_date'])
+
+    def test_category_tree_parity(self):
+        categories = list(Category.objects.order_by('path'))
+        link_subtrees(categories)
+        expected = CategorySerializer(categories, many=True).data
+        actual = CategoryValuesSerializer(CategoryValuesSerializer.values(Category.objects.order_by('path')),
+                                          many=True).data
+        self.assertEqual(self.render(actual), self.render(expected))
+
+    def test_rendering_is_timed(self):
+        stats = metrics.RequestStats()
+        token = metrics.current_request.set(stats)
+        try:
+            ItemValuesSerializer(ItemValuesSerializer.values(Item.objects.all()), many=True).data
+        finally:
+            metrics.current_request.reset(token)
+        self.assertGreater(stats.serializer_time, 0)
+        self.assertFalse(stats.serializing)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.sport = Category.objects.create(name='sport')
+        self.bikes = Category.objects.create(name='bikes', parent=self.sport)
+        self.skis = Category.objects.create(name='skis', parent=self.sport)
+        self.tools = Category.objects.create(name='tools')
+        for category, name, description, price, item_status in (
+            (self.bikes, 'Rower górski', 'Rower z amortyzacją, rower na każdy teren', 40, Item.AVAILABLE),
+            (self.bikes, 'Kask', 'Kask do jazdy na rowerze, rozmiar M, kolor czarny, lekki i przewiewny', 20,
+             Item.RENTED),
+            (self.skis, 'Narty', 'Narty zjazdowe z Łodzi, pasują do roweru w bagażniku', 150, Item.AVAILABLE),
+            (self.tools, 'Wiertarka', 'Wiertarka udarowa, odbiór w Łódź', 60, Item.AVAILABLE),
+        ):
+            Item.objects.create(category=category, name=name, description=description, price=price,
+                                image='images/item.png', status=item_status)
+
+    def search(self, **params):
+        response = self.client.get(reverse('item_search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def names(self, **params):
+        return [item['name'] for item in self.search(**params)['results']]
+
+    def test_ranking_and_prefixes(self):
+        # 'rower' also finds 'rowerze' and 'roweru'; the item naming it twice ranks first.
+        self.assertEqual(self.names(q='rower')[0], 'Rower górski')
+        self.assertEqual(set(self.names(q='rower')), {'Rower górski', 'Kask', 'Narty'})
+        self.assertEqual(self.names(q='rower kask'), ['Kask'])
+        self.assertEqual(self.names(q='rower', limit=1, offset=1), [self.names(q='rower')[1]])
+        self.assertEqual(self.names(q='hulajnoga'), [])
+
+    def test_polish_letters_are_folded(self):
+        for query in ('lodz', 'Łódź', 'ŁÓDŹ', 'łodz'):
+            with self.subTest(query=query):
+                self.assertEqual(set(self.names(q=query)), {'Narty', 'Wiertarka'})
+        self.assertEqual(self.names(q='gorski'), ['Rower górski'])
+        self.assertEqual(self.names(q='amortyzacja'), ['Rower górski'])
+
+    def test_facets(self):
+        facets = self.search(q='rower')['facets']
+        self.assertEqual({row['name']: row['count'] for row in facets['category']}, {'sport': 3})
+        self.assertEqual(facets['status'], {'Available': 2, 'Rented': 1})
+        self.assertEqual(facets['price'], {'0-50': 2, '100-200': 1})
+        facets = self.search(q='rower', category=self.sport.pk)['facets']
+        self.assertEqual({row['name']: row['count'] for row in facets['category']}, {'bikes': 2, 'skis': 1})
+        result = self.search(q='rower', category=self.bikes.pk, status=Item.AVAILABLE)
+        self.assertEqual([item['name'] for item in result['results']], ['Rower górski'])
+        self.assertEqual(result['facets']['status'], {'Available': 1})
+
+
+class BulkTest(TestCase):
+    def setUp(self):
+        self.user = create_user('user')
+        self.category = Category.objects.create(name='category')
+        self.item = Item.objects.create(category=self.category, name='item', description='d', price=10,
+                                        image='images/item.png')
+
+    def send(self, method, name, data):
+        return getattr(self.client, method)(reverse(name), data, content_type='application/json')
+
+    def item_row(self, name, price=10):
+        return {'category': str(self.category.pk), 'name': name, 'description': 'd', 'price': price,
+                'image': 'images/item.png'}
+
+    def test_item_batch_is_all_or_nothing(self):
+        response = self.send('post', 'item_bulk', [self.item_row('a'), self.item_row('b', price='x'),
+                                                   self.item_row('c'), {'name': 'd'}])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(len(errors), 4)
+        self.assertEqual((errors[0], errors[2]), ({}, {}))
+        self.assertIn('price', errors[1])
+        self.assertEqual(set(errors[3]), {'category', 'description', 'price'})
+        self.assertEqual(Item.objects.count(), 1)
+
+        response = self.send('post', 'item_bulk', [self.item_row('a'), self.item_row('b')])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['name'] for item in response.json()], ['a', 'b'])
+        self.assertEqual(Item.objects.count(), 3)
+
+    def test_item_updates_are_all_or_nothing(self):
+        response = self.send('patch', 'item_bulk', [{'id': str(self.item.pk), 'price': 20},
+                                                    {'id': str(uuid.uuid4()), 'price': 20}, {'price': 20}])
+        self.assertEqual(response.json(), [{}, {'id': ['Not found.']}, {'id': ['Not found.']}])
+        response = self.send('patch', 'item_bulk', [{'id': str(self.item.pk), 'price': 20},
+                                                    {'id': str(self.item.pk), 'name': ''}])
+        self.assertEqual(response.status_code, 400)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.price, 10)
+
+    def test_rental_batch_conflicts_are_reported_per_row(self):
+        def rental(start, end):
+            return {'user': str(self.user.pk), 'item': str(self.item.pk),
+                    'start_date': '2026-01-%02d' % start, 'end_date': '2026-01-%02d' % end}
+        Rental.objects.create(user=self.user, item=self.item, start_date=datetime.date(2026, 1, 1),
+                              end_date=datetime.date(2026, 1, 2))
+        response = self.send('post', 'rental_bulk', [rental(3, 4), rental(2, 3), rental(4, 5), rental(6, 5)])
+        self.assertEqual(response.status_code, 400)
+        conflict = {'non_field_errors': ['Item is already rented in this period']}
+        self.assertEqual(response.json(), [{}, conflict, conflict,
+                                           {'non_field_errors': ['End date must not be before start date']}])
+        self.assertEqual(Rental.objects.count(), 1)
+        response = self.send('post', 'rental_bulk', [rental(3, 4), rental(5, 6)])
+        self.assertEqual(response.status_code, 201)
+        self.item.refresh_from_db()
+        self.assertEqual((Rental.objects.count(), self.item.status), (3, Item.RESERVED))
+
+    def test_batch_size_is_limited(self):
+        with override_settings(BULK_MAX_RECORDS=2):
+            response = self.send('post', 'item_bulk', [self.item_row(name) for name in 'abc'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.send('post', 'item_bulk', []).status_code, 400)
+
+
+class CategoryTest(TestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name='root')
+        self.child = Category.objects.create(name='child', parent=self.root)
+        self.grandchild = Category.objects.create(name='grandchild', parent=self.child)
+        self.other = Category.objects.create(name='other')
+        self.item = Item.objects.create(category=self.grandchild, name='item', description='d', price=10,
+                                        image='images/item.png')
+
+    def tree(self):
+        def names(nodes):
+            return {node['name']: names(node['subcategories']) for node in nodes}
+        return names(self.client.get(reverse('category_tree')).json())
+
+    def test_move_rewrites_subtree_paths(self):
+        self.assertEqual(self.tree(), {'root': {'child': {'grandchild': {}}}, 'other': {}})
+        self.child.parent = self.other
+        self.child.save()
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.child.path, self.other.path + self.child.id.hex + '/')
+        self.assertEqual(self.grandchild.path, self.child.path + self.grandchild.id.hex + '/')
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertFalse(Item.objects.filter(in_subtree(self.root)).exists())
+        self.assertEqual(list(Item.objects.filter(in_subtree(self.other.pk))), [self.item])
+        self.assertEqual(self.tree(), {'root': {}, 'other': {'child': {'grandchild': {}}}})
+
+    def test_cycle_is_rejected(self):
+        for category, parent in ((self.root, self.grandchild), (self.child, self.child)):
+            category.parent = parent
+            with self.assertRaises(ValueError):
+                category.save()
+        self.assertEqual(Category.objects.get(pk=self.root.pk).parent, None)
+        self.assertEqual(Category.objects.get(pk=self.child.pk).parent, self.root)
+
+
+class MetricsTest(TestCase):
+    SAMPLE = re.compile(r'^[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? [0-9.e+-]+$')
+
+    def setUp(self):
+        with metrics.lock:
+            metrics.histograms.clear()
+            metrics.requests_total.clear()
+        category = Category.objects.create(name='category')
+        for index in range(3):
+            Item.objects.create(category=category, name='item %d' % index, description='d', price=10,
+                                image='images/item.png')
+
+    def histogram(self, name, view, method='GET'):
+        return metrics.histograms[(name, (('view', view), ('method', method)))]
+
+    def test_requests_are_recorded(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('item_list'))
+        query_count = len(queries)
+        self.client.get(reverse('item_detail', args=[uuid.uuid4()]))
+        self.assertEqual(sum(self.histogram('http_request_duration_seconds', 'item_list').counts), 1)
+        db_queries = self.histogram('http_request_db_queries', 'item_list')
+        self.assertEqual((sum(db_queries.counts), db_queries.sum), (1, query_count))
+        self.assertEqual(self.histogram('http_response_size_bytes', 'item_list').sum, len(response.content))
+        self.assertGreater(self.histogram('http_request_serializer_duration_seconds', 'item_list').sum, 0)
+        self.assertEqual(metrics.requests_total, {
+            (('view', 'item_list'), ('method', 'GET'), ('status', '200')): 1,
+            (('view', 'item_detail'), ('method', 'GET'), ('status', '404')): 1,
+        })
+
+    def test_exposition(self):
+        self.client.get(reverse('item_list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        lines = response.content.decode('utf-8').splitlines()
+        for line in lines:
+            if line.startswith('#'):
+                self.assertRegex(line, r'^# (HELP [a-z_]+ .+|TYPE [a-z_]+ (counter|histogram))$')
+            else:
+                self.assertRegex(line, self.SAMPLE)
+        self.assertIn('http_requests_total{view="item_list",method="GET",status="200"} 1', lines)
+        buckets = [line for line in lines if line.startswith('http_request_db_queries_bucket{view="item_list"')]
+        counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+        self.assertEqual(counts, sorted(counts))
+        self.assertIn('le="+Inf"', buckets[-1])
+        self.assertIn('http_request_db_queries_count{view="item_list",method="GET"} %d' % counts[-1], lines)
+
+    @override_settings(SLOW_REQUEST_MS=0, SLOW_REQUEST_QUERIES=1)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('rental_service.performance', 'WARNING') as logs:
+            self.client.get(reverse('item_list'))
+        [message] = logs.output
+        self.assertIn('Slow request GET /api/item/ (item_list)', message)
+        self.assertEqual(len([line for line in message.splitlines() if ' ms  SELECT ' in line]), 1)
+
+    @override_settings(SLOW_REQUEST_MS=60000)
+    def test_fast_requests_are_not_logged(self):
+        with self.assertNoLogs('rental_service.performance', 'WARNING'):
+            self.client.get(reverse('item_list'))
+
+
+class FormatTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='category')
+        for index in range(3):
+            Item.objects.create(category=category, name='item %d' % index, description='d' * 300, price=10,
+                                image='images/item.png')
+
+    def test_sparse_fieldsets(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('item_list'), {'fields': 'id,name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([sorted(item) for item in response.json()['results']], [['id', 'name']] * 3)
+        self.assertNotIn('description', queries[-1]['sql'])
+        response = self.client.get(reverse('item_list'), {'fields': 'id,secret'})
+        self.assertEqual((response.status_code, response.json()), (400, {'fields': ['Unknown fields: secret']}))
+
+    def test_msgpack_negotiation(self):
+        response = self.client.get(reverse('item_list'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        for packed in (self.client.get(reverse('item_list'), HTTP_ACCEPT='application/msgpack'),
+                       self.client.get(reverse('item_list'), {'format': 'msgpack'})):
+            self.assertEqual(packed['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(packed.content), response.json())
+
+    def test_gzip(self):
+        response = self.client.get(reverse('item_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        plain = self.client.get(reverse('item_list'))
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(zlib.decompress(response.content, 16 + zlib.MAX_WBITS)), plain.json())
+
+
+class ImageVariantTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        output = io.BytesIO()
+        Image.new('RGB', (800, 400), 'red').save(output, 'PNG')
+        self.png = output.getvalue()
+        self.name = default_storage.save('images/photo.png', ContentFile(self.png))
+        self.item = Item.objects.create(category=Category.objects.create(name='category'), name='item',
+                                        description='d', price=10, image=self.name)
+
+    def test_ensure_variant(self):
+        name = ensure_variant(self.name, 'thumb')
+        self.assertTrue(name.startswith(VARIANT_DIR) and name.endswith('/thumb.webp'))
+        with default_storage.open(name) as variant, Image.open(variant) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (160, 80)))
+        modified = default_storage.get_modified_time(name)
+        self.assertEqual(ensure_variant(self.name, 'thumb'), name)
+        self.assertEqual(default_storage.get_modified_time(name), modified)
+        self.assertNotEqual(ensure_variant(self.name, 'small'), name)
+        with self.assertRaises(SuspiciousFileOperation):
+            ensure_variant(name, 'large')
+
+    def test_serializer_fields(self):
+        request = Request(APIRequestFactory().get('/api/item/'))
+        for data in (ItemSerializer(self.item, context={'request': request}).data,
+                     ItemValuesSerializer(ItemValuesSerializer.values(Item.objects.all()), many=True,
+                                          context={'request': request}).data[0]):
+            self.assertEqual(data['image_variants'], {
+                variant: 'http://testserver' + reverse('image_variant', args=[variant, self.name])
+                for variant in settings.IMAGE_VARIANTS
+            })
+            self.assertEqual(data['image_srcset'], ', '.join(
+                '%s %dw' % (data['image_variants'][variant], width)
+                for variant, width in settings.IMAGE_VARIANTS.items()
+            ))
+        self.item.image = ''
+        self.assertEqual(ItemSerializer(self.item).data['image_variants'], {})
+        self.assertEqual(ItemSerializer(self.item).data['image_srcset'], '')
+
+    def test_view(self):
+        response = self.client.get(reverse('image_variant', args=['medium', self.name]))
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/webp'))
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (640, 320))
+
+    def test_view_not_found(self):
+        variant = ensure_variant(self.name, 'thumb')
+        unreferenced = default_storage.save('images/other.png', ContentFile(self.png))
+        corrupt = default_storage.save('images/corrupt.png', ContentFile(self.png[:100]))
+        Item.objects.create(category=self.item.category, name='corrupt', description='d', price=10, image=corrupt)
+        Item.objects.create(category=self.item.category, name='missing', description='d', price=10,
+                            image='images/missing.png')
+        stored = set(default_storage.listdir(VARIANT_DIR)[0])
+        for variant, name in (('huge', self.name), ('large', variant), ('large', unreferenced), ('large', corrupt),
+                              ('large', 'images/missing.png'), ('large', '../settings.py')):
+            with self.subTest(variant=variant, name=name):
+                response = self.client.get(reverse('image_variant', args=[variant, name]))
+                self.assertEqual(response.status_code, 404)
+        # Only the variant of the valid item's image exists.
+        self.assertEqual(set(default_storage.listdir(VARIANT_DIR)[0]), stored)
+
+
+class RentalTest(TestCase):
+    def setUp(self):
+        self.user = create_user('user')
+        self.item = Item.objects.create(category=Category.objects.create(name='category'), name='item',
+                                        description='d', price=10, image='images/item.png')
+
+    def reserve(self, start, end, item=None, rental_status=Rental.RESERVED):
+        return Rental.objects.create(user=self.user, item=item or self.item, start_date=datetime.date(2026, 1, start),
+                                     end_date=datetime.date(2026, 1, end), status=rental_status)
+
+    def rental_statuses(self, **headers):
+        response = self.client.get(reverse('rent_list', args=[self.item.pk]), **headers)
+        if response.status_code == 304:
+            return response, None
+        return response, sorted(rental['status'] for rental in response.json()['rental'])
+
+    def test_overlapping_rental_is_rejected(self):
+        self.reserve(5, 10)
+        self.reserve(1, 31, rental_status=Rental.CANCELLED)
+
+        def post(start, end):
+            return self.client.post(reverse('rental_list'), {
+                'user': str(self.user.pk), 'item': str(self.item.pk),
+                'start_date': '2026-01-%02d' % start, 'end_date': '2026-01-%02d' % end,
+            }, content_type='application/json')
+        for start, end in ((1, 5), (10, 12), (6, 7), (1, 31)):
+            response = post(start, end)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'non_field_errors': ['Item is already rented in this period']})
+        self.assertEqual(post(11, 12).status_code, 201)
+        self.assertEqual(post(3, 1).status_code, 400)
+
+    def test_available_items(self):
+        other_category = Category.objects.create(name='other')
+        free = Item.objects.create(category=self.item.category, name='free', description='d', price=10,
+                                   image='images/item.png')
+        elsewhere = Item.objects.create(category=other_category, name='elsewhere', description='d', price=10,
+                                        image='images/item.png')
+        self.reserve(5, 10)
+        self.reserve(1, 2, item=free, rental_status=Rental.RETURNED)
+
+        def available(**params):
+            response = self.client.get(reverse('item_available'), params)
+            self.assertEqual(response.status_code, 200)
+            return {item['name'] for item in response.json()['results']}
+        self.assertEqual(available(**{'from': '2026-01-10', 'to': '2026-01-12'}), {'free', 'elsewhere'})
+        self.assertEqual(available(**{'from': '2026-01-11', 'to': '2026-01-12'}), {'item', 'free', 'elsewhere'})
+        self.assertEqual(available(**{'from': '2026-01-01', 'to': '2026-01-31', 'category': other_category.pk}),
+                         {'elsewhere'})
+        response = self.client.get(reverse('item_available'), {'from': '2026-01-12', 'to': '2026-01-10'})
+        self.assertEqual(response.status_code, 400)
+
+    def transition(self, rental, action):
+        return self.client.post(reverse('rental_transition', args=[rental.pk, action]))
+
+    def item_status(self):
+        self.item.refresh_from_db()
+        return self.item.status
+
+    def test_transitions_and_item_status(self):
+        first, second = self.reserve(1, 2), self.reserve(5, 6)
+        refresh_item_statuses([self.item.pk])
+        self.assertEqual(self.item_status(), Item.RESERVED)
+        response = self.transition(first, 'rent')
+        self.assertEqual((response.status_code, response.json()['status']), (200, Rental.RENTED))
+        self.assertEqual(self.item_status(), Item.RENTED)
+        # Rented wins over Reserved; returning leaves the other reservation.
+        response = self.transition(first, 'return')
+        self.assertEqual((response.status_code, response.json()['status']), (200, Rental.RETURNED))
+        self.assertEqual(self.item_status(), Item.RESERVED)
+        response = self.transition(second, 'cancel')
+        self.assertEqual((response.status_code, response.json()['status']), (200, Rental.CANCELLED))
+        self.assertEqual(self.item_status(), Item.AVAILABLE)
+        self.assertEqual(self.transition(second, 'extend').status_code, 404)
+        self.assertEqual(self.client.post(reverse('rental_transition', args=[uuid.uuid4(), 'rent'])).status_code,
+                         404)
+
+    def test_stale_transition_is_a_conflict(self):
+        first, second = self.reserve(1, 2), self.reserve(5, 6)
+        response = self.transition(first, 'return')
+        self.assertEqual((response.status_code, response.json()), (409, {'detail': 'Rental is not rented'}))
+        self.assertEqual(self.transition(first, 'rent').status_code, 200)
+        for rental, action, detail in ((first, 'rent', 'Rental is not reserved'),
+                                       (first, 'cancel', 'Rental is not reserved'),
+                                       (second, 'rent', 'Item is already rented out')):
+            response = self.transition(rental, action)
+            self.assertEqual((response.status_code, response.json()), (409, {'detail': detail}))
+        # A batch with one stale row applies none of its rows.
+        response = self.client.patch(reverse('rental_transition_bulk'), [
+            {'id': str(second.pk), 'action': 'cancel'}, {'id': str(first.pk), 'action': 'rent'},
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), [{}, {'non_field_errors': ['Rental is not reserved']}])
+        self.assertEqual(dict(Rental.objects.values_list('pk', 'status')),
+                         {first.pk: Rental.RENTED, second.pk: Rental.RESERVED})
+        self.assertEqual(self.item_status(), Item.RENTED)
+
+    def test_transition_replaces_cached_rentals(self):
+        first, second = self.reserve(1, 2), self.reserve(5, 6)
+        # The item is Reserved before and after, so it is not saved again.
+        refresh_item_statuses([self.item.pk])
+        response, statuses = self.rental_statuses()
+        self.assertEqual(statuses, ['Reserved', 'Reserved'])
+        self.client.post(reverse('rental_transition', args=[first.pk, 'cancel']))
+        response, statuses = self.rental_statuses(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, statuses), (200, ['Cancelled', 'Reserved']))
+        self.client.patch(reverse('rental_transition_bulk'), [{'id': str(second.pk), 'action': 'rent'}],
+                          content_type='application/json')
+        self.assertEqual(self.rental_statuses()[1], ['Cancelled', 'Rented'])
+
+    def test_cached_rentals_vary_by_media_type(self):
+        self.reserve(1, 2)
+        response = self.client.get(reverse('rent_list', args=[self.item.pk]))
+        packed = self.client.get(reverse('rent_list', args=[self.item.pk]), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(packed['Content-Type'], 'application/msgpack')
+        self.assertNotEqual(packed['ETag'], response['ETag'])
+        self.assertIn('Accept', packed['Vary'])
+        self.assertEqual(msgpack.unpackb(packed.content)['rental'][0]['id'], response.json()['rental'][0]['id'])
+        # A JSON ETag does not validate the msgpack body.
+        packed = self.client.get(reverse('rent_list', args=[self.item.pk]), HTTP_ACCEPT='application/msgpack',
+                                 HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(packed.status_code, 200)
+        response = self.client.get(reverse('rent_list', args=[self.item.pk]), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept', response['Vary'])
+
+    def test_bulk_delete_refreshes_item_status(self):
+        rental = self.reserve(1, 2)
+        refresh_item_statuses([self.item.pk])
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, Item.RESERVED)
+        response = self.client.delete(reverse('rental_bulk'), {'ids': [str(rental.pk)]},
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, Item.AVAILABLE)
+        self.assertEqual(self.rental_statuses()[1], [])
+
+
+class DocumentJobTest(TestCase):
+    def setUp(self):
+        user = create_user('user')
+        item = Item.objects.create(category=Category.objects.create(name='category'), name='item', description='d',
+                                   price=10, image='images/item.png')
+        rental = Rental.objects.create(user=user, item=item, start_date=datetime.date(2026, 1, 1),
+                                       end_date=datetime.date(2026, 1, 2))
+        self.safe_conduct = SafeConduct.objects.create(rental=rental)
+
+    def failing_executor(self):
+        class Executor:
+            def submit(self, fn, *args):
+                future = Future()
+                future.set_exception(OSError('wkhtmltopdf failed'))
+                return future
+        return Executor()
+
+    def test_enqueue_dedupes_and_claims_once(self):
+        job = documents.enqueue(self.safe_conduct)
+        self.assertEqual(documents.enqueue(self.safe_conduct), job)
+        claimed = documents.claim_batch(10)
+        self.assertEqual([claimed_job.pk for claimed_job in claimed], [job.pk])
+        self.assertEqual(claimed[0].status, DocumentJob.RUNNING)
+        self.assertEqual(documents.claim_batch(10), [])
+        # Still running, so enqueueing again does not add a job.
+        self.assertEqual(documents.enqueue(self.safe_conduct), job)
+
+    @override_settings(DOCUMENT_JOB_CLAIM_SECONDS=60)
+    def test_stale_claim_is_taken_over(self):
+        job = documents.enqueue(self.safe_conduct)
+        dead_worker = documents.claim_batch(10)
+        DocumentJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - datetime.timedelta(seconds=61))
+        live_worker = documents.claim_batch(10)
+        self.assertEqual([claimed_job.pk for claimed_job in live_worker], [job.pk])
+        self.assertNotEqual(live_worker[0].claimed_by, dead_worker[0].claimed_by)
+        # The first worker's late result is dropped.
+        self.assertEqual(documents.process_batch(dead_worker, self.failing_executor()), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.claimed_by), (DocumentJob.RUNNING, live_worker[0].claimed_by))
+
+    def test_failed_job_is_retried_by_a_new_job(self):
+        job = documents.enqueue(self.safe_conduct)
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            [failed] = documents.process_batch(documents.claim_batch(10), self.failing_executor())
+        self.assertEqual((failed.status, failed.error), (DocumentJob.FAILED, 'wkhtmltopdf failed'))
+        retry = documents.enqueue(self.safe_conduct)
+        self.assertNotEqual(retry.pk, job.pk)
+        self.assertEqual(retry.status, DocumentJob.QUEUED)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='user', password='user', email='user@example.com', phone_number='1', address='a',
+            city='c', state='s', zip_code='00-000', first_name='a', last_name='b',
+        )
+        self.category = Category.objects.create(name='root')
+        self.items = [Item.objects.create(category=self.category, name='item', description='d', price=index,
+                                          image='images/item.png') for index in range(3)]
+        self.rental = Rental.objects.create(user=self.user, item=self.items[0], start_date=datetime.date(2022, 1, 1),
+                                            end_date=datetime.date(2022, 1, 2))
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer %s' % AccessToken.for_user(self.user)
+
+    def sync(self, cursor=None, **params):
+        if cursor is not None:
+            params['since'] = cursor
+        response = self.client.get(reverse('sync'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_full_sync_in_pages_then_deltas(self):
+        synced, cursor = set(), None
+        while True:
+            page = self.sync(cursor, limit=2)
+            synced.update(row['id'] for row in page['items'])
+            cursor = page['cursor']
+            if not page['more']:
+                break
+        self.assertEqual(synced, {str(item.pk) for item in self.items})
+
+        self.items[1].name = 'renamed'
+        self.items[1].save()
+        deleted_item, deleted_rental = str(self.items[2].pk), str(self.rental.pk)
+        self.items[2].delete()
+        self.rental.delete()
+        page = self.sync(cursor)
+        self.assertEqual([row['name'] for row in page['items']], ['renamed'])
+        self.assertEqual(page['categories'], [])
+        self.assertEqual(page['deleted']['items'], [deleted_item])
+        self.assertEqual(page['deleted']['rentals'], [deleted_rental])
+        page = self.sync(page['cursor'])
+        self.assertEqual(page['items'], [])
+        self.assertEqual(page['deleted']['items'], [])
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0, EXPORT_CHUNK_SIZE=2)
+class ExportTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', password='admin', email='admin@example.com', phone_number='1',
+            address='a', city='c', state='s', zip_code='00-000', first_name='a', last_name='b',
+        )
+        category = Category.objects.create(name='category')
+        self.items = [Item.objects.create(category=category, name='item, "%d"' % index, description='d', price=10,
+                                          image='images/item.png') for index in range(3)]
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer %s' % AccessToken.for_user(self.admin)
+
+    def export(self, name, **params):
+        response = self.client.get(reverse('export', args=[name, 'csv']), params)
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        return rows, response['X-Export-Until']
+
+    def test_csv_export_with_joined_columns_and_increments(self):
+        # The token's user, then one joined SELECT for all the chunks.
+        with self.assertNumQueries(2):
+            rows, until = self.export('items')
+        self.assertEqual(sorted(row['name'] for row in rows), ['item, "0"', 'item, "1"', 'item, "2"'])
+        self.assertEqual({row['category__name'] for row in rows}, {'category'})
+        self.items[1].price = 20
+        self.items[1].save()
+        rows, _ = self.export('items', since=until)
+        self.assertEqual([(row['id'], row['price']) for row in rows], [(str(self.items[1].pk), '20.00')])
+
+
+class RollupTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', password='admin', email='admin@example.com', phone_number='1',
+            address='a', city='c', state='s', zip_code='00-000', first_name='a', last_name='b',
+        )
+        self.parent = Category.objects.create(name='parent')
+        self.child = Category.objects.create(name='child', parent=self.parent)
+        self.items = [Item.objects.create(category=category, name='item', description='d', price=10,
+                                          image='images/item.png')
+                      for category in (self.parent, self.parent, self.child)]
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer %s' % AccessToken.for_user(self.admin)
+
+    def rent(self, item, start, end, rental_status=Rental.RETURNED):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Rental.objects.create(user=self.admin, item=item, start_date=datetime.date(2026, 1, start),
+                                         end_date=datetime.date(2026, 1, end), status=rental_status)
+
+    def category_stats(self):
+        return sorted((row.category.name, row.date.day, row.rented_items, row.revenue)
+                      for row in CategoryDailyStats.objects.select_related('category'))
+
+    def test_incremental_rollups_match_rebuild_and_report(self):
+        self.rent(self.items[0], 1, 2)
+        self.rent(self.items[0], 2, 2)
+        self.rent(self.items[1], 2, 3)
+        self.rent(self.items[2], 1, 1, Rental.CANCELLED)
+        rental = self.rent(self.items[2], 3, 3, Rental.RESERVED)
+        self.assertEqual(self.category_stats(), [
+            ('child', 3, 1, Decimal('10.00')), ('parent', 1, 1, Decimal('10.00')),
+            ('parent', 2, 2, Decimal('30.00')), ('parent', 3, 1, Decimal('10.00')),
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            rental.delete()
+            self.items[1].price = 20
+            self.items[1].save()
+        incremental = self.category_stats()
+        self.assertEqual(incremental, [
+            ('parent', 1, 1, Decimal('10.00')), ('parent', 2, 2, Decimal('40.00')), ('parent', 3, 1, Decimal('20.00')),
+        ])
+        rollups.rebuild(Item.objects.values_list('pk', flat=True))
+        self.assertEqual(self.category_stats(), incremental)
+
+        # The token's user, then one query for the report.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('utilisation_report'), {'days': 10, 'to': '2026-01-10'})
+        self.assertEqual(response.status_code, 200)
+        rows = {row['name']: row for row in response.json()['categories']}
+        self.assertEqual(rows['parent']['rented_item_days'], 4)
+        self.assertEqual(rows['parent']['utilisation'], 0.2)
+        self.assertEqual(rows['parent']['revenue'], '70.00')
+        self.assertEqual((rows['child']['rented_item_days'], rows['child']['utilisation']), (0, 0.0))
+        response = self.client.get(reverse('utilisation_report'), {'category': self.child.pk})
+        self.assertEqual([row['name'] for row in response.json()['categories']], ['child'])
+
+    def test_rental_writes_refresh_only_their_days(self):
+        rental = self.rent(self.items[0], 1, 3, Rental.RESERVED)
+        self.rent(self.items[0], 20, 21)
+        # A marker outside of every rental written below, left alone by them.
+        ItemDailyStats.objects.filter(date=datetime.date(2026, 1, 21)).update(rentals=99)
+
+        def item_days():
+            return sorted((row.date.day, row.rentals) for row in ItemDailyStats.objects.filter(item=self.items[0]))
+
+        # Rescheduled: the old days go, the new ones come.
+        with self.captureOnCommitCallbacks(execute=True):
+            rental.start_date, rental.end_date = datetime.date(2026, 1, 5), datetime.date(2026, 1, 6)
+            rental.save()
+        self.assertEqual(item_days(), [(5, 1), (6, 1), (20, 1), (21, 99)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('rental_bulk'), [{'id': str(rental.pk), 'start_date': '2026-01-08',
+                                                                   'end_date': '2026-01-09'}],
+                                         content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(item_days(), [(8, 1), (9, 1), (20, 1), (21, 99)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('rental_transition', args=[rental.pk, 'cancel']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(item_days(), [(20, 1), (21, 99)])
+        self.assertEqual(self.category_stats(), [('parent', day, 1, Decimal('10.00')) for day in (20, 21)])
+
+        rollups.rebuild(Item.objects.values_list('pk', flat=True))
+        self.assertEqual(item_days(), [(20, 1), (21, 1)])
+
+    @override_settings(RENTAL_MAX_DAYS=3)
+    def test_rental_span_is_capped(self):
+        rental = {'user': str(self.admin.pk), 'item': str(self.items[0].pk), 'start_date': '2026-01-01',
+                  'end_date': '2026-01-04'}
+        response = self.client.post(reverse('rental_list'), rental, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('rental_bulk'), [rental], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        # Rows saved before the cap are rolled up for RENTAL_MAX_DAYS days only.
+        self.rent(self.items[0], 1, 31)
+        self.assertEqual(self.category_stats(), [('parent', day, 1, Decimal('10.00')) for day in (1, 2, 3)])
+
+
+class QuoteTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='user', password='user', email='user@example.com', phone_number='1',
+            address='a', city='c', state='s', zip_code='00-000', first_name='a', last_name='b',
+        )
+        parent = Category.objects.create(name='parent')
+        child = Category.objects.create(name='child', parent=parent)
+        other = Category.objects.create(name='other')
+        PricingRule.objects.create(category=parent, min_days=3, discount=Decimal('12.5'))
+        self.items = [Item.objects.create(category=category, name='item', description='d', price=Decimal('9.99'),
+                                          image='images/item.png') for category in (child, other)]
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer %s' % AccessToken.for_user(self.user)
+
+    def test_cart_quoted_in_one_pass(self):
+        lines = [
+            {'item': str(self.items[0].pk), 'start_date': '2026-01-01', 'end_date': '2026-01-02'},
+            {'item': str(self.items[0].pk), 'start_date': '2026-01-01', 'end_date': '2026-01-03'},
+            {'item': str(self.items[1].pk), 'start_date': '2026-01-01', 'end_date': '2026-01-07'},
+        ] * 10
+        # The token's user, the items with their categories, their rules.
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse('quote'), lines, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        quoted = [(line['days'], line['discount'], line['total']) for line in response.json()['lines'][:3]]
+        # The subcategory inherits its parent's rule; the other category gets
+        # the default tiers.
+        self.assertEqual(quoted, [(2, '0.00', '19.98'), (3, '12.50', '26.22'), (7, '10.00', '62.94')])
+        self.assertEqual(response.json()['total'], '1091.40')
+
+        lines[1]['item'] = str(self.items[0].category_id)
+        response = self.client.post(reverse('quote'), lines[:2], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [{}, {'item': ['Item does not exist.']}])
+
+
+class BenchmarkTest(TestCase):
+    def test_every_route_is_benchmarked_uncached(self):
+        benchmark.seed(users=3, categories=3, depth=2, items=5, rentals=20, messages=40)
+        results = benchmark.run(iterations=1, asgi_requests=0, concurrency=1)
+        self.assertEqual(results['skipped_routes'], [])
+        for name, result in results['endpoints'].items():
+            self.assertLess(result['status'], 400, name)
+        # Cached endpoints are measured as misses, not as hits without queries.
+        for name in ('item_detail', 'rent_list', 'category_list', 'async_item_detail'):
+            self.assertGreater(results['endpoints'][name]['queries'], 0, name)
+
+    def test_compare(self):
+        baseline = {'endpoints': {'item_list': {'p95': 10.0, 'queries': 3, 'peak_memory_kb': 1000}}}
+
+        def regressions(**after):
+            current = {'endpoints': {'item_list': dict(baseline['endpoints']['item_list'], **after)}}
+            return benchmark.compare(baseline, current, threshold=0.2, min_delta_ms=1.0)
+
+        self.assertEqual(regressions(), [])
+        self.assertEqual(regressions(p95=11.9), [])
+        self.assertEqual(regressions(p95=12.5), ['item_list: p95 10.00 ms -> 12.50 ms'])
+        self.assertEqual(regressions(queries=2), [])
+        self.assertEqual(regressions(queries=4), ['item_list: 3 -> 4 queries'])
+        self.assertEqual(regressions(peak_memory_kb=1150), [])
+        self.assertEqual(regressions(peak_memory_kb=1300), ['item_list: peak memory 1000 KiB -> 1300 KiB'])
+        self.assertEqual(benchmark.compare(baseline, {'endpoints': {}}, threshold=0.2), [])
+
+        # Below min_delta_ms a relative jump is noise.
+        baseline['endpoints']['item_list']['p95'] = 0.5
+        self.assertEqual(regressions(p95=1.2), [])
+        self.assertEqual(regressions(p95=1.6), ['item_list: p95 0.50 ms -> 1.60 ms'])
+
+
+
+class ExplainQueriesTest(TestCase):
+    def explain(self, query, *args):
+        # One route running `query`, against the test database.
+        endpoints = mock.patch('rental_service.benchmark.endpoints',
+                               return_value=('token', [('route', 'get', '/', None)]))
+        call = mock.patch('rental_service.benchmark.call', side_effect=lambda *call_args: list(query.all()))
+        database = mock.patch('rental_service.management.commands.explain_queries.seeded_database',
+                              return_value=contextlib.nullcontext())
+        output = io.StringIO()
+        with endpoints, call, database:
+            call_command('explain_queries', *args, stdout=output)
+        return output.getvalue()
+
+    def test_full_scan_fails(self):
+        query = Message.objects.filter(message='unindexed')
+        with self.assertRaisesRegex(CommandError, 'route: rental_service_message'):
+            self.explain(query, '--fail-on-scan')
+        self.assertIn('full scan of rental_service_message', self.explain(query))
+        self.assertIn('No full table scans.', self.explain(query, '--fail-on-scan',
+                                                           '--allow-scan', 'rental_service_message'))
+
+    def test_index_lookup_passes(self):
+        query = Message.objects.filter(pk=uuid.uuid4())
+        self.assertIn('No full table scans.', self.explain(query, '--fail-on-scan'))
+
+
+class ConstraintTest(TestCase):
+    def setUp(self):
+        user = create_user('user')
+        category = Category.objects.create(name='category')
+        self.item = Item.objects.create(category=category, name='item', description='d', price=Decimal('9.99'),
+                                        image='images/item.png')
+        self.rental = Rental.objects.create(user=user, item=self.item, start_date=datetime.date(2026, 1, 1),
+                                            end_date=datetime.date(2026, 1, 3))
+
+    def test_rental_dates_ordered(self):
+        with transaction.atomic(), self.assertRaisesRegex(IntegrityError, 'rental_dates_ordered|CHECK'):
+            Rental.objects.filter(pk=self.rental.pk).update(end_date=datetime.date(2025, 12, 31))
+        Rental.objects.filter(pk=self.rental.pk).update(end_date=datetime.date(2026, 1, 1))
+
+    def test_item_price_non_negative(self):
+        with transaction.atomic(), self.assertRaisesRegex(IntegrityError, 'item_price_non_negative|CHECK'):
+            Item.objects.filter(pk=self.item.pk).update(price=Decimal('-0.01'))
+        Item.objects.filter(pk=self.item.pk).update(price=Decimal('0.00'))
+
+
+class ConstraintMigrationTest(TransactionTestCase):
+    before = [('rental_service', '0007_conversations')]
+    after = [('rental_service', '0008_query_indexes')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        self.latest = executor.loader.graph.leaf_nodes('rental_service')
+        executor.migrate(self.before)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.latest)
+
+    def test_bad_rows_are_repaired(self):
+        apps = MigrationExecutor(connection).loader.project_state(self.before).apps
+        User, Category, Item, Rental = (apps.get_model('rental_service', name)
+                                        for name in ('User', 'Category', 'Item', 'Rental'))
+        user = User.objects.create(username='user', phone_number='1', address='a', city='c', state='s',
+                                   zip_code='00-000')
+        category = Category.objects.create(name='category', path='')
+        Category.objects.filter(pk=category.pk).update(parent=category)
+        child = Category.objects.create(name='child', parent=category, path='')
+        item = Item.objects.create(category=child, name='item', description='d', price=Decimal('-1.00'),
+                                   image='images/item.png')
+        rental = Rental.objects.create(user=user, item=item, start_date=datetime.date(2026, 1, 5),
+                                       end_date=datetime.date(2026, 1, 1))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+        apps = executor.loader.project_state(self.after).apps
+        category = apps.get_model('rental_service', 'Category').objects.get(pk=category.pk)
+        self.assertIsNone(category.parent_id)
+        self.assertEqual(category.path, category.pk.hex + '/')
+        child = apps.get_model('rental_service', 'Category').objects.get(pk=child.pk)
+        self.assertEqual(child.path, category.path + child.pk.hex + '/')
+        self.assertEqual(apps.get_model('rental_service', 'Item').objects.get(pk=item.pk).price, Decimal('0.00'))
+        rental = apps.get_model('rental_service', 'Rental').objects.get(pk=rental.pk)
+        self.assertEqual((rental.start_date, rental.end_date), (datetime.date(2026, 1, 1), datetime.date(2026, 1, 5)))
+
+
+class UploadTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=self.media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.user = User.objects.create_user(
+            username='user', password='user', email='user@example.com', phone_number='1',
+            address='a', city='c', state='s', zip_code='00-000', first_name='a', last_name='b',
+        )
+        item = Item.objects.create(category=Category.objects.create(name='category'), name='item', description='d',
+                                   price=10, image='images/item.png')
+        rental = Rental.objects.create(user=self.user, item=item, start_date=datetime.date(2026, 1, 1),
+                                       end_date=datetime.date(2026, 1, 2))
+        self.safe_conduct = SafeConduct.objects.create(rental=rental)
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer %s' % AccessToken.for_user(self.user)
+
+    def append(self, upload, offset, data, **headers):
+        return self.client.patch(reverse('upload_detail', args=[upload['id']]), data,
+                                 content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+                                 **headers)
+
+    def test_resumed_upload_is_verified_and_attached_without_copying(self):
+        content = b'%PDF-1.4 scanned safe conduct'
+        response = self.client.post(reverse('upload_list'), {
+            'target': 'safe_conduct.document', 'object_id': str(self.safe_conduct.pk),
+            'filename': 'scan.pdf', 'size': len(content),
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        upload = response.json()
+        self.assertEqual(self.append(upload, 0, content[:10]).json()['offset'], 10)
+        # A retried chunk the server already has is refused with the offset to
+        # resume from.
+        response = self.append(upload, 0, content[:10])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 10))
+        bad = 'sha256 ' + base64.b64encode(hashlib.sha256(b'other').digest()).decode()
+        self.assertEqual(self.append(upload, 10, content[10:], HTTP_UPLOAD_CHECKSUM=bad).status_code, 400)
+        self.assertEqual(self.client.get(reverse('upload_detail', args=[upload['id']])).json()['offset'], 10)
+        good = 'sha256 ' + base64.b64encode(hashlib.sha256(content[10:]).digest()).decode()
+        response = self.append(upload, 10, content[10:], HTTP_UPLOAD_CHECKSUM=good)
+        self.assertEqual(response.json()['crc32'], '%08x' % zlib.crc32(content))
+
+        finalize = reverse('upload_finalize', args=[upload['id']])
+        response = self.client.post(finalize, {'crc32': '00000000'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(finalize, {'crc32': '%08x' % zlib.crc32(content)}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.safe_conduct.refresh_from_db()
+        self.assertEqual(self.safe_conduct.document.name, response.json()['name'])
+        self.assertEqual(self.safe_conduct.document.read(), content)
+        self.safe_conduct.document.close()
+        self.assertEqual(os.listdir(os.path.join(self.media.name, 'uploads', 'partial')), [])
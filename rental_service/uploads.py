@@ -0,0 +1,192 @@
+import base64
+import binascii
+import datetime
+import hashlib
+import os
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import Q
+from django.http import Http404
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from rental_service.models import Item, SafeConduct, Upload
+
+# Chunked, resumable uploads (the tus protocol's core, over the API's own
+# endpoints): a client starts an upload with its size, sends the bytes in
+# PATCH requests that name the offset they start at, asks for the offset
+# after a disconnect and carries on from there, then finalizes.
+#
+# Chunks are streamed from the request straight to a partial file in
+# UPLOAD_CHUNK_READ_SIZE pieces, never held whole in memory. The CRC-32 of
+# everything received is kept up to date in the row (unlike hashlib's state
+# it can be resumed from a number), so the whole file is verified at the end
+# without reading it again; a chunk can also carry its own SHA-256. The
+# finalized file is renamed to its final name, not copied, which needs a
+# storage with local paths such as the default FileSystemStorage.
+
+TARGETS = {
+    'item.image': (Item, 'image'),
+    'safe_conduct.document': (SafeConduct, 'document'),
+}
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Request body is too large.'
+    default_code = 'payload_too_large'
+
+
+class OffsetMismatch(Exception):
+    # The upload is elsewhere than the request assumed; `offset` is where it is.
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def partial_path(upload):
+    return default_storage.path('uploads/partial/%s' % upload.id.hex)
+
+
+def get_target(target, object_id):
+    model, field_name = TARGETS[target]
+    try:
+        return model.objects.get(pk=object_id), field_name
+    except model.DoesNotExist:
+        raise Http404
+
+
+def start(user, target, object_id, filename, size, crc32=None):
+    get_target(target, object_id)
+    upload = Upload.objects.create(user=user, target=target, object_id=object_id, filename=filename, size=size,
+                                   expected_crc32=crc32)
+    path = partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload
+
+
+def parse_checksum(header):
+    # Upload-Checksum: sha256 <base64 digest of the chunk>
+    if not header:
+        return None
+    algorithm, _, value = header.partition(' ')
+    if algorithm != 'sha256':
+        raise ValidationError({'checksum': ['Only sha256 chunk checksums are supported']})
+    try:
+        return base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise ValidationError({'checksum': ['Invalid base64 digest']})
+
+
+def claim(upload, offset):
+    # The conditional UPDATE is the lock: one append per upload at a time, and
+    # only at the offset the upload has reached. A claim left behind by a
+    # worker that died is taken over after UPLOAD_CLAIM_SECONDS.
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=settings.UPLOAD_CLAIM_SECONDS)
+    claimed = (Upload.objects.filter(pk=upload.pk, status=Upload.UPLOADING, offset=offset)
+               .filter(Q(claimed_by='') | Q(updated_at__lt=stale))
+               .update(claimed_by=token, updated_at=now))
+    if not claimed:
+        upload.refresh_from_db()
+        raise OffsetMismatch('Upload is not at this offset or is busy', upload.offset)
+    return token
+
+
+def append(upload, offset, length, stream, checksum=None):
+    # Returns the upload at its new offset. A chunk cut short by a disconnect
+    # still advances it by what arrived, unless it came with a checksum.
+    if length > settings.UPLOAD_MAX_CHUNK_SIZE:
+        raise PayloadTooLarge('Chunks may be at most %d bytes' % settings.UPLOAD_MAX_CHUNK_SIZE)
+    if offset + length > upload.size:
+        raise ValidationError({'offset': ['Chunk ends past the upload size of %d bytes' % upload.size]})
+    digest = parse_checksum(checksum)
+    token = claim(upload, offset)
+    crc32 = upload.crc32
+    received = 0
+    sha256 = hashlib.sha256()
+    try:
+        with open(partial_path(upload), 'r+b') as output:
+            output.seek(offset)
+            output.truncate()
+            while received < length:
+                try:
+                    data = stream.read(min(settings.UPLOAD_CHUNK_READ_SIZE, length - received))
+                except OSError:
+                    break
+                if not data:
+                    break
+                output.write(data)
+                crc32 = zlib.crc32(data, crc32)
+                sha256.update(data)
+                received += len(data)
+            if digest is not None and (received < length or sha256.digest() != digest):
+                received = 0
+                crc32 = upload.crc32
+                output.seek(offset)
+                output.truncate()
+            output.flush()
+            os.fsync(output.fileno())
+    finally:
+        Upload.objects.filter(pk=upload.pk, claimed_by=token).update(
+            offset=offset + received, crc32=crc32, claimed_by='', updated_at=timezone.now(),
+        )
+    upload.refresh_from_db()
+    if digest is not None and not received and length:
+        raise ValidationError({'checksum': ['Chunk checksum mismatch']})
+    return upload
+
+
+@transaction.atomic
+def finalize(upload, crc32=None):
+    # Attaches the finished file to its target. Repeating it is harmless.
+    upload = Upload.objects.select_for_update().get(pk=upload.pk)
+    if upload.status == Upload.DONE:
+        return upload
+    if upload.offset != upload.size or upload.claimed_by:
+        raise OffsetMismatch('Upload is incomplete', upload.offset)
+    expected = upload.expected_crc32 if crc32 is None else crc32
+    if expected is not None and expected != upload.crc32:
+        raise ValidationError({'crc32': ['Checksum mismatch, the upload has %08x' % upload.crc32]})
+    instance, field_name = get_target(upload.target, upload.object_id)
+    field = instance._meta.get_field(field_name)
+    path = partial_path(upload)
+    if isinstance(field, models.ImageField):
+        try:
+            with Image.open(path) as image:
+                image.verify()
+        except Exception:
+            raise ValidationError({'filename': ['Upload a valid image.']})
+    name = default_storage.get_available_name(field.generate_filename(instance, upload.filename),
+                                              max_length=field.max_length)
+    setattr(instance, field_name, name)
+    instance.save(update_fields=[field_name, 'updated_at'])
+    upload.status = Upload.DONE
+    upload.name = name
+    upload.save(update_fields=['status', 'name', 'updated_at'])
+    # Last, so that a failure before it rolls everything back.
+    os.makedirs(os.path.dirname(default_storage.path(name)), exist_ok=True)
+    os.replace(path, default_storage.path(name))
+    return upload
+
+
+def prune(before):
+    # Deletes the uploads last touched before `before`, and the partial files
+    # of the unfinished ones.
+    uploads = Upload.objects.filter(updated_at__lt=before)
+    for upload in uploads.filter(status=Upload.UPLOADING).only('pk').iterator():
+        try:
+            os.remove(partial_path(upload))
+        except FileNotFoundError:
+            pass
+    deleted, _ = uploads.delete()
+    return deleted
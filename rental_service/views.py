@@ -1,24 +1,50 @@
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, Http404
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django.shortcuts import render
 from dj_rest_auth.registration.views import RegisterView
 from rental_service.serializers import *
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rental_service.serializers import *
+from rental_service.pagination import KeysetListMixin, streaming_response
+from rental_service.availability import available_items
+from rental_service.categories import category_tree, in_subtree
+from rental_service.cache import cache_response
+from rental_service.signals import invalidate_instances, schedule_item_rollups
+from rental_service.images import ensure_variant
+from rental_service.documents import enqueue as enqueue_document
+from rental_service.search import facets as search_facets, filter_items, search_items
+from rental_service.rentals import TRANSITIONS, book, bulk_transition, invalidate_items, refresh_item_statuses
+from rental_service.messaging import send_message, start_conversation
+from rental_service.sync import changes
+from rental_service.rollups import utilisation
+from rental_service.pricing import quote
+from rental_service import uploads
+from rental_service.exports import EXPORTS, FORMATS, ExportUnavailable, encode as encode_export, horizon
+from rental_service.metrics import PrometheusRenderer, render as render_metrics
 from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
 
 class CustomRegisterView(RegisterView):
     serializer_class = CustomRegisterSerializer
 
 
-class UserViewSetList(APIView):
+class UserViewSetList(KeysetListMixin, APIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
     def get(self, request, format=None):
         users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        return self.list_response(request, users, UserValuesSerializer)
 
     def post(self, request, format=None):
         serializer = UserSerializer(data=request.data)
@@ -33,7 +59,7 @@ class UserViewSetDetail(APIView):
         try:
             return User.objects.get(pk=pk)
         except User.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+            raise Http404
 
     def get(self, request, pk, format=None):
         user = self.get_object(pk)
@@ -66,9 +92,10 @@ class CategoryViewSetList(APIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    @cache_response('category')
     def get(self, request, format=None):
-        categories = Category.objects.all()
-        serializer = CategorySerializer(categories, many=True)
+        categories = CategoryValuesSerializer.values(Category.objects.order_by('path'))
+        serializer = CategoryValuesSerializer(categories, many=True)
         return Response(serializer.data)
 
     def post(self, request, format=None):
@@ -79,14 +106,30 @@ class CategoryViewSetList(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ItemViewSetList(APIView):
+class CategoryTreeViewSetList(APIView):
+
+    @cache_response('category')
+    def get(self, request, format=None):
+        root = request.query_params.get('root')
+        if root is not None:
+            try:
+                root = Category.objects.get(pk=root)
+            except (Category.DoesNotExist, ValidationError):
+                raise Http404
+        serializer = CategorySerializer(category_tree(root=root), many=True)
+        return Response(serializer.data)
+
+
+class ItemViewSetList(KeysetListMixin, APIView):
     queryset = Item.objects.all()
     serializer_class = ItemSerializer
 
     def get(self, request, format=None):
-        items = Item.objects.all()
-        serializer = ItemSerializer(items, many=True)
-        return Response(serializer.data)
+        query = ItemListQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        items = filter_items(Item.objects.all(), **query.filters)
+        return self.list_response(request, items, query.serializer_class, query.validated_data['ordering'])
 
     def post(self, request, format=None):
         serializer = ItemSerializer(data=request.data)
@@ -96,17 +139,155 @@ class ItemViewSetList(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BulkAPIView(APIView):
+    # Validates a whole batch in one serializer pass (errors are reported per
+    # row, in input order) and writes it with one bulk query per batch_size rows.
+    model = None
+    serializer_class = None
+
+    def get_rows(self, request):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            raise ParseError('Expected a non-empty list of records')
+        if len(rows) > settings.BULK_MAX_RECORDS:
+            raise ParseError('At most %d records can be sent at once' % settings.BULK_MAX_RECORDS)
+        return rows
+
+    def post(self, request, format=None):
+        serializer = self.serializer_class(data=self.get_rows(request), many=True)
+        if serializer.is_valid():
+            with transaction.atomic():
+                serializer.save()
+            invalidate_instances(serializer.instance)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def patch(self, request, format=None):
+        rows = self.get_rows(request)
+        pk_field = self.model._meta.pk
+        pks = []
+        for row in rows:
+            try:
+                pks.append(pk_field.to_python(row['id']))
+            except (KeyError, TypeError, ValidationError):
+                pks.append(None)
+        with transaction.atomic():
+            instances = self.model.objects.select_for_update().in_bulk([pk for pk in pks if pk is not None])
+            missing = [{} if pk in instances else {'id': ['Not found.']} for pk in pks]
+            if any(missing):
+                return Response(missing, status=status.HTTP_400_BAD_REQUEST)
+            serializer = self.serializer_class([instances[pk] for pk in pks], data=rows, many=True, partial=True)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            serializer.save()
+        invalidate_instances(serializer.instance)
+        if self.model is Item:
+            schedule_item_rollups(serializer.instance)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def delete(self, request, format=None):
+        serializer = BulkDeleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        pks = serializer.validated_data['ids']
+        if len(pks) > settings.BULK_MAX_RECORDS:
+            raise ParseError('At most %d records can be sent at once' % settings.BULK_MAX_RECORDS)
+        with transaction.atomic():
+            deleted = self.delete_rows(self.model.objects.filter(pk__in=pks))
+        return Response({'deleted': deleted}, status=status.HTTP_200_OK)
+
+    def delete_rows(self, queryset):
+        deleted, _ = queryset.delete()
+        return deleted
+
+
+class ItemBulkViewSet(BulkAPIView):
+    model = Item
+    serializer_class = ItemBulkSerializer
+
+
+class RentalBulkViewSet(BulkAPIView):
+    model = Rental
+    serializer_class = RentalSerializer
+
+    def delete_rows(self, queryset):
+        item_ids = set(queryset.values_list('item_id', flat=True))
+        deleted = super().delete_rows(queryset)
+        invalidate_items(item_ids)
+        refresh_item_statuses(item_ids)
+        return deleted
+
+
+class RentalTransitionBulkViewSet(BulkAPIView):
+
+    def patch(self, request, format=None):
+        serializer = RentalTransitionSerializer(data=self.get_rows(request), many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        changed = bulk_transition([(row['id'], row['action']) for row in serializer.validated_data])
+        return Response({'changed': changed}, status=status.HTTP_200_OK)
+
+
+class ItemSearchViewSetList(APIView):
+
+    def get(self, request, format=None):
+        query = SearchQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = dict(query.validated_data)
+        limit, offset = params.pop('limit'), params.pop('offset')
+        items = search_items(params.pop('q'), **params)
+        page = items[offset:offset + limit]
+        serializer = ItemSerializer(page, many=True)
+        return Response({
+            'results': serializer.data,
+            'facets': search_facets(items, params.get('category')),
+        })
+
+
+class ItemAvailableViewSetList(KeysetListMixin, APIView):
+
+    def get(self, request, format=None):
+        query = AvailabilityQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        items = available_items(query.validated_data['from'], query.validated_data['to'],
+                                category=query.validated_data.get('category'))
+        return self.list_response(request, items, ItemValuesSerializer)
+
+
+class ImageVariantView(APIView):
+    # Serves a resized WebP variant of an item's image, rendering and storing
+    # it first if the background pool has not produced it yet. Only images
+    # some item refers to are rendered, so clients cannot make the server
+    # store variants of arbitrary files (or of variants).
+
+    def get(self, request, variant, name, format=None):
+        if variant not in settings.IMAGE_VARIANTS or not Item.objects.filter(image=name).exists():
+            raise Http404
+        try:
+            path = ensure_variant(name, variant)
+        except (OSError, SuspiciousFileOperation):
+            # Missing, truncated or otherwise unreadable images, including
+            # UnidentifiedImageError.
+            raise Http404
+        response = FileResponse(default_storage.open(path), content_type='image/webp')
+        patch_cache_control(response, public=True, max_age=settings.IMAGE_VARIANT_MAX_AGE, immutable=True)
+        return response
+
+
 class ItemViewSetDetail(APIView):
 
     def get_object(self, pk):
         try:
             return Item.objects.get(pk=pk)
         except Item.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+            raise Http404
 
+    @cache_response('item:{pk}')
     def get(self, request, pk, format=None):
         item = self.get_object(pk)
-        serializer = ItemSerializer(item)
+        serializer = ItemSerializer(item, fields=requested_fields(request, ItemSerializer))
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def put(self, request, pk, format=None):
@@ -131,18 +312,17 @@ class ItemViewSetDetail(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class RentalViewSetList(APIView):
+class RentalViewSetList(KeysetListMixin, APIView):
     queryset = Rental.objects.all()
 
     def get(self, request, format=None):
         rentals = Rental.objects.all()
-        serializer = RentalSerializer(rentals, many=True)
-        return Response(serializer.data)
+        return self.list_response(request, rentals, RentalValuesSerializer)
 
     def post(self, request, format=None):
         serializer = RentalSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            book(serializer)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -153,58 +333,97 @@ class RentalViewSetDetail(APIView):
         try:
             return Rental.objects.get(pk=pk)
         except Rental.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+            raise Http404
 
     def get(self, request, pk, format=None):
         rental = self.get_object(pk)
-        serializer = RentalSerializer(rental)
+        serializer = RentalSerializer(rental, fields=requested_fields(request, RentalSerializer))
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def put(self, request, pk, format=None):
         rental = self.get_object(pk)
         serializer = RentalSerializer(rental, data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            book(serializer)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk, format=None):
         rental = self.get_object(pk)
-        rental.delete()
+        with transaction.atomic():
+            rental.delete()
+            refresh_item_statuses([rental.item_id])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def patch(self, request, pk, format=None):
         rental = self.get_object(pk)
         serializer = RentalSerializer(rental, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            book(serializer)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class SafeConductViewSetList(APIView):
+class RentalTransitionViewSet(APIView):
+
+    def post(self, request, pk, action, format=None):
+        if action not in TRANSITIONS:
+            raise Http404
+        try:
+            rental = Rental.objects.get(pk=pk)
+        except Rental.DoesNotExist:
+            raise Http404
+        serializer = RentalSerializer(TRANSITIONS[action](rental))
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class SafeConductViewSetList(KeysetListMixin, APIView):
     queryset = SafeConduct.objects.all()
 
     def get(self, request, format=None):
         safe_conducts = SafeConduct.objects.all()
-        serializer = SafeConductSerializer(safe_conducts, many=True)
-        return Response(serializer.data)
+        return self.list_response(request, safe_conducts, SafeConductSerializer)
 
     def post(self, request, format=None):
         serializer = SafeConductSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            safe_conduct = serializer.save()
+            if not safe_conduct.document:
+                enqueue_document(safe_conduct)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SafeConductDocumentViewSet(APIView):
+
+    def post(self, request, pk, format=None):
+        try:
+            safe_conduct = SafeConduct.objects.get(pk=pk)
+        except SafeConduct.DoesNotExist:
+            raise Http404
+        job = enqueue_document(safe_conduct)
+        serializer = DocumentJobSerializer(job)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class DocumentJobViewSetDetail(APIView):
+
+    def get(self, request, pk, format=None):
+        try:
+            job = eager_load(DocumentJob.objects.all(), DocumentJobSerializer).get(pk=pk)
+        except DocumentJob.DoesNotExist:
+            raise Http404
+        serializer = DocumentJobSerializer(job)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 class SafeConductViewSetDetail(APIView):
 
     def get_object(self, pk):
         try:
             return SafeConduct.objects.get(pk=pk)
         except SafeConduct.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+            raise Http404
 
     def get(self, request, pk, format=None):
         safe_conduct = self.get_object(pk)
@@ -233,13 +452,13 @@ class SafeConductViewSetDetail(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MessageViewSetList(APIView):
+class MessageViewSetList(KeysetListMixin, APIView):
     queryset = Message.objects.all()
+    page_size = 100
 
     def get(self, request, format=None):
         messages = Message.objects.all()
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        return self.list_response(request, messages, MessageSerializer)
 
     def post(self, request, format=None):
         serializer = MessageSerializer(data=request.data)
@@ -249,13 +468,61 @@ class MessageViewSetList(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ConversationViewSetList(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        inbox = Participant.objects.filter(user=request.user).order_by('-last_message_at')
+        inbox = eager_load(inbox, InboxSerializer)[:settings.INBOX_SIZE]
+        serializer = InboxSerializer(inbox, many=True)
+        return Response(serializer.data)
+
+    def post(self, request, format=None):
+        serializer = ConversationSerializer(data=request.data)
+        if serializer.is_valid():
+            conversation = start_conversation(set(serializer.validated_data['participants']) | {request.user})
+            return Response(ConversationSerializer(conversation).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ConversationMessagesViewSetList(KeysetListMixin, APIView):
+    # Messages after ?cursor=, oldest first: the catch-up fetch for clients
+    # that reconnect to /ws/inbox/. Without pk, across all of the user's
+    # conversations.
+    permission_classes = [IsAuthenticated]
+    page_size = 100
+
+    def get_conversation(self, request, pk):
+        try:
+            return Conversation.objects.get(pk=pk, participant__user=request.user)
+        except Conversation.DoesNotExist:
+            raise Http404
+
+    def get(self, request, pk=None, format=None):
+        if pk is None:
+            messages = Message.objects.filter(conversation__participant__user=request.user)
+        else:
+            messages = Message.objects.filter(conversation=self.get_conversation(request, pk))
+        return self.list_response(request, messages, ConversationMessageSerializer)
+
+    def post(self, request, pk=None, format=None):
+        if pk is None:
+            raise Http404
+        conversation = self.get_conversation(request, pk)
+        serializer = ConversationMessageSerializer(data=request.data)
+        if serializer.is_valid():
+            message = send_message(conversation, request.user, serializer.validated_data['message'])
+            return Response(ConversationMessageSerializer(message).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 class MessageViewSetDetail(APIView):
 
     def get_object(self, pk):
         try:
             return Message.objects.get(pk=pk)
         except Message.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+            raise Http404
 
     def get(self, request, pk, format=None):
         message = self.get_object(pk)
@@ -299,14 +566,16 @@ class UserMessagesViewSetList(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CategoryItemsViewSetList(APIView):
+class CategoryItemsViewSetList(KeysetListMixin, APIView):
 
-    def get(self, request, format=None):
-        items = Item.objects.all()
-        serializer = ItemSerializer(items, many=True)
-        return Response(serializer.data)
+    def get(self, request, pk, format=None):
+        query = ItemListQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        items = filter_items(Item.objects.filter(in_subtree(pk)), **query.filters)
+        return self.list_response(request, items, query.serializer_class, query.validated_data['ordering'])
 
-    def post(self, request, format=None):
+    def post(self, request, pk=None, format=None):
         serializer = ItemSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
@@ -316,9 +585,13 @@ class CategoryItemsViewSetList(APIView):
 
 class ItemRentViewSetList(APIView):
 
+    @cache_response('item:{pk}', 'rentals:{pk}')
     def get(self, request, pk, format=None):
-        rents = Rental.objects.filter(item=pk)
-        serializer = ItemRentSerializer(rents, many=True)
+        try:
+            item = eager_load(Item.objects.all(), ItemRentSerializer).get(pk=pk)
+        except Item.DoesNotExist:
+            raise Http404
+        serializer = ItemRentSerializer(item)
         return Response(serializer.data)
 
     def post(self, request, format=None):
@@ -327,3 +600,144 @@ class ItemRentViewSetList(APIView):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SyncView(APIView):
+    # ?since=<cursor of the previous response>; repeat while `more` is true.
+    # Rentals and messages are included for authenticated users only.
+
+    def get(self, request, format=None):
+        query = SyncQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(changes(request.user, **query.validated_data))
+
+
+class ExportView(APIView):
+    # /api/export/<rentals|items|users>.<csv|parquet|arrow>, streamed. With
+    # ?since= only rows changed after it are exported; X-Export-Until is the
+    # `since` of the next incremental export. Under ASGI the body is spooled to
+    # a temporary file before it is sent (see pagination.streaming_response).
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name, extension, format=None):
+        if name not in EXPORTS or extension not in FORMATS:
+            raise Http404
+        query = ExportQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        until = horizon()
+        try:
+            content = encode_export(name, extension, query.validated_data.get('since'), until)
+        except ExportUnavailable as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        response = streaming_response(request, content, FORMATS[extension])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (name, extension)
+        response['X-Export-Until'] = until.isoformat()
+        return response
+
+
+class QuoteView(APIView):
+    # Prices a whole cart at once: a list of {item, start_date, end_date}.
+
+    def post(self, request, format=None):
+        if not isinstance(request.data, list):
+            raise ParseError('Expected a list of items to quote')
+        if len(request.data) > settings.QUOTE_MAX_LINES:
+            raise ParseError('At most %d items can be quoted at once' % settings.QUOTE_MAX_LINES)
+        serializer = QuoteLineSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        lines, total = quote(serializer.validated_data)
+        return Response({'lines': QuoteLineSerializer(lines, many=True).data, 'total': str(total)})
+
+
+def offset_conflict(exc):
+    return Response({'detail': str(exc), 'offset': exc.offset}, status=status.HTTP_409_CONFLICT)
+
+
+class UploadViewSetList(APIView):
+    # Starts a chunked upload of an item image or a safe conduct document;
+    # see rental_service.uploads.
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = UploadStartSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        upload = uploads.start(request.user, **serializer.validated_data)
+        return Response(UploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+class UploadViewSetDetail(APIView):
+    # GET reports the offset to resume from. PATCH appends the raw request
+    # body at the Upload-Offset header, optionally verified against an
+    # Upload-Checksum: sha256 <base64> header.
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self, request, pk):
+        try:
+            return Upload.objects.get(pk=pk, user=request.user)
+        except Upload.DoesNotExist:
+            raise Http404
+
+    def get(self, request, pk, format=None):
+        return Response(UploadSerializer(self.get_object(request, pk)).data)
+
+    def patch(self, request, pk, format=None):
+        upload = self.get_object(request, pk)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            raise ParseError('Upload-Offset and Content-Length headers are required')
+        # The body is read straight from the request, never through request.data.
+        try:
+            upload = uploads.append(upload, offset, length, request._request, request.headers.get('Upload-Checksum'))
+        except uploads.OffsetMismatch as exc:
+            return offset_conflict(exc)
+        return Response(UploadSerializer(upload).data)
+
+
+class UploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk, format=None):
+        try:
+            upload = Upload.objects.get(pk=pk, user=request.user)
+        except Upload.DoesNotExist:
+            raise Http404
+        serializer = UploadFinalizeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload = uploads.finalize(upload, serializer.validated_data.get('crc32'))
+        except uploads.OffsetMismatch as exc:
+            return offset_conflict(exc)
+        return Response(UploadSerializer(upload).data)
+
+
+class UtilisationReportView(APIView):
+    # Utilisation and revenue per category over the last ?days= days (90 by
+    # default), read from the daily rollups; ?category= limits it to a subtree.
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        query = UtilisationQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        days = query.validated_data['days']
+        end = query.validated_data.get('to') or timezone.localdate()
+        start = end - datetime.timedelta(days=days - 1)
+        rows = utilisation(start, end, category=query.validated_data.get('category'))
+        serializer = UtilisationSerializer(rows, many=True, context={'days': days})
+        return Response({'from': start, 'to': end, 'categories': serializer.data})
+
+
+class MetricsView(APIView):
+    # Prometheus text exposition of the histograms kept by PerformanceMiddleware.
+    authentication_classes = []
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request, format=None):
+        return Response(render_metrics())